@@ -0,0 +1,192 @@
+"""
+Cantine.OS - Batch Menu Generation
+Solves menus for every établissement of a commune in a process pool
+
+Usage:
+    python -m app.batch                       # all établissements, 5 days
+    python -m app.batch --ids etab_001,etab_002 --jours 10 --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional
+
+from .solver import MenuSolver, CanteenConfig, ConviveProfile, Recipe, load_recipes
+from .storage import open_storage
+
+
+DATA_DIR = Path(__file__).parent.parent.parent / "data"
+
+# Catalog shared by all solves of a worker process (set once by _init_worker)
+_worker_catalog = {"recipes": None, "gemrcn": None}
+
+# One pool per process, reused by every batch while the catalog is unchanged.
+# Workers are spawned, not forked: the API process runs CP-SAT, ledger and
+# feedback threads, and forking a multithreaded process can deadlock
+_pool = {"executor": None, "catalog_version": None}
+_pool_lock = threading.Lock()
+
+
+def etablissement_to_config(etab: dict, nb_jours: int = 5) -> CanteenConfig:
+    """Build a solver config from an etablissements.json entry."""
+    priorites = etab.get("priorites", {})
+    return CanteenConfig(
+        nom=etab.get("nom", etab.get("id", "")),
+        budget_max_par_repas=etab.get("budget_max_par_repas", 2.0),
+        nb_jours=nb_jours,
+        convives=[
+            ConviveProfile(
+                label=c.get("label", ""),
+                age_min=c.get("age_min", 6),
+                age_max=c.get("age_max", 11),
+                effectif=c.get("effectif", 0),
+                grammages={}
+            )
+            for c in etab.get("convives", [])
+        ],
+        priorite_carbone=priorites.get("carbone", 0.3),
+        priorite_local=priorites.get("local", 0.3),
+        priorite_budget=priorites.get("budget", 0.4),
+        equipement_disponible=etab.get("equipement_disponible") or []
+    )
+
+
+def _init_worker(recipes: List[Recipe], gemrcn: dict):
+    _worker_catalog["recipes"] = recipes
+    _worker_catalog["gemrcn"] = gemrcn
+
+
+def _solve_etablissement(etab: dict, nb_jours: int, max_time_in_seconds: float,
+                         num_search_workers: int) -> Dict:
+    start = time.perf_counter()
+    result = {"etablissement_id": etab.get("id"), "nom": etab.get("nom")}
+    try:
+        config = etablissement_to_config(etab, nb_jours)
+        solver = MenuSolver(config, _worker_catalog["recipes"], _worker_catalog["gemrcn"])
+        menu = solver.solve(max_time_in_seconds=max_time_in_seconds, num_search_workers=num_search_workers)
+        if menu is None:
+            result["statut"] = "infaisable"
+            result["erreur"] = "Impossible de générer un menu avec ces contraintes."
+        else:
+            result["statut"] = "succes"
+            result["menu"] = menu
+    except Exception as e:
+        result["statut"] = "echec"
+        result["erreur"] = str(e)
+    result["duree_s"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def _get_pool(recipes: List[Recipe], gemrcn: dict, catalog_version: Hashable) -> ProcessPoolExecutor:
+    """The process pool, (re)started with the catalog when its version changes."""
+    with _pool_lock:
+        if _pool["executor"] is None or _pool["catalog_version"] != catalog_version:
+            if _pool["executor"] is not None:
+                # Batches already submitted finish on the old workers
+                _pool["executor"].shutdown(wait=False)
+            _pool["executor"] = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(recipes, gemrcn))
+            _pool["catalog_version"] = catalog_version
+        return _pool["executor"]
+
+
+def generate_batch(etablissements: List[dict], recipes: List[Recipe], gemrcn: dict,
+                   nb_jours: int = 5, max_workers: Optional[int] = None,
+                   max_time_in_seconds: float = 30.0, catalog_version: Hashable = None) -> Dict:
+    """
+    Solve one menu per établissement in parallel.
+    The worker processes receive the parsed catalog once and are kept for the
+    next batches with the same `catalog_version` (None: a catalog that never
+    changes, as in the CLI). At most `max_workers` solves run at a time, and
+    CP-SAT threads are split between them so that the cores are not
+    oversubscribed.
+    """
+    start = time.perf_counter()
+    cpus = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers or cpus, cpus, len(etablissements) or 1))
+    num_search_workers = max(1, cpus // max_workers)
+
+    pool = _get_pool(recipes, gemrcn, catalog_version)
+    results = []
+    waiting = iter(etablissements)
+    running = set()
+    try:
+        while True:
+            for etab in waiting:
+                running.add(pool.submit(_solve_etablissement, etab, nb_jours, max_time_in_seconds,
+                                        num_search_workers))
+                if len(running) >= max_workers:
+                    break
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            results.extend(future.result() for future in done)
+    except BrokenProcessPool:
+        # A worker died: start a fresh pool for the next batch
+        with _pool_lock:
+            if _pool["executor"] is pool:
+                _pool["executor"] = None
+        raise
+
+    order = {etab.get("id"): i for i, etab in enumerate(etablissements)}
+    results.sort(key=lambda r: order.get(r["etablissement_id"], 0))
+
+    wall_time = time.perf_counter() - start
+    solve_time = sum(r["duree_s"] for r in results)
+    return {
+        "nb_etablissements": len(results),
+        "nb_succes": sum(1 for r in results if r["statut"] == "succes"),
+        "nb_workers": max_workers,
+        "nb_jours": nb_jours,
+        "duree_totale_s": round(wall_time, 3),
+        "duree_cumulee_s": round(solve_time, 3),
+        "acceleration": round(solve_time / wall_time, 2) if wall_time > 0 else None,
+        "resultats": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Génère les menus de tous les établissements")
+    parser.add_argument("--ids", default="", help="IDs d'établissements séparés par des virgules (défaut: tous)")
+    parser.add_argument("--jours", type=int, default=5, help="Nombre de jours par menu")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de processus (défaut: nb de coeurs)")
+    parser.add_argument("--temps-max", type=float, default=30.0, help="Temps max de résolution par établissement (s)")
+    parser.add_argument("--out", default="", help="Fichier JSON de sortie")
+    args = parser.parse_args()
+
+    etablissements = open_storage(DATA_DIR).all("etablissements")
+    if args.ids:
+        wanted = set(args.ids.split(","))
+        etablissements = [e for e in etablissements if e.get("id") in wanted]
+
+    recipes = load_recipes(DATA_DIR / "recettes.json")
+    with open(DATA_DIR / "gemrcn_constraints.json", "r", encoding="utf-8") as f:
+        gemrcn = json.load(f)
+
+    report = generate_batch(etablissements, recipes, gemrcn, nb_jours=args.jours,
+                            max_workers=args.workers, max_time_in_seconds=args.temps_max)
+
+    print("\n" + "=" * 60)
+    for r in report["resultats"]:
+        status = "✅" if r["statut"] == "succes" else "❌"
+        print(f"{status} {r['etablissement_id']} {r['nom']}: {r['statut']} ({r['duree_s']}s)")
+    print("-" * 60)
+    print(f"{report['nb_succes']}/{report['nb_etablissements']} menus générés en {report['duree_totale_s']}s "
+          f"({report['nb_workers']} processus, accélération x{report['acceleration']})")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 Rapport sauvegardé: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Cantine.OS - Recipe Catalog
+Columnar view of recettes.json: numeric fields in typed arrays, tags,
+equipment and months as bitmasks, and a binary snapshot that is
+memory-mapped on the next start instead of re-parsing the JSON
+"""
+
+import json
+import mmap
+import os
+import sys
+import tempfile
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .result_cache import file_digest
+from .solver import Recipe
+
+
+# Numeric columns: Recipe field -> key in recettes.json ("nutrition" = nutrition_par_portion)
+NUMERIC_FIELDS = {
+    "cout_portion_euro": None,
+    "co2_kg_portion": None,
+    "proteines_g": "nutrition",
+    "lipides_g": "nutrition",
+    "glucides_g": "nutrition",
+    "fer_mg": "nutrition",
+    "calcium_mg": "nutrition",
+    "fibres_g": "nutrition",
+}
+
+FLAG_VEGETARIEN = 1
+FLAG_BIO = 2
+FLAG_LOCAL = 4
+
+SNAPSHOT_MAGIC = b"CANTCAT1"
+SNAPSHOT_NAME = "recettes.catalog"
+
+
+class StringColumn:
+    """UTF-8 strings back to back: string i is blob[offsets[i]:offsets[i + 1]], decoded on access."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+
+class MaskColumn:
+    """
+    Per-recipe bitmask over `vocab`, stored as `width` 64-bit words per
+    recipe, plus the vocabulary codes in file order (codes[offsets[i]:offsets[i + 1]])
+    so that names() gives back each recipe's list as written.
+    """
+
+    def __init__(self, vocab: List[str], words, width: int, codes, offsets):
+        self.vocab = vocab
+        self.words = words
+        self.width = width
+        self.codes = codes
+        self.offsets = offsets
+        self.bit = {name: b for b, name in enumerate(vocab)}
+
+    def mask(self, i: int) -> int:
+        mask = 0
+        for w in range(self.width):
+            mask |= self.words[i * self.width + w] << (64 * w)
+        return mask
+
+    def names(self, i: int) -> List[str]:
+        return [self.vocab[code] for code in self.codes[self.offsets[i]:self.offsets[i + 1]]]
+
+    def bits(self, names: Sequence[str]) -> int:
+        mask = 0
+        for name in names:
+            if name in self.bit:
+                mask |= 1 << self.bit[name]
+        return mask
+
+
+def pack_masks(vocab: List, rows: List[List]) -> MaskColumn:
+    """MaskColumn of each row's names, the vocabulary growing in first-seen order."""
+    bit = {name: b for b, name in enumerate(vocab)}
+    masks = []
+    codes = array("H")
+    offsets = array("Q", [0])
+    for names in rows:
+        mask = 0
+        for name in names:
+            if name not in bit:
+                bit[name] = len(vocab)
+                vocab.append(name)
+            mask |= 1 << bit[name]
+            codes.append(bit[name])
+        masks.append(mask)
+        offsets.append(len(codes))
+    width = max(1, (len(vocab) + 63) // 64)
+    words = array("Q", bytes(8 * width * len(rows)))
+    for i, mask in enumerate(masks):
+        for w in range(width):
+            words[i * width + w] = mask >> (64 * w) & 0xFFFFFFFFFFFFFFFF
+    return MaskColumn(vocab, words, width, codes, offsets)
+
+
+class RecipeCatalog:
+    """
+    The recipe catalog as columns: recipe i is row i of every column.
+    Built from recettes.json (from_json) or mapped from a snapshot
+    (load_snapshot); recipes() materializes the Recipe objects the solver
+    uses, once per catalog.
+    """
+
+    def __init__(self, ids, noms, type_vocab: List[str], type_codes, numeric: Dict[str, Sequence[float]],
+                 flags, tags: MaskColumn, equipement: MaskColumn, months: MaskColumn, ingredients):
+        self.ids = ids
+        self.noms = noms
+        self.type_vocab = type_vocab
+        self.type_codes = type_codes
+        self.numeric = numeric
+        self.flags = flags
+        self.tags = tags
+        self.equipement = equipement
+        self.months = months  # bit m - 1 = in season in month m
+        self._ingredients = ingredients  # list of lists, or StringColumn of JSON
+        self.digest: Optional[str] = None  # content digest of the source file (set by CatalogStore)
+        self._recipes: Optional[List[Recipe]] = None
+        self._positions: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    @classmethod
+    def from_json(cls, path: Path) -> "RecipeCatalog":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        type_vocab: List[str] = []
+        type_bit: Dict[str, int] = {}
+        type_codes = array("B")
+        numeric = {name: array("d") for name in NUMERIC_FIELDS}
+        flags = array("B")
+        for item in data:
+            if item["type"] not in type_bit:
+                type_bit[item["type"]] = len(type_vocab)
+                type_vocab.append(item["type"])
+            type_codes.append(type_bit[item["type"]])
+            nutrition = item.get("nutrition_par_portion", {})
+            for name, section in NUMERIC_FIELDS.items():
+                numeric[name].append((nutrition if section else item).get(name, 0) or 0)
+            flags.append((FLAG_VEGETARIEN if item.get("vegetarien") else 0)
+                         | (FLAG_BIO if item.get("bio") else 0)
+                         | (FLAG_LOCAL if item.get("local") else 0))
+        return cls(
+            ids=[item["id"] for item in data],
+            noms=[item["nom"] for item in data],
+            type_vocab=type_vocab,
+            type_codes=type_codes,
+            numeric=numeric,
+            flags=flags,
+            tags=pack_masks([], [item.get("tags", []) for item in data]),
+            equipement=pack_masks([], [item.get("equipement", []) for item in data]),
+            months=pack_masks(list(range(1, 13)), [item.get("mois_saison", []) for item in data]),
+            ingredients=[item.get("ingredients", []) for item in data],
+        )
+
+    # --- Row access ----------------------------------------------------------
+
+    def position(self, recipe_id: str) -> Optional[int]:
+        if self._positions is None:
+            self._positions = {rid: i for i, rid in enumerate(self.ids)}
+        return self._positions.get(recipe_id)
+
+    def type(self, i: int) -> str:
+        return self.type_vocab[self.type_codes[i]]
+
+    def ingredients(self, i: int) -> List[Dict]:
+        if isinstance(self._ingredients, StringColumn):
+            return json.loads(self._ingredients[i])
+        return self._ingredients[i]
+
+    def recipe(self, i: int) -> Recipe:
+        flags = self.flags[i]
+        return Recipe(
+            id=self.ids[i],
+            nom=self.noms[i],
+            type=self.type(i),
+            vegetarien=bool(flags & FLAG_VEGETARIEN),
+            bio=bool(flags & FLAG_BIO),
+            local=bool(flags & FLAG_LOCAL),
+            **{name: column[i] for name, column in self.numeric.items()},
+            tags=self.tags.names(i),
+            equipement=self.equipement.names(i),
+            mois_saison=self.months.names(i),
+            ingredients=self.ingredients(i),
+        )
+
+    def recipes(self) -> List[Recipe]:
+        """Recipe objects of the whole catalog (built once; the same list on every call)."""
+        with self._lock:
+            if self._recipes is None:
+                self._recipes = [self.recipe(i) for i in range(len(self))]
+            return self._recipes
+
+    # --- Snapshot ------------------------------------------------------------
+
+    def save_snapshot(self, path: Path, source: Dict):
+        """
+        Write the columns to a binary file: a JSON header (vocabularies,
+        `source` stamp of the JSON file, section offsets) then every column,
+        8-byte aligned, in native byte order. Written then renamed.
+        """
+        ingredients = self._ingredients
+        if not isinstance(ingredients, StringColumn):
+            ingredients = [json.dumps(row, ensure_ascii=False, separators=(",", ":")) for row in ingredients]
+        sections = {
+            **{f"num.{name}": pack_array(column, "d") for name, column in self.numeric.items()},
+            "flags": pack_array(self.flags, "B"),
+            "types": pack_array(self.type_codes, "B"),
+            "months": pack_array(self.months.words, "Q"),
+            "months.codes": pack_array(self.months.codes, "H"),
+            "months.offsets": pack_array(self.months.offsets, "Q"),
+            "tags": pack_array(self.tags.words, "Q"),
+            "tags.codes": pack_array(self.tags.codes, "H"),
+            "tags.offsets": pack_array(self.tags.offsets, "Q"),
+            "equipement": pack_array(self.equipement.words, "Q"),
+            "equipement.codes": pack_array(self.equipement.codes, "H"),
+            "equipement.offsets": pack_array(self.equipement.offsets, "Q"),
+        }
+        for name, column in (("ids", self.ids), ("noms", self.noms), ("ingredients", ingredients)):
+            blob, offsets = pack_strings(column)
+            sections[f"{name}.blob"] = blob
+            sections[f"{name}.offsets"] = offsets
+
+        layout = {}
+        offset = 0
+        for name, (typecode, data) in sections.items():
+            layout[name] = [offset, len(data), typecode]
+            offset += (len(data) + 7) // 8 * 8
+        header = json.dumps({
+            "byteorder": sys.byteorder,
+            "count": len(self),
+            "source": source,
+            "types": self.type_vocab,
+            "tags": self.tags.vocab,
+            "tags_words": self.tags.width,
+            "equipements": self.equipement.vocab,
+            "equipement_words": self.equipement.width,
+            "months": self.months.vocab,
+            "months_words": self.months.width,
+            "numeric": list(self.numeric),
+            "sections": layout,
+        }, ensure_ascii=False).encode("utf-8")
+        header += b" " * (-(len(SNAPSHOT_MAGIC) + 8 + len(header)) % 8)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for _, data in sections.values():
+                f.write(data)
+                f.write(bytes(-len(data) % 8))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_snapshot(cls, path: Path) -> Tuple["RecipeCatalog", Dict]:
+        """
+        Map a snapshot: columns are views on the mapped file (nothing is
+        copied, strings are decoded on access). Returns (catalog, source stamp).
+        Raises ValueError if the file is not a snapshot of this machine's byte order.
+        """
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} n'est pas un instantané du catalogue")
+        start = len(SNAPSHOT_MAGIC) + 8
+        header_size = int.from_bytes(view[len(SNAPSHOT_MAGIC):start], "little")
+        header = json.loads(bytes(view[start:start + header_size]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} a été écrit sur une machine d'un autre boutisme")
+        base = start + header_size
+
+        def section(name: str):
+            offset, size, typecode = header["sections"][name]
+            return view[base + offset:base + offset + size].cast(typecode)
+
+        def strings(name: str) -> StringColumn:
+            return StringColumn(section(f"{name}.blob"), section(f"{name}.offsets"))
+
+        def masks(name: str, vocab: str) -> MaskColumn:
+            return MaskColumn(header[vocab], section(name), header[f"{name}_words"],
+                              section(f"{name}.codes"), section(f"{name}.offsets"))
+
+        catalog = cls(
+            ids=strings("ids"),
+            noms=strings("noms"),
+            type_vocab=header["types"],
+            type_codes=section("types"),
+            numeric={name: section(f"num.{name}") for name in header["numeric"]},
+            flags=section("flags"),
+            tags=masks("tags", "tags"),
+            equipement=masks("equipement", "equipements"),
+            months=masks("months", "months"),
+            ingredients=strings("ingredients"),
+        )
+        catalog._mapped = mapped  # keeps the mapping alive as long as the catalog
+        return catalog, header["source"]
+
+
+def pack_array(column, typecode: str) -> Tuple[str, bytes]:
+    if isinstance(column, memoryview):
+        return typecode, column.tobytes()
+    return typecode, array(typecode, column).tobytes()
+
+
+def pack_strings(column) -> Tuple[Tuple[str, bytes], Tuple[str, bytes]]:
+    """(blob, offsets) sections of a string column."""
+    if isinstance(column, StringColumn):
+        return ("B", bytes(column.blob)), pack_array(column.offsets, "Q")
+    encoded = [value.encode("utf-8") for value in column]
+    offsets = array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return ("B", b"".join(encoded)), ("Q", offsets.tobytes())
+
+
+class CatalogStore:
+    """
+    recettes.json as a RecipeCatalog, shared between requests. The file is
+    only hashed when its (mtime, size) stamp changes, and the catalog only
+    rebuilt when its content did. With `snapshot_dir`, every build is saved
+    as a snapshot, which the next process maps instead of parsing the JSON.
+    """
+
+    def __init__(self, path: Path, snapshot_dir: Optional[Path] = None):
+        self.path = Path(path)
+        self.snapshot_path = Path(snapshot_dir) / SNAPSHOT_NAME if snapshot_dir is not None else None
+        self.stamp = None
+        self.digest: Optional[str] = None
+        self.catalog: Optional[RecipeCatalog] = None
+        self.builds = 0
+        self.snapshot_loads = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> RecipeCatalog:
+        st = self.path.stat()
+        stamp = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            if stamp == self.stamp:
+                return self.catalog
+            if self.catalog is None and self._load_snapshot(stamp):
+                return self.catalog
+            digest = file_digest(self.path)
+            if digest != self.digest or self.catalog is None:
+                self.catalog = RecipeCatalog.from_json(self.path)
+                self.catalog.digest = digest
+                self.digest = digest
+                self.builds += 1
+                if self.snapshot_path is not None:
+                    self.catalog.save_snapshot(self.snapshot_path, {"stamp": stamp, "digest": digest})
+            self.stamp = stamp
+            return self.catalog
+
+    def _load_snapshot(self, stamp: List[int]) -> bool:
+        # Caller holds self._lock
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return False
+        try:
+            catalog, source = RecipeCatalog.load_snapshot(self.snapshot_path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"Catalog snapshot ignored: {e}")
+            return False
+        if source.get("stamp") != stamp and source.get("digest") != file_digest(self.path):
+            return False
+        catalog.digest = source["digest"]
+        self.catalog = catalog
+        self.digest = source["digest"]
+        self.stamp = stamp
+        self.snapshot_loads += 1
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "recettes": len(self.catalog) if self.catalog is not None else 0,
+                "reconstructions": self.builds,
+                "chargements_instantane": self.snapshot_loads,
+                "empreinte": self.digest,
+            }
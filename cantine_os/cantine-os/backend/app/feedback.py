@@ -0,0 +1,163 @@
+"""
+Cantine.OS - Feedback Ingestion
+QR-code ratings are taken in memory and written to storage in batches,
+with running per-date sums so a rating never rescans the others
+"""
+
+import atexit
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .storage import Storage
+
+
+class FeedbackBuffer:
+    """
+    Write-behind buffer in front of the "ratings" and "menu_scores"
+    collections. submit() gives the rating a random id, updates the
+    [sum, count] of its menu date and queues it: O(1), no I/O. A background thread writes
+    the queue in one transaction every `flush_interval` seconds, or as soon
+    as `flush_every` ratings are waiting, together with the menu_scores of
+    the dates it touched. A crash loses at most that window; readers call
+    flush() first so they always see every rating taken. With nothing
+    queued, a flush only catches up with the ratings of other processes, so
+    the averages submit() returns lag them by at most `flush_interval`.
+
+    Ratings other processes stored since the last flush are read back from
+    the storage cursor (Storage.since) and counted in before the scores are
+    written, so every date's totals include them: O(new ratings).
+    """
+
+    def __init__(self, storage: Storage, flush_every: int = 500, flush_interval: float = 0.5):
+        self.storage = storage
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()  # pending list and sums
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._wake = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self.pending: List[Dict] = []
+        self.dirty_dates = set()
+        self.by_date: Dict[str, List[int]] = {}  # menu_date -> [sum, count], stored and pending
+        self.cursor: Optional[int] = None  # Storage.since() cursor after the ratings counted
+        self.stats = {"notes": 0, "flushs": 0, "resynchronisations": 0}
+        self._version = None  # storage version of "ratings" when last caught up
+        stored, self.cursor = storage.since("ratings")
+        self._count(stored)
+
+    def _count(self, ratings: List[Dict]) -> set:
+        # Caller holds self._lock; returns the dates counted
+        for rating in ratings:
+            totals = self.by_date.setdefault(rating.get("menu_date"), [0, 0])
+            totals[0] += rating.get("rating", 0)
+            totals[1] += 1
+        return {rating.get("menu_date") for rating in ratings}
+
+    def submit(self, menu_date: str, rating: int, comment: Optional[str] = "") -> Dict:
+        """Queue a rating; returns it with its id and the new average and count of its date."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            new_rating = {
+                "id": f"rating_{uuid.uuid4().hex[:12]}",
+                "menu_date": menu_date,
+                "rating": rating,
+                "comment": comment,
+                "timestamp": now
+            }
+            self.pending.append(new_rating)
+            self.dirty_dates.add(menu_date)
+            totals = self.by_date.setdefault(menu_date, [0, 0])
+            totals[0] += rating
+            totals[1] += 1
+            score, count = round(totals[0] / totals[1], 2), totals[1]
+            self.stats["notes"] += 1
+            waiting = len(self.pending)
+        if self._flusher is None:
+            self._start()
+        if waiting >= self.flush_every:
+            self._wake.set()
+        return {"rating": new_rating, "popularity_score": score, "total_ratings": count}
+
+    def _start(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="feedback", daemon=True)
+            self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Keep the ratings queued, retry at the next tick
+                print(f"⚠️ Écriture des notes impossible: {e}")
+
+    def _catch_up(self):
+        # Caller holds self._flush_lock and self._lock; nothing is pending
+        if self.cursor is None:
+            return  # the next flush recounts everything
+        version = self.storage.version("ratings")
+        if version == self._version:
+            return
+        others = self.storage.since("ratings", self.cursor)
+        if others is None:
+            self.by_date = {}
+            others = self.storage.since("ratings")
+        stored, self.cursor = others
+        self._count(stored)
+        self._version = version
+
+    def flush(self):
+        """Write the queued ratings and the scores of their dates in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                if not self.pending:
+                    self._catch_up()
+                    return
+                batch = self.pending
+                dates = self.dirty_dates
+                self.pending, self.dirty_dates = [], set()
+            try:
+                with self.storage.transaction():
+                    others = self.storage.since("ratings", self.cursor) if self.cursor is not None else None
+                    with self._lock:
+                        if others is None:
+                            # First flush, or the ratings were rewritten: count them all again
+                            stored, cursor = self.storage.since("ratings")
+                            self.by_date = {}
+                            dates |= self._count(stored + batch + self.pending)
+                            self.stats["resynchronisations"] += self.cursor is not None
+                        else:
+                            # Ratings other processes stored since the last flush, whatever their dates
+                            stored, cursor = others
+                            if stored:
+                                dates |= self._count(stored)
+                                self.stats["resynchronisations"] += 1
+                        scores = {d: (round(self.by_date[d][0] / self.by_date[d][1], 2), self.by_date[d][1])
+                                  for d in dates if d in self.by_date}
+                    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    for rating in batch:
+                        self.storage.add("ratings", rating)
+                    for menu_date, (score, count) in scores.items():
+                        self.storage.put("menu_scores", {
+                            "score": score,
+                            "total_ratings": count,
+                            "last_updated": now
+                        }, key=menu_date)
+                    cursor = self.storage.since("ratings", cursor)[1]
+            except BaseException:
+                with self._lock:
+                    self.pending = batch + self.pending
+                    self.dirty_dates |= dates
+                    # by_date may hold ratings the cursor does not cover yet: recount at the next flush
+                    self.cursor = None
+                raise
+            with self._lock:
+                self.cursor = cursor
+                self.stats["flushs"] += 1
@@ -0,0 +1,187 @@
+"""
+Cantine.OS - Cost / CO2 / Local Pareto Frontier
+Epsilon-constraint exploration of the trade-off between menu cost, carbon
+footprint and local share, one CP-SAT solve per point in parallel threads
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from itertools import product
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from ortools.sat.python import cp_model
+
+from .lru import LRUCache
+from .solver import MenuSolver, CanteenConfig, Recipe
+
+
+def config_hash(config: CanteenConfig, catalog_version: Hashable = None) -> str:
+    """
+    Canonical hash of everything a frontier depends on.
+    Objective priorities are left out: the frontier is the same for any weights.
+    """
+    data = asdict(config)
+    for key in ("priorite_carbone", "priorite_local", "priorite_budget", "priorite_popularite"):
+        data.pop(key)
+    data["equipement_disponible"] = sorted(data.get("equipement_disponible") or [])
+    data["catalog_version"] = catalog_version
+    payload = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def non_dominated(points: List[Dict]) -> List[Dict]:
+    """Keep the points no other point beats on cost, CO2 and local share (duplicates removed)."""
+    def key(p):
+        return (p["cout_total"], p["co2_total_kg"], -p["pct_local"])
+
+    front = []
+    for p in sorted(points, key=key):
+        if any(key(q) == key(p) for q in front):
+            continue
+        if any(all(a <= b for a, b in zip(key(q), key(p))) for q in front):
+            continue
+        front.append(p)
+    return front
+
+
+class FrontierExplorer:
+    """
+    Pareto frontier of cost vs CO2 vs local share.
+    Cost is minimized under a grid of epsilon bounds (CO2 <= eps_co2,
+    local components >= eps_local) spanning the ranges found by the anchor
+    solves; every point clones the same built model and solves on a worker
+    thread (CP-SAT releases the GIL). Points are cached by config hash;
+    the model is only built on the first point missing from the cache.
+    """
+
+    def __init__(self, config: CanteenConfig, recipes: List[Recipe], gemrcn: dict,
+                 cache: Optional[LRUCache] = None, catalog_version: Hashable = None,
+                 max_workers: Optional[int] = None):
+        self.config = config
+        self.cache = cache
+        self.hash = config_hash(config, catalog_version)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.menu_solver = MenuSolver(config, recipes, gemrcn)
+        self._build_lock = threading.Lock()
+        self.cost = self.carbon = self.local = None
+        self.cost_weight = None
+
+    def _build(self):
+        """Build the model and the objective expressions, once."""
+        with self._build_lock:
+            if self.cost_weight is not None:
+                return
+            self.menu_solver.build_model()
+            template = self.menu_solver.template
+            self.cost = cp_model.LinearExpr.WeightedSum(template.obj_vars, template.cost_coefs)
+            self.carbon = cp_model.LinearExpr.WeightedSum(template.obj_vars, template.carbon_coefs)
+            local_vars = [v for v, l in zip(template.obj_vars, template.local_coefs) if l]
+            self.local = cp_model.LinearExpr.Sum(local_vars)
+            # Lexicographic weight: cost first, then CO2 and local share as tie-breaks,
+            # so that every epsilon point is itself non-dominated
+            self.cost_weight = sum(template.carbon_coefs) + len(local_vars) + 1
+
+    def _solve_point(self, objective: str, eps_co2: Optional[int], eps_local: Optional[int],
+                     max_time_in_seconds: float, num_search_workers: int) -> Dict:
+        key = ("frontier", self.hash, objective, eps_co2, eps_local)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return dict(cached, cache=True)
+
+        if self.cost_weight is None:
+            self._build()
+        model = self.menu_solver.model.Clone()
+        if eps_co2 is not None:
+            model.Add(self.carbon <= eps_co2)
+        if eps_local is not None:
+            model.Add(self.local >= eps_local)
+        if objective == "cout":
+            model.Minimize(self.cost * self.cost_weight + self.carbon - self.local)
+        elif objective == "co2":
+            model.Minimize(self.carbon * self.cost_weight + self.cost)
+        else:
+            model.Maximize(self.local * self.cost_weight - self.cost)
+
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = max_time_in_seconds
+        solver.parameters.num_search_workers = num_search_workers
+        status = solver.Solve(model)
+
+        # CO2 coefficients are effectif-weighted with several populations
+        scale = 1000 * self.menu_solver.cost_scale
+        point = {
+            "objectif": objective,
+            "epsilon_co2_kg": round(eps_co2 / scale, 3) if eps_co2 is not None else None,
+            "epsilon_nb_local": eps_local,
+            "statut": solver.StatusName(status),
+        }
+        if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            menu = self.menu_solver._extract_solution(solver)
+            point.update(
+                cout_total=menu["stats"]["cout_total"],
+                co2_total_kg=round(solver.Value(self.carbon) / scale, 3),
+                nb_local=int(solver.Value(self.local)),
+                pct_local=menu["stats"]["pct_local"],
+                menu=menu,
+            )
+        # Timeouts without solution are not cached: a longer limit may succeed
+        if self.cache is not None and status != cp_model.UNKNOWN:
+            self.cache.put(key, point)
+        return dict(point, cache=False)
+
+    def _run(self, tasks: List[Tuple], max_time_in_seconds: float) -> List[Dict]:
+        workers = max(1, min(self.max_workers, len(tasks)))
+        threads_per_solve = max(1, (os.cpu_count() or 1) // workers)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frontier") as pool:
+            return list(pool.map(
+                lambda t: self._solve_point(*t, max_time_in_seconds, threads_per_solve), tasks
+            ))
+
+    def solve(self, nb_points: int = 4, max_time_per_point: float = 5.0) -> Dict:
+        """
+        Compute the frontier on a nb_points x nb_points epsilon grid.
+        Returns the non-dominated menus sorted by cost.
+        """
+        start = time.perf_counter()
+
+        # Anchors: the best menu for each criterion bounds the epsilon ranges
+        anchors = self._run([("cout", None, None), ("co2", None, None), ("local", None, None)],
+                            max_time_per_point)
+        feasible = [a for a in anchors if "cout_total" in a]
+        if len(feasible) < len(anchors):
+            return {"config_hash": self.hash, "statut": "infaisable", "points": [],
+                    "nb_solves": len(anchors), "duree_s": round(time.perf_counter() - start, 3)}
+        _, greenest, most_local = anchors
+
+        scale = 1000 * self.menu_solver.cost_scale
+        co2_max = round(max(a["co2_total_kg"] for a in anchors) * scale)
+        co2_min = round(greenest["co2_total_kg"] * scale)
+        local_min = min(a["nb_local"] for a in anchors)
+        local_max = most_local["nb_local"]
+        steps = max(1, nb_points - 1)
+        co2_levels = sorted({co2_min + (co2_max - co2_min) * i // steps for i in range(nb_points)})
+        local_levels = sorted({local_min + (local_max - local_min) * i // steps for i in range(nb_points)})
+
+        tasks = [("cout", eps_co2, eps_local) for eps_co2, eps_local in product(co2_levels, local_levels)]
+        points = self._run(tasks, max_time_per_point)
+
+        all_points = [p for p in anchors + points if "cout_total" in p]
+        front = non_dominated(all_points)
+        return {
+            "config_hash": self.hash,
+            "statut": "succes",
+            "nb_solves": len(anchors) + len(tasks),
+            "nb_depuis_cache": sum(1 for p in anchors + points if p["cache"]),
+            "plages": {
+                "co2_total_kg": [round(co2_min / scale, 3), round(co2_max / scale, 3)],
+                "nb_local": [local_min, local_max],
+            },
+            "points": front,
+            "duree_s": round(time.perf_counter() - start, 3),
+        }
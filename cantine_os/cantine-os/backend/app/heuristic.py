@@ -0,0 +1,294 @@
+"""
+Cantine.OS - Menu Heuristic
+Greedy construction and iterated local search on a MenuSolver's model,
+raced against CP-SAT by MenuSolver.solve_portfolio()
+"""
+
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class Assignment:
+    """Stands for a CpSolver in MenuSolver._extract_solution: the chosen variables are 1."""
+
+    def __init__(self, selected: set):
+        self.selected = selected
+
+    def Value(self, var) -> int:
+        return 1 if var.Index() in self.selected else 0
+
+
+class MenuHeuristic:
+    """
+    Local search on the menu shared by every population (one recipe per
+    day and component), with the model's checks: budget, Egalim weeks,
+    GEMRCN bounds of every population and variety windows. Its objective is
+    the model's objective for that menu, so the two engines compare directly.
+
+    Violations outweigh any objective change: the search repairs first, then
+    improves. A missing or extra serving (GEMRCN, Egalim, variety) also
+    outweighs any cost change of a slot, so that the budget is never met by
+    trading a GEMRCN serving for a cheaper dish. Moves
+    change one slot (or, while repairing, swap two days of a component)
+    until a local optimum; then a few random slots are kicked and the search
+    starts again from the best menu found (iterated local search).
+    """
+
+    def __init__(self, solver, seed: int = 0):
+        self.random = random.Random(seed)
+        template = solver.template
+        nb_days = solver.config.nb_jours
+        populations = list(solver.pop_x_slots)
+        weight_of = {var.Index(): w for var, w in zip(template.obj_vars, solver.objective_weights)}
+        cost_of = {var.Index(): c for var, c in zip(template.obj_vars, template.cost_coefs)}
+
+        # GEMRCN bounds of every population: (component, bits, is_min, bound)
+        self.bounds = [
+            (rule.composante, bits, rule.sens == "min", bound)
+            for population in populations
+            for rule, bits, bound in solver._gemrcn_bounds(population)
+        ]
+        self.weeks = nb_days // 5
+        # Variety windows: (window, max per window, number of windows)
+        self.variety = [
+            (rule.fenetre_jours, rule.max_par_fenetre, max(1, nb_days - rule.fenetre_jours + 1))
+            for rule in solver.variety_rules
+        ]
+        self.budget_cap = solver.budget_cents() * solver.cost_scale
+
+        self.slots: List[Tuple[int, str]] = []
+        self.variables = []  # slot -> candidate -> variable indices (one per population)
+        self.recipe_ids = []  # slot -> candidate -> recipe id
+        self.scores = []  # slot -> candidate -> objective coefficient, all populations
+        self.costs = []  # slot -> candidate -> cost (cents, effectif-weighted)
+        self.members = []  # slot -> candidate -> GEMRCN bounds counting it
+        self.veg_week = []  # slot -> candidate -> Egalim week it counts for (-1: none)
+        self.groups = []  # slot -> candidate -> variety group per rule (None: none)
+        self.feasible_slots = True
+        for d in range(nb_days):
+            for comp in solver.day_recipes:
+                if not solver.recipes_by_type.get(comp):
+                    continue
+                recipes = solver.day_recipes[comp][d]
+                if not recipes:
+                    self.feasible_slots = False
+                slot_vars = [solver.pop_x_slots[p][comp][d] for p in populations]
+                variables = [[slot[i].Index() for slot in slot_vars] for i in range(len(recipes))]
+                self.slots.append((d, comp))
+                self.variables.append(variables)
+                self.recipe_ids.append([r.id for r in recipes])
+                self.scores.append([sum(weight_of[v] for v in vs) for vs in variables])
+                self.costs.append([sum(cost_of[v] for v in vs) for vs in variables])
+                self.members.append([
+                    tuple(b for b, (bound_comp, bits, _, _) in enumerate(self.bounds)
+                          if bound_comp == comp and solver.rule_index.contains(bits, r.id))
+                    for r in recipes
+                ])
+                week = d // 5 if comp == "plat_principal" and d // 5 < self.weeks else -1
+                self.veg_week.append([week if r.vegetarien else -1 for r in recipes])
+                self.groups.append([
+                    tuple(rule.group(r) if rule.composante == comp else None for rule in solver.variety_rules)
+                    for r in recipes
+                ])
+        self.by_score = [sorted(range(len(s)), key=s.__getitem__) for s in self.scores]
+        self.index_of = [{rid: i for i, rid in enumerate(ids)} for ids in self.recipe_ids]
+        self.by_component: Dict[str, List[int]] = {}
+        for k, (_, comp) in enumerate(self.slots):
+            self.by_component.setdefault(comp, []).append(k)
+
+        # Violations are counted in cents over budget, a serving short or in excess
+        # weighing more than any cost change of a slot; any violation outweighs
+        # the widest objective swing
+        self.serving_weight = 1 + max((max(c) - min(c) for c in self.costs if c), default=0)
+        self.violation_weight = 1 + sum(max(s) - min(s) for s in self.scores if s)
+        self.choice: List[int] = []
+
+    # --- State -------------------------------------------------------------
+
+    def _load(self, choice: List[int]):
+        """Set the menu and recompute every counter from scratch."""
+        self.choice = list(choice)
+        self.objective = 0
+        self.total_cost = 0
+        self.counts = [0] * len(self.bounds)
+        self.veg_counts = [0] * self.weeks
+        self.windows = {}  # (rule, group) -> servings per window start
+        for k, i in enumerate(self.choice):
+            self.objective += self.scores[k][i]
+            self.total_cost += self.costs[k][i]
+            for b in self.members[k][i]:
+                self.counts[b] += 1
+            if self.veg_week[k][i] >= 0:
+                self.veg_counts[self.veg_week[k][i]] += 1
+            for v, group in enumerate(self.groups[k][i]):
+                if group is not None:
+                    for s in self._window_starts(v, self.slots[k][0]):
+                        self._window_counts(v, group)[s] += 1
+        self.violation = max(0, self.total_cost - self.budget_cap)
+        self.violation += sum(self._bound_violation(b, c) for b, c in enumerate(self.counts))
+        self.violation += self.serving_weight * sum(1 for c in self.veg_counts if c == 0)
+        self.violation += self.serving_weight * sum(
+            max(0, c - self.variety[v][1]) for (v, _), counts in self.windows.items() for c in counts
+        )
+
+    def _window_starts(self, v: int, d: int) -> range:
+        window, _, nb_windows = self.variety[v]
+        return range(max(0, d - window + 1), min(d, nb_windows - 1) + 1)
+
+    def _window_counts(self, v: int, group) -> List[int]:
+        counts = self.windows.get((v, group))
+        if counts is None:
+            counts = self.windows[(v, group)] = [0] * self.variety[v][2]
+        return counts
+
+    def _bound_violation(self, b: int, count: int) -> int:
+        _, _, is_min, bound = self.bounds[b]
+        return self.serving_weight * (max(0, bound - count) if is_min else max(0, count - bound))
+
+    def _delta(self, k: int, new: int) -> Tuple[int, int]:
+        """(objective change, violation change) of serving candidate `new` on slot k."""
+        old = self.choice[k]
+        if new == old:
+            return 0, 0
+        violation = 0
+        cost_change = self.costs[k][new] - self.costs[k][old]
+        if cost_change:
+            violation += (max(0, self.total_cost + cost_change - self.budget_cap)
+                          - max(0, self.total_cost - self.budget_cap))
+        old_members, new_members = self.members[k][old], self.members[k][new]
+        if old_members != new_members:
+            for b in old_members:
+                if b not in new_members:
+                    violation += self._bound_violation(b, self.counts[b] - 1) - self._bound_violation(b, self.counts[b])
+            for b in new_members:
+                if b not in old_members:
+                    violation += self._bound_violation(b, self.counts[b] + 1) - self._bound_violation(b, self.counts[b])
+        old_week, new_week = self.veg_week[k][old], self.veg_week[k][new]
+        if old_week != new_week:
+            if old_week >= 0 and self.veg_counts[old_week] == 1:
+                violation += self.serving_weight
+            if new_week >= 0 and self.veg_counts[new_week] == 0:
+                violation -= self.serving_weight
+        old_groups, new_groups = self.groups[k][old], self.groups[k][new]
+        if old_groups != new_groups:
+            d = self.slots[k][0]
+            for v, (old_group, new_group) in enumerate(zip(old_groups, new_groups)):
+                if old_group == new_group:
+                    continue
+                limit = self.variety[v][1]
+                for s in self._window_starts(v, d):
+                    if old_group is not None and self.windows[(v, old_group)][s] > limit:
+                        violation -= self.serving_weight
+                    if new_group is not None and self.windows.get((v, new_group), [0] * (s + 1))[s] >= limit:
+                        violation += self.serving_weight
+        return self.scores[k][new] - self.scores[k][old], violation
+
+    def _apply(self, k: int, new: int):
+        old = self.choice[k]
+        if new == old:
+            return
+        objective, violation = self._delta(k, new)
+        self.objective += objective
+        self.violation += violation
+        self.total_cost += self.costs[k][new] - self.costs[k][old]
+        for b in self.members[k][old]:
+            self.counts[b] -= 1
+        for b in self.members[k][new]:
+            self.counts[b] += 1
+        if self.veg_week[k][old] >= 0:
+            self.veg_counts[self.veg_week[k][old]] -= 1
+        if self.veg_week[k][new] >= 0:
+            self.veg_counts[self.veg_week[k][new]] += 1
+        d = self.slots[k][0]
+        for v, (old_group, new_group) in enumerate(zip(self.groups[k][old], self.groups[k][new])):
+            if old_group == new_group:
+                continue
+            for s in self._window_starts(v, d):
+                if old_group is not None:
+                    self.windows[(v, old_group)][s] -= 1
+                if new_group is not None:
+                    self._window_counts(v, new_group)[s] += 1
+        self.choice[k] = new
+
+    def _penalized(self, objective: int, violation: int) -> int:
+        return objective + self.violation_weight * violation
+
+    # --- Search ------------------------------------------------------------
+
+    def _descend(self, deadline: float) -> bool:
+        """Best-improvement moves until a local optimum; False if the deadline cut it short."""
+        order = list(range(len(self.slots)))
+        while True:
+            improved = False
+            self.random.shuffle(order)
+            for k in order:
+                if time.perf_counter() > deadline:
+                    return False
+                best, best_gain = None, 0
+                current = self.scores[k][self.choice[k]]
+                for i in self.by_score[k]:
+                    # Once feasible, only a lower-scoring dish can improve
+                    if self.violation == 0 and self.scores[k][i] >= current:
+                        break
+                    gain = self._penalized(*self._delta(k, i))
+                    if gain < best_gain:
+                        best, best_gain = i, gain
+                if best is not None:
+                    self._apply(k, best)
+                    improved = True
+            if not improved and self.violation > 0:
+                # (a swap keeps the objective: it can only help while repairing)
+                improved = self._swap_pass(deadline)
+            if not improved:
+                return True
+
+    def _swap_pass(self, deadline: float) -> bool:
+        """Swap the dishes of two days of a component (moves a serving across windows and weeks)."""
+        improved = False
+        for slots in self.by_component.values():
+            for a, k1 in enumerate(slots):
+                if time.perf_counter() > deadline:
+                    return improved
+                for k2 in slots[a + 1:]:
+                    i1, i2 = self.choice[k1], self.choice[k2]
+                    j1 = self.index_of[k1].get(self.recipe_ids[k2][i2])
+                    j2 = self.index_of[k2].get(self.recipe_ids[k1][i1])
+                    if j1 is None or j2 is None or j1 == i1:
+                        continue
+                    first = self._penalized(*self._delta(k1, j1))
+                    self._apply(k1, j1)
+                    second = self._penalized(*self._delta(k2, j2))
+                    if first + second < 0:
+                        self._apply(k2, j2)
+                        improved = True
+                    else:
+                        self._apply(k1, i1)
+        return improved
+
+    def run(self, deadline: float, should_stop: Optional[Callable[[], bool]] = None
+            ) -> Optional[Tuple[int, Assignment]]:
+        """
+        Search until `deadline` (time.perf_counter()); returns the best
+        feasible menu found as (objective, Assignment), or None.
+        """
+        if not self.slots or not self.feasible_slots:
+            return None
+        # Greedy start: the best-scoring dish of every slot, repaired by the descent
+        self._load([min(range(len(s)), key=s.__getitem__) for s in self.scores])
+        best: Optional[List[int]] = None
+        best_objective = None
+        while time.perf_counter() < deadline and not (should_stop and should_stop()):
+            self._descend(deadline)
+            if self.violation == 0 and (best_objective is None or self.objective < best_objective):
+                best, best_objective = list(self.choice), self.objective
+            elif best is not None:
+                self._load(best)
+            # Kick: a few random slots get a random dish
+            kicked = min(self.random.randint(2, 8), len(self.slots))
+            for k in self.random.sample(range(len(self.slots)), kicked):
+                self._apply(k, self.random.randrange(len(self.scores[k])))
+        if best is None:
+            return None
+        selected = {v for k, i in enumerate(best) for v in self.variables[k][i]}
+        return best_objective, Assignment(selected)
@@ -0,0 +1,113 @@
+"""
+Cantine.OS - Ingredient Pricing
+Supplier prices for recipe ingredients, used by the ingredient-aware
+solver objective
+"""
+
+import re
+import unicodedata
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .solver import StockLot
+
+
+# Words a supplier product name may add to an ingredient name and still be the same product
+PRODUCT_QUALIFIERS = {
+    "bio", "frais", "surgele", "vrac", "brut", "cru", "sec", "mini", "complet",
+    "rouge", "vert", "verte", "filet", "pave", "feuille", "cote", "desosse", "grain",
+    "fermier", "nature", "seche",
+}
+
+STOPWORDS = {"de", "du", "des", "la", "le", "les", "et", "a", "au", "aux", "d", "l"}
+
+
+def _name_words(name: str) -> List[str]:
+    """Lowercase, accent-free, singular words of a product or ingredient name."""
+    name = re.sub(r"\(.*?\)", " ", name)  # "(vrac)", "(pavé cru)"...
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    words = re.split(r"[^a-z]+", name.lower().replace("_", " "))
+    return [w[:-1] if w.endswith("s") and len(w) > 3 else w for w in words if w and w not in STOPWORDS]
+
+
+def matches_product(ingredient: str, product_name: str) -> bool:
+    """True if a supplier product is the ingredient, possibly with qualifiers ("Poivrons rouges")."""
+    wanted = set(_name_words(ingredient))
+    offered = set(_name_words(product_name))
+    return bool(wanted) and wanted <= offered and offered - wanted <= PRODUCT_QUALIFIERS
+
+
+def supplier_ingredient_prices(suppliers: List[dict], ingredients: Iterable[str]) -> Dict[str, Tuple[float, dict]]:
+    """
+    ingredient -> (lowest €/kg, supplier) over the products sold by the kilogram.
+    Ingredients no supplier sells are left out.
+    """
+    prices = {}
+    for ingredient in ingredients:
+        for supplier in suppliers:
+            for product in supplier.get("produits", []):
+                if str(product.get("unite", "")).lower() != "kg":
+                    continue
+                price = product.get("prix_unitaire")
+                if not price or not matches_product(ingredient, product.get("nom", "")):
+                    continue
+                if ingredient not in prices or price < prices[ingredient][0]:
+                    prices[ingredient] = (price, supplier)
+    return prices
+
+
+def ingredient_prices(recipes, suppliers: Optional[List[dict]] = None) -> Dict[str, float]:
+    """
+    €/kg of every ingredient of the catalog: best supplier price when a
+    supplier sells it, otherwise the average cout_euro_kg of the recipes.
+    """
+    recipe_prices = {}
+    for recipe in recipes:
+        for ingredient in recipe.ingredients:
+            recipe_prices.setdefault(ingredient["nom"], []).append(ingredient.get("cout_euro_kg", 0))
+    prices = {name: sum(values) / len(values) for name, values in recipe_prices.items()}
+    for name, (price, _) in supplier_ingredient_prices(suppliers or [], prices).items():
+        prices[name] = price
+    return prices
+
+
+def stock_index(stocks: List[dict], recipes, days: List[date],
+                prices: Optional[Dict[str, float]] = None) -> Dict[str, List[StockLot]]:
+    """
+    ingredient -> perishable lots of stocks.json that the menu of `days` can use.
+    Only lots counted in kg with a DLC are kept (the others do not go to
+    waste); `jours_utilisables` is the number of `days` on or before the DLC,
+    and lots already past their DLC on the first day are left out.
+    """
+    prices = prices if prices is not None else ingredient_prices(recipes)
+    index = {}
+    for stock in stocks:
+        if str(stock.get("unite", "")).lower() != "kg" or not stock.get("dlc"):
+            continue
+        quantity = stock.get("quantite_actuelle") or 0
+        if quantity <= 0:
+            continue
+        try:
+            dlc = date.fromisoformat(stock["dlc"])
+        except ValueError:
+            continue
+        usable = sum(1 for day in days if day <= dlc)
+        if usable == 0:
+            continue
+        names = tuple(sorted(n for n in prices if matches_product(n, stock.get("produit_nom", ""))))
+        if not names:
+            continue
+        lot = StockLot(
+            stock_id=stock.get("id", ""),
+            produit=stock.get("produit_nom", ""),
+            ingredients=names,
+            quantite_kg=quantity,
+            dlc=dlc,
+            jours_utilisables=usable,
+            prix_kg=sum(prices[n] for n in names) / len(names),
+        )
+        for name in names:
+            index.setdefault(name, []).append(lot)
+    for lots in index.values():
+        lots.sort(key=lambda lot: lot.dlc)
+    return index
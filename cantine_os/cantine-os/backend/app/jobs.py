@@ -0,0 +1,151 @@
+"""
+Cantine.OS - Background Job Queue
+Runs long menu solves on a bounded worker pool so API handlers return immediately
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+
+# Job statuses
+EN_ATTENTE = "en_attente"
+EN_COURS = "en_cours"
+TERMINE = "termine"
+ECHEC = "echec"
+ANNULE = "annule"
+
+FINISHED_STATUSES = (TERMINE, ECHEC, ANNULE)
+
+
+class QueueFullError(Exception):
+    """Raised when the number of pending jobs reaches the queue-depth limit."""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    statut: str = EN_ATTENTE
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    exception: Optional[BaseException] = None
+    cancel_requested: bool = False
+    # Called from cancel() while the job is running (e.g. MenuSolver.stop)
+    cancel_hook: Optional[Callable[[], None]] = None
+    done: threading.Event = field(default_factory=threading.Event)
+    # Bumped on every status change, lets subscribers detect updates
+    version: int = 0
+
+    def to_dict(self, include_result: bool = False) -> Dict:
+        data = {
+            "job_id": self.id,
+            "type": self.kind,
+            "statut": self.statut,
+            "cree_le": self.created_at,
+            "demarre_le": self.started_at,
+            "termine_le": self.finished_at,
+            "erreur": self.error,
+        }
+        if self.started_at is not None:
+            end = self.finished_at or time.time()
+            data["duree_s"] = round(end - self.started_at, 3)
+        if include_result and self.statut == TERMINE:
+            data["resultat"] = self.result
+        return data
+
+
+class JobQueue:
+    """
+    Bounded worker pool with a queue-depth limit.
+    `fn(job)` runs on a worker thread; it may set `job.cancel_hook` so that
+    cancel() can interrupt it while running.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 20, keep_finished: int = 200):
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="menu-job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[Job], Any]) -> Job:
+        with self._lock:
+            pending = sum(1 for j in self._jobs.values() if j.statut == EN_ATTENTE)
+            if pending >= self.max_pending:
+                raise QueueFullError(f"{pending} jobs en attente (limite {self.max_pending})")
+            job = Job(id=uuid.uuid4().hex[:12], kind=kind)
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a pending job, or stop a running one through its cancel hook."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.statut in FINISHED_STATUSES:
+                return job
+            job.cancel_requested = True
+            if job.statut == EN_ATTENTE:
+                self._finish(job, ANNULE)
+                return job
+            hook = job.cancel_hook
+        if hook is not None:
+            hook()
+        return job
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.statut] = counts.get(job.statut, 0) + 1
+            return {"max_pending": self.max_pending, "jobs": counts}
+
+    def _run(self, job: Job, fn: Callable[[Job], Any]):
+        with self._lock:
+            if job.statut != EN_ATTENTE:
+                return  # Cancelled while queued
+            job.statut = EN_COURS
+            job.started_at = time.time()
+            job.version += 1
+        try:
+            result = fn(job)
+        except Exception as e:
+            with self._lock:
+                job.error = str(e)
+                job.exception = e
+                self._finish(job, ANNULE if job.cancel_requested else ECHEC)
+            return
+        with self._lock:
+            job.result = result
+            self._finish(job, ANNULE if job.cancel_requested else TERMINE)
+
+    def _finish(self, job: Job, statut: str):
+        # Caller holds self._lock
+        job.statut = statut
+        job.finished_at = time.time()
+        job.cancel_hook = None
+        job.version += 1
+        job.done.set()
+
+    def _prune(self):
+        # Caller holds self._lock; forget the oldest finished jobs
+        finished = [j.id for j in self._jobs.values() if j.statut in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,320 @@
+"""
+Cantine.OS - Stock Movement Ledger
+Stock movements as an append-only journal: one JSON line per movement,
+fsync'ed in batches, current quantities kept in memory and periodically
+compacted into a snapshot. Sealed journal segments keep the history,
+with a per-stock offset index for the history of one stock. Several
+processes may share a ledger directory: they serialize on its lock file
+and catch up with each other's appends before every operation
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .storage import FileLock, write_json_atomic
+
+
+JOURNAL_NAME = "journal.log"
+SNAPSHOT_NAME = "instantane.json"
+
+# Entry written when a stock is edited or deleted: its quantity is no longer the ledger's
+RESET = "reinitialisation"
+
+
+class StockLedger:
+    """
+    Movements of `directory`:
+      journal.log          active journal, appended to
+      segment-<n>.log/.idx sealed journals and their {stock_id: [offsets]} index
+      instantane.json      quantities as of the last compacted movement
+      .lock                held while reading or appending
+
+    The current quantity of a stock is the `quantite_apres` of its last
+    movement. Appends are fsync'ed every `fsync_every` movements or
+    `fsync_interval` seconds, whichever comes first: a crash loses at most
+    that window. The active journal is sealed into a segment (and the
+    snapshot rewritten) every `compact_every` movements, so a restart
+    replays at most that many lines.
+
+    Each append is handed to the OS right away, so another process sees it
+    once it takes the lock: it replays the journal lines past the offset it
+    knows, or reloads everything if the journal was sealed meanwhile.
+    """
+
+    def __init__(self, directory: Path, first_seq: int = 1, fsync_every: int = 64,
+                 fsync_interval: float = 0.05, compact_every: int = 10000):
+        self.directory = Path(directory)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.lock = FileLock(self.directory / ".lock")
+        self.first_seq = first_seq
+        self.seq = first_seq - 1  # last movement number
+        self.state: Dict[str, Dict] = {}  # stock_id -> {"quantite", "dernier_mouvement"}
+        self.segments: List[Tuple[int, Dict[str, List[int]]]] = []  # (n, index), oldest first
+        self.index: Dict[str, List[int]] = {}  # stock_id -> offsets in the active journal
+        self.entries = 0  # movements in the active journal
+        self._journal = None
+        self._journal_ino: Optional[int] = None  # active journal known to this process
+        self._end = 0  # offset up to which it has been replayed
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._flusher: Optional[threading.Thread] = None
+        self.stats = {"ecritures": 0, "fsync": 0, "compactions": 0, "rattrapages": 0}
+        if self.directory.exists():
+            with self.lock:
+                self._load()
+
+    # --- Recovery ------------------------------------------------------------
+
+    def _load(self):
+        snapshot_seq = 0
+        snapshot_path = self.directory / SNAPSHOT_NAME
+        if snapshot_path.exists():
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            self.seq = max(self.seq, snapshot_seq)
+            self.state = snapshot["stocks"]
+        for path in sorted(self.directory.glob("segment-*.log"), key=lambda p: int(p.stem.split("-")[1])):
+            n = int(path.stem.split("-")[1])
+            index_path = path.with_suffix(".idx")
+            if index_path.exists() and n <= snapshot_seq:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            else:
+                # Sealed but not yet in the snapshot (crash during a compaction)
+                index, _ = self._replay(path, snapshot_seq)
+                write_json_atomic(index_path, index)
+            self.segments.append((n, index))
+        journal_path = self.directory / JOURNAL_NAME
+        if journal_path.exists():
+            self.index, self.entries, self._end = self._replay(journal_path, snapshot_seq)
+            self._journal_ino = os.stat(journal_path).st_ino
+
+    def _replay(self, path: Path, after_seq: int, start: int = 0,
+                index: Optional[Dict[str, List[int]]] = None) -> Tuple[Dict[str, List[int]], int, int]:
+        """
+        Index the movements of a journal from offset `start` and apply those
+        after `after_seq` to the state. Returns (index, movements read, end offset).
+        """
+        index = {} if index is None else index
+        entries = 0
+        with open(path, "rb+") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn last write: drop it
+                    f.truncate(offset)
+                    break
+                entry = json.loads(line)
+                index.setdefault(entry["stock_id"], []).append(offset)
+                entries += 1
+                if entry["seq"] > after_seq:
+                    self._apply(entry)
+                    self.seq = max(self.seq, entry["seq"])
+                offset += len(line)
+        return index, entries, offset
+
+    def _catch_up(self):
+        """Pick up the movements other processes appended (caller holds self.lock)."""
+        try:
+            st = os.stat(self.directory / JOURNAL_NAME)
+        except FileNotFoundError:
+            st = None
+        ino = st.st_ino if st is not None else None
+        if ino != self._journal_ino:
+            # Journal sealed (or started) by another process: reload from the snapshot
+            self._sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self.seq = self.first_seq - 1
+            self.state, self.segments, self.index = {}, [], {}
+            self.entries, self._end, self._journal_ino = 0, 0, None
+            self._load()
+            self.stats["rattrapages"] += 1
+        elif st is not None and st.st_size > self._end:
+            _, entries, self._end = self._replay(self.directory / JOURNAL_NAME, 0, self._end, self.index)
+            self.entries += entries
+            self.stats["rattrapages"] += 1
+
+    def _apply(self, entry: Dict):
+        if entry["type"] == RESET:
+            self.state.pop(entry["stock_id"], None)
+        elif "quantite_apres" not in entry:
+            # Imported movement: already counted in its stock record
+            return
+        else:
+            self.state[entry["stock_id"]] = {"quantite": entry["quantite_apres"], "dernier_mouvement": entry["date"]}
+
+    # --- Writes --------------------------------------------------------------
+
+    def append(self, stock_id: str, movement: Dict, quantite_apres: float) -> Dict:
+        """Journal a movement that leaves the stock at `quantite_apres`; returns it with its id."""
+        with self.lock:
+            self._catch_up()
+            self.seq += 1
+            entry = {"seq": self.seq, "id": f"mvt_{self.seq:03d}", "stock_id": stock_id, **movement,
+                     "quantite_apres": quantite_apres}
+            self._write(entry)
+            self._apply(entry)
+            self._maybe_compact()
+            return {k: v for k, v in entry.items() if k != "seq"}
+
+    def import_movements(self, movements: List[Dict]) -> int:
+        """
+        Journal the movements stored before the ledger existed, oldest first,
+        so that history() serves them too. They keep their ids and leave the
+        quantities alone (their stock records include them). Only an empty
+        ledger imports; returns the number of movements journaled.
+        """
+        with self.lock:
+            self._catch_up()
+            if self.seq > self.first_seq - 1 or self.segments or self.entries:
+                return 0
+            movements = [m for m in movements if m.get("stock_id") and m.get("type")]
+            for movement in sorted(movements, key=lambda m: m.get("date", "")):
+                self.seq += 1
+                self._write({"seq": self.seq, **movement})
+            self._maybe_compact()
+            return len(movements)
+
+    def reset(self, stock_id: str):
+        """Forget the ledger quantity of an edited or deleted stock (its record is the reference again)."""
+        with self.lock:
+            self._catch_up()
+            if stock_id not in self.state:
+                return
+            self.seq += 1
+            entry = {"seq": self.seq, "id": f"mvt_{self.seq:03d}", "stock_id": stock_id, "type": RESET,
+                     "date": time.strftime("%Y-%m-%d")}
+            self._write(entry)
+            self._apply(entry)
+            self._maybe_compact()
+
+    def _write(self, entry: Dict):
+        # Caller holds self.lock and has caught up, so the journal ends at self._end
+        if self._journal is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._journal = open(self.directory / JOURNAL_NAME, "ab")
+            self._journal_ino = os.fstat(self._journal.fileno()).st_ino
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="stock-ledger", daemon=True)
+                self._flusher.start()
+                atexit.register(self.close)
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._journal.write(line)
+        self._journal.flush()  # visible to the other processes; fsync'ed in batches below
+        self.index.setdefault(entry["stock_id"], []).append(self._end)
+        self._end += len(line)
+        self.entries += 1
+        self.stats["ecritures"] += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self._sync()
+
+    def _maybe_compact(self):
+        # Caller holds self.lock
+        if self.entries >= self.compact_every:
+            self.compact()
+
+    def _sync(self):
+        # Caller holds self.lock
+        if self._journal is not None and self._unsynced:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self.stats["fsync"] += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            if not self._unsynced:
+                continue
+            with self.lock:
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+
+    def flush(self):
+        """fsync the movements appended so far."""
+        with self.lock:
+            self._sync()
+
+    def compact(self):
+        """Seal the active journal into a segment and snapshot the quantities."""
+        with self.lock:
+            if not self.entries:
+                return
+            self._sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            segment = self.directory / f"segment-{self.seq}.log"
+            os.replace(self.directory / JOURNAL_NAME, segment)
+            write_json_atomic(segment.with_suffix(".idx"), self.index)
+            write_json_atomic(self.directory / SNAPSHOT_NAME, {"seq": self.seq, "stocks": self.state})
+            self.segments.append((self.seq, self.index))
+            self.index = {}
+            self.entries = 0
+            self._journal_ino, self._end = None, 0
+            self.stats["compactions"] += 1
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    # --- Reads ---------------------------------------------------------------
+
+    def quantity(self, stock_id: str, default: float) -> float:
+        with self.lock:
+            self._catch_up()
+            state = self.state.get(stock_id)
+            return state["quantite"] if state is not None else default
+
+    def materialize(self, stocks: List[Dict]) -> List[Dict]:
+        """Stock records with the quantities and last movement dates of the ledger."""
+        with self.lock:
+            self._catch_up()
+            return [{**s, "quantite_actuelle": self.state[s.get("id")]["quantite"],
+                     "dernier_mouvement": self.state[s.get("id")]["dernier_mouvement"]}
+                    if s.get("id") in self.state else s
+                    for s in stocks]
+
+    def history(self, stock_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Movements of one stock, newest first, read through the offset indexes."""
+        movements = []
+        with self.lock:  # a compaction would rename the journal under us
+            self._catch_up()
+            sources = [(self.directory / JOURNAL_NAME, self.index.get(stock_id, []))]
+            for n, index in reversed(self.segments):
+                sources.append((self.directory / f"segment-{n}.log", index.get(stock_id, [])))
+            for path, offsets in sources:
+                if not offsets:
+                    continue
+                with open(path, "rb") as f:
+                    for offset in reversed(offsets):
+                        f.seek(offset)
+                        entry = json.loads(f.readline())
+                        if entry["type"] == RESET:
+                            continue
+                        del entry["seq"]
+                        movements.append(entry)
+                        if limit is not None and len(movements) >= limit:
+                            return movements
+        return movements
+
+    def version(self) -> int:
+        with self.lock:
+            self._catch_up()
+            return self.seq
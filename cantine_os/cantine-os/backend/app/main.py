@@ -3,17 +3,38 @@ Cantine.OS - FastAPI Backend
 REST API for menu optimization
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
 import json
 import tempfile
 import shutil
+import threading
+import time
+from datetime import date
 from pathlib import Path
 
-from .solver import MenuSolver, CanteenConfig, ConviveProfile, load_recipes
+from ortools.sat.python import cp_model
+from .solver import (
+    MenuSolver, RollingHorizonSolver, CanteenConfig, ConviveProfile, ModelCache, CHUNK_DAYS,
+    volume_discount, school_days, variety_rules, COMPONENTS
+)
+from .ingredients import ingredient_prices, stock_index
+from .popularity import PopularityIndex
+from .batch import generate_batch
+from .frontier import FrontierExplorer
+from .result_cache import ResultCache, file_digest, request_key
+from .lru import LRUCache
+from .catalog import CatalogStore, FLAG_VEGETARIEN, FLAG_BIO, FLAG_LOCAL
+from .storage import open_storage
+from .ledger import StockLedger
+from .feedback import FeedbackBuffer
+from .jobs import JobQueue, QueueFullError, Job, ANNULE, ECHEC, FINISHED_STATUSES
 
 # OCR import (optional - may not be installed)
 try:
@@ -38,6 +59,39 @@ app.add_middleware(
 
 DATA_DIR = Path(__file__).parent.parent.parent / "data"
 
+# Built solver models, reused across /api/generate-menu calls
+MODEL_CACHE = ModelCache()
+
+# Pareto frontier points, keyed by config hash and epsilon bounds
+FRONTIER_CACHE = LRUCache(max_entries=1024)
+
+# Solved menus, keyed by request hash and catalog content (survives restarts)
+RESULT_CACHE = ResultCache(DATA_DIR / "cache" / "menus")
+
+# Suppliers, stocks, orders, ratings...: data/cantine.db once migrated
+# (python -m app.storage), the JSON files of data/ until then
+STORAGE = open_storage(DATA_DIR)
+
+# Stock movements: append-only journal, starting with the movements stored before it
+LEDGER = StockLedger(DATA_DIR / "mouvements")
+if LEDGER.version() == 0:
+    LEDGER.import_movements(STORAGE.all("mouvements"))
+
+# QR-code ratings: taken in memory, written to STORAGE in batches
+FEEDBACK = FeedbackBuffer(STORAGE)
+
+# Columnar recipe catalog, snapshotted next to the result cache (mapped on restart)
+RECIPE_CATALOG = CatalogStore(DATA_DIR / "recettes.json", snapshot_dir=DATA_DIR / "cache")
+
+# Time limit when re-solving from a previous menu (the hint is already feasible)
+WARM_START_MAX_TIME_SECONDS = 1.0
+
+# Time limit of a local repair (only the repaired slots are free)
+REPAIR_MAX_TIME_SECONDS = 2.0
+
+# Menu solves run on a bounded pool (CP-SAT already uses several threads per solve)
+MENU_JOBS = JobQueue(max_workers=2, max_pending=20)
+
 
 # ============ MODELS ============
 
@@ -87,6 +141,37 @@ class MenuRequest(BaseModel):
     priorite_local: float = 0.3
     priorite_budget: float = 0.4
     equipement_disponible: Optional[List[str]] = None
+    # Re-solve mode: previously returned menu ({"jours": [...]}) used as a warm start
+    menu_precedent: Optional[dict] = None
+    max_changements: Optional[int] = None
+    # Long horizons: solve chunk by chunk ("semaine" or "mois") instead of one model
+    decoupage: Optional[str] = None
+    # First meal date (YYYY-MM-DD): only recipes in season on each day are proposed
+    date_debut: Optional[date] = None
+    # Optimize the purchase cost of the ingredients (supplier prices, volume tiers)
+    # instead of the cost of the portions
+    cout_ingredients: bool = False
+    # Favour recipes that use perishable stock (stocks.json) before its DLC
+    utiliser_stocks: bool = False
+    # Weight of the QR-code ratings of the recipes (0 = ignored)
+    priorite_popularite: float = 0.0
+    # Repeat windows, e.g. [{"composante": "dessert", "par": "famille", "fenetre_jours": 5, "max": 2}]
+    # (replaces the "variete" rules of gemrcn_constraints.json)
+    variete: Optional[List[dict]] = None
+    # Latency budget (ms, model build included): race CP-SAT against a local-search
+    # heuristic and keep the better menu ("portefeuille" tells which engine won)
+    latence_ms: Optional[int] = None
+
+
+class MenuRepairRequest(MenuRequest):
+    # Menu to repair, as returned by /api/generate-menu ({"jours": [...]})
+    menu: dict
+    # Day numbers ("jour", from 1) to re-optimize; the other days are kept
+    jours: List[int]
+    # Components to re-optimize on those days (default: all)
+    composantes: Optional[List[str]] = None
+    # Recipes the repaired slots may not serve (default: their current dishes)
+    exclure: Optional[List[str]] = None
 
 
 class RecipeBase(BaseModel):
@@ -142,40 +227,57 @@ class SupplierInput(BaseModel):
     produits: List[ProductInput] = []
 
 
-def load_suppliers():
-    """Load suppliers from JSON file."""
-    suppliers_file = DATA_DIR / "fournisseurs.json"
-    if suppliers_file.exists():
-        with open(suppliers_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get("fournisseurs", [])
-    return []
-
-
-def save_suppliers(suppliers: list):
-    """Save suppliers to JSON file."""
-    suppliers_file = DATA_DIR / "fournisseurs.json"
-    data = {
-        "fournisseurs": suppliers,
-        "meta": {
-            "version": "1.0",
-            "last_updated": "2024-12-13",
-            "description": "Catalogue des fournisseurs de la cantine"
-        }
-    }
-    with open(DATA_DIR / "fournisseurs.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+def data_file_version(path: Path) -> tuple:
+    """Cheap version stamp for a data file (changes whenever the file is rewritten)."""
+    st = path.stat()
+    return (st.st_mtime_ns, st.st_size)
 
-def load_etablissements():
-    try:
-        with open(DATA_DIR / "etablissements.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
 
-def save_etablissements(etablissements: list):
-    with open(DATA_DIR / "etablissements.json", "w", encoding="utf-8") as f:
-        json.dump(etablissements, f, indent=4, ensure_ascii=False)
+_catalog = {"stamp": None, "digest": None, "gemrcn": None}
+_catalog_lock = threading.Lock()
+
+
+def load_catalog():
+    """
+    Recipes + GEMRCN constraints used by the solver.
+    Parsed once and re-read only when one of the files changes (the recipe
+    list is the same object as long as recettes.json is unchanged).
+    Returns (recipes, gemrcn, version), version being the content digests
+    of both files.
+    """
+    catalog = RECIPE_CATALOG.get()
+    stamp = data_file_version(DATA_DIR / "gemrcn_constraints.json")
+    with _catalog_lock:
+        if _catalog["stamp"] != stamp:
+            with open(DATA_DIR / "gemrcn_constraints.json", "r", encoding="utf-8") as f:
+                _catalog["gemrcn"] = json.load(f)
+            _catalog["digest"] = file_digest(DATA_DIR / "gemrcn_constraints.json")
+            _catalog["stamp"] = stamp
+        return catalog.recipes(), _catalog["gemrcn"], (catalog.digest, _catalog["digest"])
+
+
+POPULARITY = PopularityIndex()
+_popularity_stamp = {"stamp": None}
+_popularity_lock = threading.Lock()
+
+
+def load_popularity() -> PopularityIndex:
+    """
+    Recipe popularity from the ratings joined to the planning.
+    Both are re-read only when they change, and then only the ratings
+    added since the last sync are counted.
+    """
+    FEEDBACK.flush()
+    stamp = (STORAGE.version("ratings"), STORAGE.version("planning"))
+    with _popularity_lock:
+        if _popularity_stamp["stamp"] != stamp:
+            new = STORAGE.since("ratings", POPULARITY.cursor)
+            start_over = new is None
+            ratings, cursor = STORAGE.since("ratings") if start_over else new
+            POPULARITY.sync(ratings, STORAGE.all("planning"), planning_version=stamp[1],
+                            cursor=cursor, start_over=start_over)
+            _popularity_stamp["stamp"] = stamp
+    return POPULARITY
 
 
 # ============ ENDPOINTS ============
@@ -188,7 +290,7 @@ def root():
 @app.get("/api/recipes")
 def get_recipes():
     """Get all available recipes."""
-    recipes = load_recipes(DATA_DIR / "recettes.json")
+    recipes = RECIPE_CATALOG.get().recipes()
     return [
         {
             "id": r.id,
@@ -217,15 +319,11 @@ def get_gemrcn_constraints():
         return json.load(f)
 
 
-@app.post("/api/generate-menu")
-def generate_menu(request: MenuRequest):
-    """Generate an optimized menu plan."""
-    # Load data
-    recipes = load_recipes(DATA_DIR / "recettes.json")
-    with open(DATA_DIR / "gemrcn_constraints.json", "r", encoding="utf-8") as f:
-        gemrcn = json.load(f)
+class MenuInfeasibleError(Exception):
+    """No menu satisfies the request constraints."""
 
-    # Build config from request
+
+def request_to_config(request: MenuRequest) -> CanteenConfig:
     convives = [
         ConviveProfile(
             label=c.label,
@@ -237,7 +335,7 @@ def generate_menu(request: MenuRequest):
         for c in request.convives
     ]
 
-    config = CanteenConfig(
+    return CanteenConfig(
         nom=request.nom_etablissement,
         budget_max_par_repas=request.budget_max_par_repas,
         nb_jours=request.nb_jours,
@@ -245,30 +343,480 @@ def generate_menu(request: MenuRequest):
         priorite_carbone=request.priorite_carbone,
         priorite_local=request.priorite_local,
         priorite_budget=request.priorite_budget,
-        equipement_disponible=request.equipement_disponible or []
+        equipement_disponible=request.equipement_disponible or [],
+        date_debut=request.date_debut,
+        priorite_popularite=request.priorite_popularite,
+        variete=request.variete
     )
 
-    # Solve
-    solver = MenuSolver(config, recipes, gemrcn)
-    menu = solver.solve()
+
+def solve_menu_request(request: MenuRequest, job: Optional[Job] = None, on_solution=None,
+                       lookup_cache: bool = True) -> dict:
+    """
+    Build and solve the model for a MenuRequest (runs on a job worker).
+    `on_solution` receives every improving intermediate menu.
+    Results are cached; `lookup_cache=False` when the caller already missed.
+    """
+    # Load data
+    recipes, gemrcn, catalog_version = load_catalog()
+    config = request_to_config(request)
+
+    cache_key = menu_cache_key(request, catalog_version)
+    cached = RESULT_CACHE.get(cache_key, catalog_version) if lookup_cache else None
+    if cached is not None:
+        return restamp_cached_response(cached, request)
+    response = solve_menu_uncached(request, config, recipes, gemrcn, catalog_version, job, on_solution)
+    # A search cut short by cancellation may be suboptimal: do not keep it
+    if job is None or not job.cancel_requested:
+        RESULT_CACHE.put(cache_key, catalog_version, response)
+    return response
+
+
+def menu_cache_key(request: MenuRequest, catalog_version) -> str:
+    """
+    Content address of a request: every solver input, but not the
+    établissement name, so that schools sharing a profile share results.
+    """
+    payload = request.model_dump(exclude={"nom_etablissement"})
+    payload["equipement_disponible"] = sorted(payload.get("equipement_disponible") or [])
+    if request.cout_ingredients:
+        # Supplier prices are part of the objective
+        catalog_version = (catalog_version, STORAGE.version("fournisseurs"))
+    if request.utiliser_stocks:
+        # So are the stock levels, and the DLCs are compared to the first meal date
+        catalog_version = (catalog_version, STORAGE.version("stocks"), LEDGER.version(),
+                           (request.date_debut or date.today()).isoformat())
+    if request.priorite_popularite > 0:
+        # And the ratings counted so far
+        catalog_version = (catalog_version, load_popularity().version())
+    return request_key(payload, catalog_version)
+
+
+def cached_menu_response(request: MenuRequest) -> Optional[dict]:
+    """Response of an identical request from the result cache, or None (blocking)."""
+    _, _, catalog_version = load_catalog()
+    cached = RESULT_CACHE.get(menu_cache_key(request, catalog_version), catalog_version)
+    return restamp_cached_response(cached, request) if cached is not None else None
+
+
+def restamp_cached_response(cached: dict, request: MenuRequest) -> dict:
+    response = dict(cached, cache=True)
+    response["config"] = dict(cached["config"], etablissement=request.nom_etablissement)
+    return response
+
+
+def solve_menu_uncached(request: MenuRequest, config: CanteenConfig, recipes, gemrcn, catalog_version,
+                        job: Optional[Job] = None, on_solution=None) -> dict:
+
+    if request.decoupage:
+        return solve_rolling_menu_request(request, config, recipes, gemrcn, job)
+
+    # Solve (structural model reused from the cache when possible)
+    solver = build_menu_solver(request, config, recipes, gemrcn, catalog_version)
+    if job is not None:
+        job.cancel_hook = solver.stop
+        if job.cancel_requested:
+            solver.stop()
+
+    if request.menu_precedent:
+        solver.warm_start(request.menu_precedent, max_changes=request.max_changements)
+    if request.latence_ms:
+        menu = solver.solve_portfolio(latency_ms=request.latence_ms)
+    elif request.menu_precedent:
+        menu = solver.solve(max_time_in_seconds=WARM_START_MAX_TIME_SECONDS, on_solution=on_solution)
+    else:
+        menu = solver.solve(on_solution=on_solution)
 
     if menu is None:
-        raise HTTPException(
-            status_code=400,
-            detail="Impossible de générer un menu avec ces contraintes. Essayez d'augmenter le budget."
+        if solver.last_status == cp_model.INFEASIBLE and not solver.stop_requested:
+            # Proven conflict: name it instead of guessing
+            diagnostic = explain_menu_request(request, config, recipes, gemrcn, catalog_version)
+            if diagnostic["conflit_minimal"]:
+                raise MenuInfeasibleError(diagnostic_message(diagnostic))
+        if request.latence_ms and not solver.stop_requested:
+            raise MenuInfeasibleError(
+                f"Aucun menu trouvé en {request.latence_ms} ms. Augmentez la latence autorisée."
+            )
+        raise MenuInfeasibleError(
+            "Impossible de générer un menu avec ces contraintes. Essayez d'augmenter le budget."
+        )
+
+    return menu_response(config, menu)
+
+
+def build_menu_solver(request: MenuRequest, config: CanteenConfig, recipes, gemrcn, catalog_version,
+                      prune_dominated: bool = True, explain: bool = False) -> MenuSolver:
+    """MenuSolver of a request, with its optional supplier prices, stocks and ratings."""
+    prices = ingredient_prices(recipes, STORAGE.all("fournisseurs")) if request.cout_ingredients else None
+    stocks = None
+    if request.utiliser_stocks:
+        # Without a start date the menu is assumed to start today
+        days = school_days(request.date_debut or date.today(), request.nb_jours)
+        stocks = stock_index(load_stocks(), recipes, days, prices)
+
+    popularity = load_popularity().scores() if request.priorite_popularite > 0 else None
+    return MenuSolver(config, recipes, gemrcn, model_cache=MODEL_CACHE, catalog_version=catalog_version,
+                      prune_dominated=prune_dominated, ingredient_prices=prices, stocks=stocks,
+                      popularity=popularity, explain=explain)
+
+
+def explain_menu_request(request: MenuRequest, config: CanteenConfig, recipes, gemrcn, catalog_version) -> dict:
+    """MenuSolver.explain() on the model the request is solved with, warm start included."""
+    solver = build_menu_solver(request, config, recipes, gemrcn, catalog_version, explain=True)
+    if request.menu_precedent:
+        solver.warm_start(request.menu_precedent, max_changes=request.max_changements)
+    return solver.explain()
+
+
+def diagnostic_message(diagnostic: dict) -> str:
+    """One-line French summary of MenuSolver.explain() for HTTP error details."""
+    conflict = ", ".join(c["description"] for c in diagnostic["conflit_minimal"])
+    message = f"Contraintes incompatibles : {conflict}."
+    relaxation = diagnostic["relaxation_conseillee"]
+    if relaxation is None:
+        message += " Plusieurs de ces contraintes doivent être assouplies."
+    elif "propose" in relaxation:
+        message += (f" Suggestion : {relaxation['action']} « {relaxation['description']} » "
+                    f"de {relaxation['actuel']} à {relaxation['propose']} {relaxation['unite']}.")
+    else:
+        message += f" Suggestion : lever la contrainte « {relaxation['description']} »."
+    return message
+
+
+def solve_rolling_menu_request(request: MenuRequest, config: CanteenConfig, recipes, gemrcn,
+                               job: Optional[Job] = None) -> dict:
+    """Long-horizon plan solved chunk by chunk (see RollingHorizonSolver)."""
+    solver = RollingHorizonSolver(config, recipes, gemrcn, chunk_days=CHUNK_DAYS[request.decoupage])
+    if job is not None:
+        job.cancel_hook = solver.stop
+        if job.cancel_requested:
+            solver.stop()
+
+    menu = solver.solve()
+    if menu is None:
+        raise MenuInfeasibleError(
+            "Impossible de générer le planning sur tout l'horizon. Essayez d'augmenter le budget."
         )
+    response = menu_response(config, menu)
+    response["config"]["decoupage"] = request.decoupage
+    return response
 
+
+def menu_response(config: CanteenConfig, menu: dict) -> dict:
     return {
         "status": "success",
         "config": {
             "etablissement": config.nom,
             "budget_max": config.budget_max_par_repas,
-            "nb_jours": config.nb_jours
+            "nb_jours": config.nb_jours,
+            "date_debut": config.date_debut.isoformat() if config.date_debut else None
         },
         "menu": menu
     }
 
 
+def submit_menu_job(request: MenuRequest, on_solution=None, lookup_cache: bool = True) -> Job:
+    if request.decoupage and request.decoupage not in CHUNK_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Découpage invalide. Valeurs: {list(CHUNK_DAYS)}"
+        )
+    if request.decoupage:
+        # RollingHorizonSolver plans from the config alone: refuse what it would ignore
+        ignored = [name for name, used in [
+            ("menu_precedent", request.menu_precedent is not None),
+            ("max_changements", request.max_changements is not None),
+            ("latence_ms", request.latence_ms is not None),
+            ("cout_ingredients", request.cout_ingredients),
+            ("utiliser_stocks", request.utiliser_stocks),
+            ("priorite_popularite", request.priorite_popularite > 0),
+            ("flux de solutions (stream)", on_solution is not None),
+        ] if used]
+        if ignored:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Options incompatibles avec le découpage : {', '.join(ignored)}"
+            )
+    if request.latence_ms is not None and request.latence_ms <= 0:
+        raise HTTPException(status_code=400, detail="La latence doit être positive (ms)")
+    if request.variete is not None:
+        try:
+            variety_rules(load_catalog()[1], request.variete)
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Règles de variété invalides : {e}")
+    try:
+        return MENU_JOBS.submit("generate-menu", lambda job: solve_menu_request(request, job, on_solution, lookup_cache))
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"File de génération saturée ({e}). Réessayez dans quelques instants."
+        )
+
+
+def job_result_or_error(job: Job) -> dict:
+    """Result of a finished job, or the matching HTTP error."""
+    if job.statut == ANNULE:
+        raise HTTPException(status_code=409, detail=f"Job {job.id} annulé")
+    if job.statut == ECHEC:
+        if isinstance(job.exception, MenuInfeasibleError):
+            raise HTTPException(status_code=400, detail=job.error)
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la génération: {job.error}")
+    return job.result
+
+
+@app.post("/api/generate-menu")
+async def generate_menu(request: MenuRequest, http_request: Request):
+    """
+    Generate an optimized menu plan.
+    Identical requests are answered from the result cache; otherwise the
+    solve runs on the job pool and is cancelled if the client disconnects.
+    The lookup and the submission read the catalog and the data files
+    (and flush the ratings), so they run off the event loop.
+    """
+    cached = await run_in_threadpool(cached_menu_response, request)
+    if cached is not None:
+        return cached
+
+    job = await run_in_threadpool(submit_menu_job, request, lookup_cache=False)
+    while not job.done.is_set():
+        if await http_request.is_disconnected():
+            MENU_JOBS.cancel(job.id)
+            return None
+        await asyncio.sleep(0.1)
+    return job_result_or_error(job)
+
+
+@app.post("/api/generate-menu/diagnostic")
+def diagnose_menu(request: MenuRequest):
+    """
+    Explain why a request has no solution: minimal set of conflicting
+    constraint families (budget, Egalim, each GEMRCN frequency, equipment,
+    season, variety) and the cheapest relaxation restoring feasibility.
+    """
+    recipes, gemrcn, catalog_version = load_catalog()
+    return explain_menu_request(request, request_to_config(request), recipes, gemrcn, catalog_version)
+
+
+@app.post("/api/generate-menu/reparation")
+def repair_menu(request: MenuRepairRequest):
+    """
+    Re-optimize some days (or some components of them) of an existing menu,
+    e.g. after a failed delivery: the other days are kept as they are and
+    the horizon's constraints (budget, Egalim, GEMRCN, variety) still hold.
+    """
+    start = time.perf_counter()
+    recipes, gemrcn, catalog_version = load_catalog()
+    config = request_to_config(request)
+    # Without dominance pruning: the kept dishes and the best replacement of an
+    # excluded recipe may be recipes pruning would drop
+    solver = build_menu_solver(request, config, recipes, gemrcn, catalog_version, prune_dominated=False)
+    try:
+        menu = solver.repair(request.menu, request.jours, request.composantes, request.exclure,
+                             max_time_in_seconds=REPAIR_MAX_TIME_SECONDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Menu à réparer invalide : {e}")
+    if menu is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Aucun remplacement ne respecte les contraintes du menu. "
+                   "Réparez plus de jours ou autorisez les recettes exclues."
+        )
+    response = menu_response(config, menu)
+    response["reparation"] = {
+        "jours": sorted(set(request.jours)),
+        "composantes": request.composantes or COMPONENTS,
+        "temps_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    return response
+
+
+def sse_event(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/generate-menu/stream")
+async def generate_menu_stream(request: MenuRequest, http_request: Request):
+    """
+    Server-Sent Events version of /api/generate-menu.
+    Emits a `solution` event for every improving menu found by CP-SAT
+    (objective, cost, CO2, elapsed time), then a final `resultat` or `erreur`.
+    The solve is cancelled if the client disconnects.
+    """
+    loop = asyncio.get_running_loop()
+    solutions: asyncio.Queue = asyncio.Queue()
+
+    def on_solution(payload: dict):
+        loop.call_soon_threadsafe(solutions.put_nowait, payload)
+
+    job = await run_in_threadpool(submit_menu_job, request, on_solution=on_solution)
+
+    async def events():
+        try:
+            yield sse_event("job", job.to_dict())
+            while True:
+                if await http_request.is_disconnected():
+                    return
+                try:
+                    payload = await asyncio.wait_for(solutions.get(), timeout=0.1)
+                    yield sse_event("solution", payload)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+                if job.done.is_set() and solutions.empty():
+                    break
+            try:
+                yield sse_event("resultat", job_result_or_error(job))
+            except HTTPException as e:
+                yield sse_event("erreur", {"status_code": e.status_code, "detail": e.detail})
+        finally:
+            # Client went away (or the stream was torn down): free the worker
+            if not job.done.is_set():
+                MENU_JOBS.cancel(job.id)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+class FrontierRequest(MenuRequest):
+    nb_points: int = 4  # epsilon levels per criterion (nb_points² solves)
+    temps_max_par_point: float = 5.0
+
+
+@app.post("/api/generate-menu/frontiere")
+def generate_menu_frontier(request: FrontierRequest):
+    """
+    Cost / CO2 / local-share trade-off curve in one call.
+    Returns the non-dominated menus of an epsilon-constraint grid, solved in
+    parallel; points are cached, so repeated calls for the same
+    établissement profile are answered from memory.
+    """
+    if not 2 <= request.nb_points <= 8:
+        raise HTTPException(status_code=400, detail="nb_points doit être compris entre 2 et 8")
+    recipes, gemrcn, catalog_version = load_catalog()
+    explorer = FrontierExplorer(request_to_config(request), recipes, gemrcn,
+                                cache=FRONTIER_CACHE, catalog_version=catalog_version)
+    return explorer.solve(nb_points=request.nb_points, max_time_per_point=request.temps_max_par_point)
+
+
+class BatchMenuRequest(BaseModel):
+    etablissement_ids: Optional[List[str]] = None  # None = all
+    nb_jours: int = 5
+    max_workers: Optional[int] = None
+
+
+@app.post("/api/generate-menu/batch")
+def generate_menu_batch(request: BatchMenuRequest):
+    """
+    Generate menus for every (or a filtered set of) établissement(s) in one call.
+    Solves run in a process pool sharing one parsed recipe catalog.
+    """
+    etablissements = STORAGE.all("etablissements")
+    if request.etablissement_ids:
+        wanted = set(request.etablissement_ids)
+        etablissements = [e for e in etablissements if e.get("id") in wanted]
+    if not etablissements:
+        raise HTTPException(status_code=404, detail="Aucun établissement correspondant")
+
+    recipes, gemrcn, catalog_version = load_catalog()
+    return generate_batch(etablissements, recipes, gemrcn, nb_jours=request.nb_jours,
+                          max_workers=request.max_workers, catalog_version=catalog_version)
+
+
+# ============ MENU GENERATION JOBS ============
+
+@app.post("/api/jobs/generate-menu", status_code=202)
+def submit_generate_menu_job(request: MenuRequest):
+    """Queue a menu generation; poll /api/jobs/{job_id} or subscribe to its events."""
+    job = submit_menu_job(request)
+    return {
+        **job.to_dict(),
+        "liens": {
+            "statut": f"/api/jobs/{job.id}",
+            "resultat": f"/api/jobs/{job.id}/resultat",
+            "evenements": f"/api/jobs/{job.id}/evenements"
+        }
+    }
+
+
+@app.get("/api/jobs")
+def get_jobs():
+    """Queue statistics and recent jobs."""
+    return {
+        **MENU_JOBS.stats(),
+        "recents": [j.to_dict() for j in MENU_JOBS.list_jobs()[-20:]]
+    }
+
+
+def get_job_or_404(job_id: str) -> Job:
+    job = MENU_JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} non trouvé")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """Poll a job's status (includes the result once finished)."""
+    return get_job_or_404(job_id).to_dict(include_result=True)
+
+
+@app.get("/api/jobs/{job_id}/resultat")
+def get_job_result(job_id: str):
+    """Fetch the generated menu of a finished job."""
+    job = get_job_or_404(job_id)
+    if job.statut not in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} pas encore terminé ({job.statut})")
+    return job_result_or_error(job)
+
+
+@app.get("/api/jobs/{job_id}/evenements")
+async def stream_job_events(job_id: str, http_request: Request, annuler_si_deconnexion: bool = True):
+    """
+    Server-Sent Events: one event per status change until the job finishes.
+    By default the job is cancelled if the subscriber disconnects.
+    """
+    job = get_job_or_404(job_id)
+
+    async def events():
+        seen_version = -1
+        try:
+            while True:
+                if await http_request.is_disconnected():
+                    return
+                if job.version != seen_version:
+                    seen_version = job.version
+                    payload = job.to_dict(include_result=True)
+                    yield sse_event("statut", payload)
+                    if job.statut in FINISHED_STATUSES:
+                        return
+                await asyncio.sleep(0.1)
+        finally:
+            # Subscriber went away before the end: free the worker
+            if annuler_si_deconnexion and job.statut not in FINISHED_STATUSES:
+                MENU_JOBS.cancel(job.id)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a queued job or stop a running CP-SAT search."""
+    get_job_or_404(job_id)
+    job = MENU_JOBS.cancel(job_id)
+    return job.to_dict()
+
+
+@app.get("/api/solver/cache")
+def get_solver_cache_stats():
+    """Model template cache statistics."""
+    return MODEL_CACHE.stats()
+
+
+@app.get("/api/generate-menu/cache")
+def get_menu_cache_stats():
+    """Result cache statistics (hit rate of identical menu requests)."""
+    return RESULT_CACHE.stats()
+
+
 # ============ AGREATION / BULK ORDERING ENDPOINTS ============
 
 @app.get("/api/commandes/agregation")
@@ -283,8 +831,8 @@ def get_aggregated_orders(semaine: str = None):
         - economie_vs_detail (€ économisés)
     """
     # 1. Load data
-    suppliers = load_suppliers()
-    etablissements = load_etablissements() 
+    suppliers = STORAGE.all("fournisseurs")
+    etablissements = STORAGE.all("etablissements")
     
     # 2. Simulate aggregated needs (Mock logic for demo as we don't have real planning persistence yet)
     # In a real app, we would fetch planning for each store for the given week
@@ -322,15 +870,8 @@ def get_aggregated_orders(semaine: str = None):
                      # Check if supplier has bulk discount logic (simulated here)
                      # Example: -10% if > 50kg, -20% if > 100kg
                     base_price = product.get("prix_unitaire", 0)
-                    current_price = base_price
-                    discount = 0
-                    
-                    # Simuler des paliers de réduction
-                    if qty_total >= 100:
-                        discount = 0.20
-                    elif qty_total >= 50:
-                        discount = 0.10
-                        
+                    # Paliers de réduction (partagés avec le solveur)
+                    discount = volume_discount(qty_total)
                     current_price = base_price * (1 - discount)
                     
                     if current_price < best_price:
@@ -380,27 +921,33 @@ def get_heatmap_data():
     Get data for the Nutritional Density vs Cost heatmap.
     This is the "Killer Feature" to convince mayors.
     """
-    recipes = load_recipes(DATA_DIR / "recettes.json")
+    catalog = RECIPE_CATALOG.get()
+    cost = catalog.numeric["cout_portion_euro"]
+    proteines = catalog.numeric["proteines_g"]
+    fer = catalog.numeric["fer_mg"]
+    calcium = catalog.numeric["calcium_mg"]
+    co2 = catalog.numeric["co2_kg_portion"]
 
     # Calculate nutritional density score
     # Simple formula: (proteins + iron*5 + calcium/10) / cost
     heatmap_data = []
-    for r in recipes:
-        if r.cout_portion_euro > 0:
-            density = (r.proteines_g + r.fer_mg * 5 + r.calcium_mg / 10) / r.cout_portion_euro
+    for i in range(len(catalog)):
+        if cost[i] > 0:
+            density = (proteines[i] + fer[i] * 5 + calcium[i] / 10) / cost[i]
+            flags = catalog.flags[i]
             heatmap_data.append({
-                "id": r.id,
-                "nom": r.nom,
-                "type": r.type,
-                "cout": r.cout_portion_euro,
-                "proteines": r.proteines_g,
-                "fer": r.fer_mg,
-                "calcium": r.calcium_mg,
-                "co2": r.co2_kg_portion,
+                "id": catalog.ids[i],
+                "nom": catalog.noms[i],
+                "type": catalog.type(i),
+                "cout": cost[i],
+                "proteines": proteines[i],
+                "fer": fer[i],
+                "calcium": calcium[i],
+                "co2": co2[i],
                 "densite_nutritionnelle": round(density, 2),
-                "vegetarien": r.vegetarien,
-                "bio": r.bio,
-                "local": r.local
+                "vegetarien": bool(flags & FLAG_VEGETARIEN),
+                "bio": bool(flags & FLAG_BIO),
+                "local": bool(flags & FLAG_LOCAL)
             })
 
     # Sort by density (best value first)
@@ -417,47 +964,38 @@ def get_heatmap_data():
 
 @app.get("/api/etablissements")
 def get_etablissements():
-    return load_etablissements()
+    return STORAGE.all("etablissements")
 
 @app.get("/api/etablissements/{etablissement_id}")
 def get_etablissement(etablissement_id: str):
-    etablissements = load_etablissements()
-    for etab in etablissements:
-        if etab["id"] == etablissement_id:
-            return etab
-    raise HTTPException(status_code=404, detail="Etablissement not found")
+    etab = STORAGE.get("etablissements", etablissement_id)
+    if etab is None:
+        raise HTTPException(status_code=404, detail="Etablissement not found")
+    return etab
 
 @app.post("/api/etablissements")
 def create_etablissement(etablissement: EtablissementInput):
-    etablissements = load_etablissements()
     new_etab = etablissement.dict()
-    if not new_etab.get("id"):
-        new_etab["id"] = f"etab_{len(etablissements) + 1:03d}"
-    
-    etablissements.append(new_etab)
-    save_etablissements(etablissements)
+    with STORAGE.transaction():
+        if not new_etab.get("id"):
+            new_etab["id"] = f"etab_{STORAGE.count('etablissements') + 1:03d}"
+        STORAGE.add("etablissements", new_etab)
     return new_etab
 
 @app.put("/api/etablissements/{etablissement_id}")
 def update_etablissement(etablissement_id: str, etablissement: EtablissementInput):
-    etablissements = load_etablissements()
-    for index, etab in enumerate(etablissements):
-        if etab["id"] == etablissement_id:
-            updated_etab = etablissement.dict()
-            updated_etab["id"] = etablissement_id # Ensure ID allows match
-            etablissements[index] = updated_etab
-            save_etablissements(etablissements)
-            return updated_etab
-    raise HTTPException(status_code=404, detail="Etablissement not found")
+    with STORAGE.transaction():
+        if STORAGE.get("etablissements", etablissement_id) is None:
+            raise HTTPException(status_code=404, detail="Etablissement not found")
+        updated_etab = etablissement.dict()
+        updated_etab["id"] = etablissement_id # Ensure ID allows match
+        STORAGE.put("etablissements", updated_etab)
+    return updated_etab
 
 @app.delete("/api/etablissements/{etablissement_id}")
 def delete_etablissement(etablissement_id: str):
-    etablissements = load_etablissements()
-    initial_len = len(etablissements)
-    etablissements = [e for e in etablissements if e["id"] != etablissement_id]
-    if len(etablissements) == initial_len:
+    if STORAGE.delete("etablissements", etablissement_id) is None:
          raise HTTPException(status_code=404, detail="Etablissement not found")
-    save_etablissements(etablissements)
     return {"message": "Etablissement deleted"}
 
 
@@ -466,7 +1004,7 @@ def delete_etablissement(etablissement_id: str):
 @app.get("/api/suppliers")
 def get_suppliers():
     """Get all suppliers with their products."""
-    suppliers = load_suppliers()
+    suppliers = STORAGE.all("fournisseurs")
     return {
         "count": len(suppliers),
         "suppliers": suppliers
@@ -476,32 +1014,17 @@ def get_suppliers():
 @app.get("/api/suppliers/{supplier_id}")
 def get_supplier(supplier_id: str):
     """Get a specific supplier by ID."""
-    suppliers = load_suppliers()
-    for s in suppliers:
-        if s.get("id") == supplier_id:
-            return s
+    supplier = STORAGE.get("fournisseurs", supplier_id)
+    if supplier is not None:
+        return supplier
     raise HTTPException(status_code=404, detail=f"Fournisseur {supplier_id} non trouvé")
 
 
 @app.post("/api/suppliers")
 def create_supplier(supplier: SupplierInput):
     """Create a new supplier."""
-    suppliers = load_suppliers()
-    
-    # Generate ID if not provided
-    if not supplier.id:
-        existing_ids = [s.get("id", "") for s in suppliers]
-        new_num = 1
-        while f"f{new_num:03d}" in existing_ids:
-            new_num += 1
-        supplier_id = f"f{new_num:03d}"
-    else:
-        supplier_id = supplier.id
-        if any(s.get("id") == supplier_id for s in suppliers):
-            raise HTTPException(status_code=400, detail=f"L'ID {supplier_id} existe déjà")
-    
     new_supplier = {
-        "id": supplier_id,
+        "id": supplier.id,
         "nom": supplier.nom,
         "type": supplier.type,
         "contact": supplier.contact.model_dump(),
@@ -513,8 +1036,17 @@ def create_supplier(supplier: SupplierInput):
         "produits": [p.model_dump() for p in supplier.produits]
     }
     
-    suppliers.append(new_supplier)
-    save_suppliers(suppliers)
+    with STORAGE.transaction():
+        # Generate ID if not provided
+        if not supplier.id:
+            new_num = 1
+            while STORAGE.get("fournisseurs", f"f{new_num:03d}") is not None:
+                new_num += 1
+            new_supplier["id"] = f"f{new_num:03d}"
+        elif STORAGE.get("fournisseurs", supplier.id) is not None:
+            raise HTTPException(status_code=400, detail=f"L'ID {supplier.id} existe déjà")
+        
+        STORAGE.add("fournisseurs", new_supplier)
     
     return {"status": "success", "supplier": new_supplier}
 
@@ -522,11 +1054,9 @@ def create_supplier(supplier: SupplierInput):
 @app.put("/api/suppliers/{supplier_id}")
 def update_supplier(supplier_id: str, supplier: SupplierInput):
     """Update an existing supplier."""
-    suppliers = load_suppliers()
-    
-    for i, s in enumerate(suppliers):
-        if s.get("id") == supplier_id:
-            suppliers[i] = {
+    with STORAGE.transaction():
+        if STORAGE.get("fournisseurs", supplier_id) is not None:
+            updated = {
                 "id": supplier_id,
                 "nom": supplier.nom,
                 "type": supplier.type,
@@ -538,8 +1068,8 @@ def update_supplier(supplier_id: str, supplier: SupplierInput):
                 "minimum_commande_euro": supplier.minimum_commande_euro,
                 "produits": [p.model_dump() for p in supplier.produits]
             }
-            save_suppliers(suppliers)
-            return {"status": "success", "supplier": suppliers[i]}
+            STORAGE.put("fournisseurs", updated)
+            return {"status": "success", "supplier": updated}
     
     raise HTTPException(status_code=404, detail=f"Fournisseur {supplier_id} non trouvé")
 
@@ -547,13 +1077,9 @@ def update_supplier(supplier_id: str, supplier: SupplierInput):
 @app.delete("/api/suppliers/{supplier_id}")
 def delete_supplier(supplier_id: str):
     """Delete a supplier."""
-    suppliers = load_suppliers()
-    
-    for i, s in enumerate(suppliers):
-        if s.get("id") == supplier_id:
-            deleted = suppliers.pop(i)
-            save_suppliers(suppliers)
-            return {"status": "success", "deleted": deleted}
+    deleted = STORAGE.delete("fournisseurs", supplier_id)
+    if deleted is not None:
+        return {"status": "success", "deleted": deleted}
     
     raise HTTPException(status_code=404, detail=f"Fournisseur {supplier_id} non trouvé")
 
@@ -561,7 +1087,7 @@ def delete_supplier(supplier_id: str):
 @app.get("/api/products")
 def get_all_products():
     """Get all products from all suppliers."""
-    suppliers = load_suppliers()
+    suppliers = STORAGE.all("fournisseurs")
     products = []
     
     for s in suppliers:
@@ -589,7 +1115,7 @@ def search_products(q: str = "", categorie: str = "", limit: int = 10):
         categorie: Filter by category
         limit: Maximum results (default 10)
     """
-    suppliers = load_suppliers()
+    suppliers = STORAGE.all("fournisseurs")
     results = []
     
     for s in suppliers:
@@ -813,10 +1339,9 @@ async def import_products_to_supplier(supplier_id: str, products: List[ProductIn
     """
     Import parsed products into an existing supplier.
     """
-    suppliers = load_suppliers()
-    
-    for i, s in enumerate(suppliers):
-        if s.get("id") == supplier_id:
+    with STORAGE.transaction():
+        s = STORAGE.get("fournisseurs", supplier_id)
+        if s is not None:
             # Get existing products
             existing_products = s.get("produits", [])
             existing_ids = {p.get("id") for p in existing_products}
@@ -832,8 +1357,8 @@ async def import_products_to_supplier(supplier_id: str, products: List[ProductIn
                 existing_products.append(product.model_dump())
                 new_count += 1
             
-            suppliers[i]["produits"] = existing_products
-            save_suppliers(suppliers)
+            s["produits"] = existing_products
+            STORAGE.put("fournisseurs", s)
             
             return {
                 "status": "success",
@@ -999,27 +1524,15 @@ class StockInput(BaseModel):
     fournisseur_nom: str = ""
 
 
-def load_stocks():
-    """Load stocks from JSON file."""
-    stocks_file = DATA_DIR / "stocks.json"
-    if stocks_file.exists():
-        with open(stocks_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"stocks": [], "mouvements": [], "meta": {}}
-
-
-def save_stocks(data: dict):
-    """Save stocks to JSON file."""
-    data["meta"]["last_updated"] = datetime.now().strftime("%Y-%m-%d")
-    with open(DATA_DIR / "stocks.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+def load_stocks() -> List[dict]:
+    """Stock records with their current quantities (the ledger's, for stocks moved since their last edit)."""
+    return LEDGER.materialize(STORAGE.all("stocks"))
 
 
 @app.get("/api/stocks")
 def get_stocks():
     """Get all stock items."""
-    data = load_stocks()
-    stocks = data.get("stocks", [])
+    stocks = load_stocks()
     
     # Add status based on quantity vs min
     for stock in stocks:
@@ -1042,8 +1555,7 @@ def get_stocks():
 @app.get("/api/stocks/alertes")
 def get_stock_alerts():
     """Get stocks that are low or out of stock."""
-    data = load_stocks()
-    stocks = data.get("stocks", [])
+    stocks = load_stocks()
     
     alerts = []
     for stock in stocks:
@@ -1074,8 +1586,7 @@ def get_dlc_alerts(jours: int = 5):
     """
     from datetime import datetime, timedelta
     
-    data = load_stocks()
-    stocks = data.get("stocks", [])
+    stocks = load_stocks()
     today = datetime.now().date()
     threshold = today + timedelta(days=jours)
     
@@ -1289,14 +1800,11 @@ IMPORTANT:
 @app.get("/api/stocks/{stock_id}")
 def get_stock(stock_id: str):
     """Get a specific stock item by ID."""
-    data = load_stocks()
-    
-    for stock in data.get("stocks", []):
-        if stock.get("id") == stock_id:
-            # Get movements for this stock
-            movements = [m for m in data.get("mouvements", []) if m.get("stock_id") == stock_id]
-            movements.sort(key=lambda x: x.get("date", ""), reverse=True)
-            return {**stock, "mouvements": movements[:10]}
+    stock = STORAGE.get("stocks", stock_id)
+    if stock is not None:
+        # Get movements for this stock (indexed journal, imported movements included)
+        movements = LEDGER.history(stock_id, limit=10)
+        return {**LEDGER.materialize([stock])[0], "mouvements": movements}
     
     raise HTTPException(status_code=404, detail=f"Stock {stock_id} non trouvé")
 
@@ -1304,23 +1812,8 @@ def get_stock(stock_id: str):
 @app.post("/api/stocks")
 def create_stock(stock: StockInput):
     """Create a new stock item."""
-    data = load_stocks()
-    stocks = data.get("stocks", [])
-    
-    # Generate ID if not provided
-    if not stock.id:
-        existing_ids = [s.get("id", "") for s in stocks]
-        new_num = 1
-        while f"stock_{new_num:03d}" in existing_ids:
-            new_num += 1
-        stock_id = f"stock_{new_num:03d}"
-    else:
-        stock_id = stock.id
-        if any(s.get("id") == stock_id for s in stocks):
-            raise HTTPException(status_code=400, detail=f"L'ID {stock_id} existe déjà")
-    
     new_stock = {
-        "id": stock_id,
+        "id": stock.id,
         "produit_id": stock.produit_id,
         "produit_nom": stock.produit_nom,
         "categorie": stock.categorie,
@@ -1334,9 +1827,17 @@ def create_stock(stock: StockInput):
         "dernier_mouvement": datetime.now().strftime("%Y-%m-%d")
     }
     
-    stocks.append(new_stock)
-    data["stocks"] = stocks
-    save_stocks(data)
+    with STORAGE.transaction():
+        # Generate ID if not provided
+        if not stock.id:
+            new_num = 1
+            while STORAGE.get("stocks", f"stock_{new_num:03d}") is not None:
+                new_num += 1
+            new_stock["id"] = f"stock_{new_num:03d}"
+        elif STORAGE.get("stocks", stock.id) is not None:
+            raise HTTPException(status_code=400, detail=f"L'ID {stock.id} existe déjà")
+        
+        STORAGE.add("stocks", new_stock)
     
     return {"status": "success", "stock": new_stock}
 
@@ -1344,12 +1845,11 @@ def create_stock(stock: StockInput):
 @app.put("/api/stocks/{stock_id}")
 def update_stock(stock_id: str, stock: StockInput):
     """Update an existing stock item."""
-    data = load_stocks()
-    stocks = data.get("stocks", [])
-    
-    for i, s in enumerate(stocks):
-        if s.get("id") == stock_id:
-            stocks[i] = {
+    with LEDGER.lock, STORAGE.transaction():
+        s = STORAGE.get("stocks", stock_id)
+        if s is not None:
+            s = LEDGER.materialize([s])[0]
+            updated = {
                 "id": stock_id,
                 "produit_id": stock.produit_id,
                 "produit_nom": stock.produit_nom,
@@ -1363,9 +1863,10 @@ def update_stock(stock_id: str, stock: StockInput):
                 "fournisseur_nom": stock.fournisseur_nom,
                 "dernier_mouvement": s.get("dernier_mouvement", datetime.now().strftime("%Y-%m-%d"))
             }
-            data["stocks"] = stocks
-            save_stocks(data)
-            return {"status": "success", "stock": stocks[i]}
+            STORAGE.put("stocks", updated)
+            # The edited quantity replaces the one of the journal
+            LEDGER.reset(stock_id)
+            return {"status": "success", "stock": updated}
     
     raise HTTPException(status_code=404, detail=f"Stock {stock_id} non trouvé")
 
@@ -1373,14 +1874,11 @@ def update_stock(stock_id: str, stock: StockInput):
 @app.delete("/api/stocks/{stock_id}")
 def delete_stock(stock_id: str):
     """Delete a stock item."""
-    data = load_stocks()
-    stocks = data.get("stocks", [])
-    
-    for i, s in enumerate(stocks):
-        if s.get("id") == stock_id:
-            deleted = stocks.pop(i)
-            data["stocks"] = stocks
-            save_stocks(data)
+    with LEDGER.lock:
+        deleted = STORAGE.delete("stocks", stock_id)
+        if deleted is not None:
+            deleted = LEDGER.materialize([deleted])[0]
+            LEDGER.reset(stock_id)
             return {"status": "success", "deleted": deleted}
     
     raise HTTPException(status_code=404, detail=f"Stock {stock_id} non trouvé")
@@ -1389,58 +1887,32 @@ def delete_stock(stock_id: str):
 @app.post("/api/stocks/{stock_id}/mouvement")
 def record_stock_movement(stock_id: str, movement: StockMovementInput):
     """Record a stock movement (entry or exit)."""
-    data = load_stocks()
-    stocks = data.get("stocks", [])
-    mouvements = data.get("mouvements", [])
-    
-    # Find stock
-    stock_index = None
-    for i, s in enumerate(stocks):
-        if s.get("id") == stock_id:
-            stock_index = i
-            break
-    
-    if stock_index is None:
-        raise HTTPException(status_code=404, detail=f"Stock {stock_id} non trouvé")
-    
-    stock = stocks[stock_index]
-    
     # Validate movement type
     if movement.type not in ["entree", "sortie"]:
         raise HTTPException(status_code=400, detail="Type de mouvement invalide. Utilisez 'entree' ou 'sortie'")
     
-    # Update quantity
-    current_qty = stock.get("quantite_actuelle", 0)
-    if movement.type == "entree":
-        new_qty = current_qty + movement.quantite
-    else:
-        new_qty = current_qty - movement.quantite
-        if new_qty < 0:
-            raise HTTPException(status_code=400, detail=f"Stock insuffisant. Disponible: {current_qty}")
-    
-    # Generate movement ID
-    mvt_num = len(mouvements) + 1
-    mvt_id = f"mvt_{mvt_num:03d}"
-    
-    # Create movement record
-    new_movement = {
-        "id": mvt_id,
-        "stock_id": stock_id,
-        "type": movement.type,
-        "quantite": movement.quantite,
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "motif": movement.motif
-    }
-    
-    # Update stock
-    stocks[stock_index]["quantite_actuelle"] = new_qty
-    stocks[stock_index]["dernier_mouvement"] = new_movement["date"]
-    
-    mouvements.append(new_movement)
-    
-    data["stocks"] = stocks
-    data["mouvements"] = mouvements
-    save_stocks(data)
+    with LEDGER.lock:
+        # Find stock
+        stock = STORAGE.get("stocks", stock_id)
+        if stock is None:
+            raise HTTPException(status_code=404, detail=f"Stock {stock_id} non trouvé")
+        
+        # Update quantity
+        current_qty = LEDGER.quantity(stock_id, stock.get("quantite_actuelle", 0))
+        if movement.type == "entree":
+            new_qty = current_qty + movement.quantite
+        else:
+            new_qty = current_qty - movement.quantite
+            if new_qty < 0:
+                raise HTTPException(status_code=400, detail=f"Stock insuffisant. Disponible: {current_qty}")
+        
+        # Journal the movement (numbered by the ledger); the stock record is left as is
+        new_movement = LEDGER.append(stock_id, {
+            "type": movement.type,
+            "quantite": movement.quantite,
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "motif": movement.motif
+        }, new_qty)
     
     return {
         "status": "success",
@@ -1459,8 +1931,7 @@ def calculate_stock_needs(semaine: str, convives: int = 150):
         semaine: Week identifier (e.g., "S50" or "2024-W50")
         convives: Number of people to serve per meal (default 150)
     """
-    data = load_stocks()
-    stocks = data.get("stocks", [])
+    stocks = load_stocks()
     
     # Create stock lookup by ingredient name (normalized)
     stock_lookup = {}
@@ -1474,27 +1945,19 @@ def calculate_stock_needs(semaine: str, convives: int = 150):
                 stock_lookup[word] = stock
     
     # Load recipes
-    recipes = load_recipes(DATA_DIR / "recettes.json")
-    recipe_lookup = {r.id: r for r in recipes}
-    
-    # Try to load planning data (stored in frontend localStorage, but we'll check for a planning.json)
-    planning_file = DATA_DIR / "planning.json"
-    planning_data = {}
-    if planning_file.exists():
-        with open(planning_file, "r", encoding="utf-8") as f:
-            planning_data = json.load(f)
+    catalog = RECIPE_CATALOG.get()
     
     # Aggregate ingredients from planned recipes
     ingredient_needs = {}
     planned_recipe_ids = []
     
-    # If we have planning data, use it
-    week_data = planning_data.get(semaine, {})
+    # If we have planning data (saved by the frontend), use it
+    week_data = STORAGE.get("planning", semaine) or {}
     if week_data:
         for day_key, day_data in week_data.items():
             if isinstance(day_data, dict):
                 for meal_type, recipe_id in day_data.items():
-                    if recipe_id and recipe_id in recipe_lookup:
+                    if recipe_id and catalog.position(recipe_id) is not None:
                         planned_recipe_ids.append(recipe_id)
     
     # If no planning data, use sample recipes for demo
@@ -1502,16 +1965,17 @@ def calculate_stock_needs(semaine: str, convives: int = 150):
         # Demo: simulate a week with sample recipes (2 per day for 5 days)
         demo_recipes = ["r001", "r002", "r003", "r006", "r008", "r009", "r010", "r011"]
         for rid in demo_recipes:
-            if rid in recipe_lookup:
+            if catalog.position(rid) is not None:
                 planned_recipe_ids.append(rid)
     
     # Aggregate ingredients
     for recipe_id in planned_recipe_ids:
-        recipe = recipe_lookup.get(recipe_id)
-        if not recipe:
+        position = catalog.position(recipe_id)
+        if position is None:
             continue
+        recipe_nom = catalog.noms[position]
         
-        for ingredient in recipe.ingredients:
+        for ingredient in catalog.ingredients(position):
             ing_name = ingredient.get("nom", "").replace("_", " ").title()
             qty_per_portion = ingredient.get("quantite_kg", 0)
             qty_total = qty_per_portion * convives
@@ -1525,8 +1989,8 @@ def calculate_stock_needs(semaine: str, convives: int = 150):
                 }
             
             ingredient_needs[ing_name]["quantite_besoin"] += qty_total
-            if recipe.nom not in ingredient_needs[ing_name]["recettes"]:
-                ingredient_needs[ing_name]["recettes"].append(recipe.nom)
+            if recipe_nom not in ingredient_needs[ing_name]["recettes"]:
+                ingredient_needs[ing_name]["recettes"].append(recipe_nom)
     
     # Compare with stock
     results = []
@@ -1579,21 +2043,15 @@ def calculate_stock_needs(semaine: str, convives: int = 150):
 # Endpoint to save planning from frontend
 @app.post("/api/planning")
 def save_planning(planning: dict):
-    """Save planning data to JSON file."""
-    planning_file = DATA_DIR / "planning.json"
-    with open(planning_file, "w", encoding="utf-8") as f:
-        json.dump(planning, f, indent=2, ensure_ascii=False)
+    """Save planning data."""
+    STORAGE.replace("planning", planning)
     return {"status": "success"}
 
 
 @app.get("/api/planning")
 def get_planning():
     """Get planning data."""
-    planning_file = DATA_DIR / "planning.json"
-    if planning_file.exists():
-        with open(planning_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    return STORAGE.all("planning")
 
 
 # ============ FEEDBACK & RATING SYSTEM ============
@@ -1603,27 +2061,6 @@ class MenuRatingInput(BaseModel):
     rating: int  # 1-5 carrots
     comment: Optional[str] = ""
 
-def load_feedback():
-    """Load feedback data from JSON file."""
-    feedback_file = DATA_DIR / "feedback.json"
-    if feedback_file.exists():
-        with open(feedback_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"ratings": [], "menu_scores": {}, "meta": {"last_updated": None}}
-
-def save_feedback(data: dict):
-    """Save feedback data to JSON file."""
-    data["meta"]["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(DATA_DIR / "feedback.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def calculate_popularity_score(ratings: List[dict]) -> float:
-    """Calculate average popularity score from ratings."""
-    if not ratings:
-        return 0.0
-    total = sum(r.get("rating", 0) for r in ratings)
-    return round(total / len(ratings), 2)
-
 @app.post("/api/feedback/rate")
 def submit_rating(rating_input: MenuRatingInput):
     """Submit a rating for a menu."""
@@ -1631,50 +2068,25 @@ def submit_rating(rating_input: MenuRatingInput):
     if rating_input.rating < 1 or rating_input.rating > 5:
         raise HTTPException(status_code=400, detail="La note doit être entre 1 et 5 carottes")
     
-    data = load_feedback()
-    
-    # Add new rating
-    new_rating = {
-        "id": f"rating_{len(data['ratings']) + 1:05d}",
-        "menu_date": rating_input.menu_date,
-        "rating": rating_input.rating,
-        "comment": rating_input.comment,
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    data["ratings"].append(new_rating)
-    
-    # Update menu score
-    menu_ratings = [r for r in data["ratings"] if r["menu_date"] == rating_input.menu_date]
-    popularity_score = calculate_popularity_score(menu_ratings)
-    
-    data["menu_scores"][rating_input.menu_date] = {
-        "score": popularity_score,
-        "total_ratings": len(menu_ratings),
-        "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    save_feedback(data)
+    # Queued with the running total of its date; written to storage by FEEDBACK
+    result = FEEDBACK.submit(rating_input.menu_date, rating_input.rating, rating_input.comment)
     
     return {
         "status": "success",
         "message": "Merci pour votre avis !",
-        "rating": new_rating,
-        "popularity_score": popularity_score,
-        "total_ratings": len(menu_ratings)
+        **result
     }
 
 @app.get("/api/feedback/menu/{menu_date}")
 def get_menu_feedback(menu_date: str):
     """Get all feedback for a specific menu date."""
-    data = load_feedback()
-    
-    menu_ratings = [r for r in data["ratings"] if r["menu_date"] == menu_date]
-    score_data = data["menu_scores"].get(menu_date, {
+    FEEDBACK.flush()
+    menu_ratings = STORAGE.find("ratings", menu_date=menu_date)
+    score_data = STORAGE.get("menu_scores", menu_date) or {
         "score": 0.0,
         "total_ratings": 0,
         "last_updated": None
-    })
+    }
     
     return {
         "menu_date": menu_date,
@@ -1684,10 +2096,27 @@ def get_menu_feedback(menu_date: str):
         "last_updated": score_data.get("last_updated")
     }
 
+@app.get("/api/feedback/popularite")
+def get_recipe_popularity(limit: int = 20):
+    """Recipes ranked by their ratings (menu dates joined to the planning)."""
+    index = load_popularity()
+    scores = index.scores()
+    recipes, _, _ = load_catalog()
+    names = {r.id: r.nom for r in recipes}
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return {
+        **index.stats(),
+        "recettes": [
+            {"recette_id": rid, "nom": names.get(rid, rid), "ecart_note": score}
+            for rid, score in ranked[:limit]
+        ],
+    }
+
 @app.get("/api/feedback/stats")
 def get_feedback_stats():
     """Get overall feedback statistics."""
-    data = load_feedback()
+    FEEDBACK.flush()
+    data = {"ratings": STORAGE.all("ratings"), "menu_scores": STORAGE.all("menu_scores")}
     
     # Calculate stats
     total_ratings = len(data["ratings"])
@@ -1772,30 +2201,13 @@ def generate_qr_code(menu_date: str, size: int = 300):
 
 # ============ ORDER GENERATION ============
 
-def load_orders():
-    """Load orders from JSON file."""
-    orders_file = DATA_DIR / "commandes.json"
-    if orders_file.exists():
-        with open(orders_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {"commandes": [], "meta": {"last_updated": None}}
-
-
-def save_orders(data: dict):
-    """Save orders to JSON file."""
-    data["meta"]["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-    with open(DATA_DIR / "commandes.json", "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-
 @app.get("/api/commandes")
 def get_orders(statut: str = ""):
     """Get all orders, optionally filtered by status."""
-    data = load_orders()
-    orders = data.get("commandes", [])
-    
     if statut:
-        orders = [o for o in orders if o.get("statut") == statut]
+        orders = STORAGE.find("commandes", statut=statut)
+    else:
+        orders = STORAGE.all("commandes")
     
     return {
         "count": len(orders),
@@ -1821,11 +2233,6 @@ def generate_orders(input_data: GenerateOrderInput):
     Generate orders from stock needs, grouped by supplier.
     Each supplier gets a separate order.
     """
-    data = load_orders()
-    orders = data.get("commandes", [])
-    stocks_data = load_stocks()
-    stocks = stocks_data.get("stocks", [])
-    
     # Group items by supplier
     by_supplier = {}
     
@@ -1833,7 +2240,7 @@ def generate_orders(input_data: GenerateOrderInput):
         # Find the stock to get supplier info
         stock = None
         if item.stock_id:
-            stock = next((s for s in stocks if s.get("id") == item.stock_id), None)
+            stock = STORAGE.get("stocks", item.stock_id)
         
         # Get supplier info
         fournisseur_id = stock.get("fournisseur_id", "unknown") if stock else "unknown"
@@ -1855,28 +2262,30 @@ def generate_orders(input_data: GenerateOrderInput):
     
     # Create orders
     new_orders = []
-    order_num = len(orders) + 1
-    
-    for fournisseur_id, order_data in by_supplier.items():
-        order_id = f"CMD-{datetime.now().strftime('%Y%m%d')}-{order_num:03d}"
+    with STORAGE.transaction():
+        order_num = STORAGE.count("commandes") + 1
         
-        new_order = {
-            "id": order_id,
-            "date_creation": datetime.now().strftime("%Y-%m-%d %H:%M"),
-            "semaine": input_data.semaine,
-            "fournisseur_id": fournisseur_id,
-            "fournisseur_nom": order_data["fournisseur_nom"],
-            "lignes": order_data["lignes"],
-            "nb_produits": len(order_data["lignes"]),
-            "statut": "brouillon"
-        }
-        
-        orders.append(new_order)
-        new_orders.append(new_order)
-        order_num += 1
-    
-    data["commandes"] = orders
-    save_orders(data)
+        for fournisseur_id, order_data in by_supplier.items():
+            order_id = f"CMD-{datetime.now().strftime('%Y%m%d')}-{order_num:03d}"
+            while STORAGE.get("commandes", order_id) is not None:
+                # A deleted order left its number to a later one
+                order_num += 1
+                order_id = f"CMD-{datetime.now().strftime('%Y%m%d')}-{order_num:03d}"
+            
+            new_order = {
+                "id": order_id,
+                "date_creation": datetime.now().strftime("%Y-%m-%d %H:%M"),
+                "semaine": input_data.semaine,
+                "fournisseur_id": fournisseur_id,
+                "fournisseur_nom": order_data["fournisseur_nom"],
+                "lignes": order_data["lignes"],
+                "nb_produits": len(order_data["lignes"]),
+                "statut": "brouillon"
+            }
+            
+            STORAGE.add("commandes", new_order)
+            new_orders.append(new_order)
+            order_num += 1
     
     return {
         "status": "success",
@@ -1888,34 +2297,30 @@ def generate_orders(input_data: GenerateOrderInput):
 @app.get("/api/commandes/{order_id}")
 def get_order(order_id: str):
     """Get a specific order by ID."""
-    data = load_orders()
-    for order in data.get("commandes", []):
-        if order.get("id") == order_id:
-            return order
+    order = STORAGE.get("commandes", order_id)
+    if order is not None:
+        return order
     raise HTTPException(status_code=404, detail=f"Commande {order_id} non trouvée")
 
 
 @app.put("/api/commandes/{order_id}/statut")
 def update_order_status(order_id: str, statut: str):
     """Update order status (brouillon, envoyee, livree, annulee)."""
-    data = load_orders()
-    orders = data.get("commandes", [])
-    
     valid_statuts = ["brouillon", "envoyee", "livree", "annulee"]
     if statut not in valid_statuts:
         raise HTTPException(status_code=400, detail=f"Statut invalide. Valeurs: {valid_statuts}")
     
-    for i, order in enumerate(orders):
-        if order.get("id") == order_id:
-            orders[i]["statut"] = statut
+    with STORAGE.transaction():
+        order = STORAGE.get("commandes", order_id)
+        if order is not None:
+            order["statut"] = statut
             if statut == "envoyee":
-                orders[i]["date_envoi"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+                order["date_envoi"] = datetime.now().strftime("%Y-%m-%d %H:%M")
             elif statut == "livree":
-                orders[i]["date_livraison"] = datetime.now().strftime("%Y-%m-%d %H:%M")
+                order["date_livraison"] = datetime.now().strftime("%Y-%m-%d %H:%M")
             
-            data["commandes"] = orders
-            save_orders(data)
-            return {"status": "success", "commande": orders[i]}
+            STORAGE.put("commandes", order)
+            return {"status": "success", "commande": order}
     
     raise HTTPException(status_code=404, detail=f"Commande {order_id} non trouvée")
 
@@ -1923,14 +2328,8 @@ def update_order_status(order_id: str, statut: str):
 @app.delete("/api/commandes/{order_id}")
 def delete_order(order_id: str):
     """Delete an order."""
-    data = load_orders()
-    orders = data.get("commandes", [])
-    
-    for i, order in enumerate(orders):
-        if order.get("id") == order_id:
-            deleted = orders.pop(i)
-            data["commandes"] = orders
-            save_orders(data)
-            return {"status": "success", "deleted": deleted}
+    deleted = STORAGE.delete("commandes", order_id)
+    if deleted is not None:
+        return {"status": "success", "deleted": deleted}
     
     raise HTTPException(status_code=404, detail=f"Commande {order_id} non trouvée")
@@ -0,0 +1,136 @@
+"""
+Cantine.OS - Recipe Popularity
+Joins the QR-code ratings of each menu date to the recipes planned that
+day, and keeps per-recipe averages up to date incrementally
+"""
+
+import threading
+from datetime import date
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+# Ratings a recipe needs before its own average outweighs the overall one
+PRIOR_RATINGS = 5
+
+
+def planned_recipes(planning: dict, menu_date: str) -> Tuple[str, ...]:
+    """
+    Recipe ids planned on `menu_date` (YYYY-MM-DD) in planning.json, whose
+    layout is { "<year>-W<iso week>": { "<day 0-4>": { component: recipe_id } } }
+    with the year of the week's Monday, as written by the frontend.
+    """
+    try:
+        day = date.fromisoformat(menu_date)
+    except (TypeError, ValueError):
+        return ()
+    if day.weekday() > 4:
+        return ()
+    monday = date.fromordinal(day.toordinal() - day.weekday())
+    week = planning.get(f"{monday.year}-W{monday.isocalendar()[1]}") or {}
+    meals = week.get(str(day.weekday())) or week.get(day.weekday()) or {}
+    if not isinstance(meals, dict):
+        return ()
+    return tuple(sorted({rid for rid in meals.values() if rid}))
+
+
+class PopularityIndex:
+    """
+    Running rating sums per menu date and per planned recipe.
+    Ratings are append-only, so sync() is only handed the ones added since
+    the last call (Storage.since from `cursor`): O(new ratings). When the planning changes,
+    recipe totals are rebuilt from the per-date totals (O(rated dates)),
+    never by rescanning the ratings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.processed = 0  # ratings already counted
+        self.cursor: Optional[int] = None  # Storage.since() cursor after them
+        self.planning_version: Hashable = None
+        self.total = [0, 0]  # sum, count over all ratings
+        self.by_date: Dict[str, List[int]] = {}  # menu_date -> [sum, count]
+        self.date_recipes: Dict[str, Tuple[str, ...]] = {}  # menu_date -> planned recipe ids
+        self.by_recipe: Dict[str, List[int]] = {}  # recipe id -> [sum, count]
+
+    def sync(self, ratings: List[dict], planning: dict, planning_version: Hashable = None,
+             cursor: Optional[int] = None, start_over: bool = False):
+        """
+        Count `ratings`, those added since the last sync (all of them with
+        `start_over`, when the stored ratings were rewritten); re-join dates
+        if the planning changed.
+        """
+        with self._lock:
+            if start_over:
+                self._reset()
+            if planning_version is None or planning_version != self.planning_version:
+                self.planning_version = planning_version
+                self._rejoin(planning)
+            for rating in ratings:
+                self._add(rating.get("menu_date"), rating.get("rating", 0), planning)
+            self.processed += len(ratings)
+            self.cursor = cursor
+
+    def _reset(self):
+        self.processed = 0
+        self.total = [0, 0]
+        self.by_date.clear()
+        self.date_recipes.clear()
+        self.by_recipe.clear()
+
+    def _rejoin(self, planning: dict):
+        self.date_recipes = {menu_date: planned_recipes(planning, menu_date) for menu_date in self.by_date}
+        self.by_recipe = {}
+        for menu_date, (total, count) in self.by_date.items():
+            for rid in self.date_recipes[menu_date]:
+                stats = self.by_recipe.setdefault(rid, [0, 0])
+                stats[0] += total
+                stats[1] += count
+
+    def _add(self, menu_date: Optional[str], rating: int, planning: dict):
+        if not menu_date or not rating:
+            return
+        self.total[0] += rating
+        self.total[1] += 1
+        stats = self.by_date.setdefault(menu_date, [0, 0])
+        stats[0] += rating
+        stats[1] += 1
+        if menu_date not in self.date_recipes:
+            self.date_recipes[menu_date] = planned_recipes(planning, menu_date)
+        for rid in self.date_recipes[menu_date]:
+            stats = self.by_recipe.setdefault(rid, [0, 0])
+            stats[0] += rating
+            stats[1] += 1
+
+    def mean(self) -> Optional[float]:
+        total, count = self.total
+        return total / count if count else None
+
+    def scores(self, prior_ratings: int = PRIOR_RATINGS) -> Dict[str, float]:
+        """
+        recipe id -> stars above (+) or below (-) the overall average, with each
+        recipe's average shrunk towards the overall one while it has few ratings.
+        Recipes never rated are left out (neutral).
+        """
+        with self._lock:
+            mean = self.mean()
+            if mean is None:
+                return {}
+            return {
+                rid: round((total + prior_ratings * mean) / (count + prior_ratings) - mean, 3)
+                for rid, (total, count) in self.by_recipe.items()
+            }
+
+    def version(self) -> Tuple:
+        """Changes whenever scores() may change."""
+        with self._lock:
+            return (self.processed, self.planning_version)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            mean = self.mean()
+            return {
+                "total_ratings": self.total[1],
+                "note_moyenne": round(mean, 2) if mean is not None else None,
+                "dates_notees": len(self.by_date),
+                "recettes_notees": len(self.by_recipe),
+            }
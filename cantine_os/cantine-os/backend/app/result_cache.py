@@ -0,0 +1,149 @@
+"""
+Cantine.OS - Generated Menu Result Cache
+Content-addressed cache of solved menus: in-memory LRU in front of an
+on-disk JSON store that survives restarts
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Hashable, Optional
+
+from .lru import LRUCache
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a data file's content."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def request_key(payload: Dict, catalog_digest: Hashable) -> str:
+    """Canonical hash of a request payload and the catalog it is solved against."""
+    canonical = json.dumps({"requete": payload, "catalogue": catalog_digest},
+                           sort_keys=True, default=str, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Solved menus keyed by request hash, one generation per catalog digest.
+    Entries live in a thread-safe LRU and in `directory/<digest>/<key>.json`;
+    when the catalog digest changes, both tiers are dropped. Keys also
+    change with stocks and ratings, so the disk tier is capped at
+    `max_disk_entries` files: past it, the least recently used (by mtime,
+    refreshed on disk hits) are deleted down to 90% of the cap.
+    """
+
+    def __init__(self, directory: Path, max_entries: int = 256, max_disk_entries: int = 4096):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._disk_entries = 0  # files in the current generation's folder
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.disk_evictions = 0
+
+    def _use_generation(self, catalog_digest: Hashable) -> Path:
+        # Caller holds self._lock
+        generation = hashlib.sha256(repr(catalog_digest).encode("utf-8")).hexdigest()[:16]
+        if generation != self._generation:
+            if self._generation is not None:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generation = generation
+            folder = self.directory / generation
+            self._disk_entries = len(list(folder.glob("*.json"))) if folder.exists() else 0
+            # Forget results computed against other versions of the data files
+            if self.directory.exists():
+                for child in self.directory.iterdir():
+                    if child.is_dir() and child.name != generation:
+                        shutil.rmtree(child, ignore_errors=True)
+        return self.directory / generation
+
+    def get(self, key: str, catalog_digest: Hashable) -> Optional[Dict]:
+        with self._lock:
+            folder = self._use_generation(catalog_digest)
+            result = self._entries.get(key)
+            if result is not None:
+                self.memory_hits += 1
+                return result
+            path = folder / f"{key}.json"
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self._entries.put(key, result)
+            return result
+
+    def put(self, key: str, catalog_digest: Hashable, result: Dict):
+        with self._lock:
+            folder = self._use_generation(catalog_digest)
+            self._entries.put(key, result)
+            folder.mkdir(parents=True, exist_ok=True)
+            path = folder / f"{key}.json"
+            if not path.exists():
+                self._disk_entries += 1
+            # Write then rename, so that readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            if self._disk_entries > self.max_disk_entries:
+                self._evict_disk(folder)
+
+    def _evict_disk(self, folder: Path):
+        # Caller holds self._lock
+        files = []
+        for path in folder.glob("*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        files.sort()
+        excess = len(files) - int(self.max_disk_entries * 0.9)
+        for _, path in files[:max(0, excess)]:
+            path.unlink(missing_ok=True)
+            self._entries.pop(path.stem)
+            self.disk_evictions += 1
+        self._disk_entries = len(files) - max(0, excess)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "entrees_memoire": len(self._entries),
+                "entrees_disque": self._disk_entries,
+                "hits_memoire": self.memory_hits,
+                "hits_disque": self.disk_hits,
+                "misses": self.misses,
+                "taux_de_hit": round(hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+                "evictions_disque": self.disk_evictions,
+            }
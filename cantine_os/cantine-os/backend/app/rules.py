@@ -0,0 +1,142 @@
+"""
+Cantine.OS - GEMRCN Frequency Rules
+The "regles" section of gemrcn_constraints.json, compiled against the
+recipe catalog into bitsets (bit i = i-th recipe of the catalog)
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class FrequencyRule:
+    """
+    At least (sens "min") or at most (sens "max") N servings over 20 meals
+    of the `composante` recipes that carry one of `tags` (or a tag containing
+    one of `tags_contenant`) and none of the excluded ones. N is read from the
+    population's frequences_sur_20_repas under the first of `cles` present,
+    else `defaut`.
+    """
+    id: str
+    composante: str
+    sens: str  # "min" | "max"
+    cles: Tuple[str, ...]
+    defaut: int
+    tags: Tuple[str, ...] = ()
+    tags_contenant: Tuple[str, ...] = ()
+    sauf_tags: Tuple[str, ...] = ()
+    sauf_tags_contenant: Tuple[str, ...] = ()
+    libelle: str = ""
+
+    @property
+    def family(self) -> str:
+        return f"gemrcn.{self.id}"
+
+    def limit(self, frequencies: Dict) -> int:
+        for key in self.cles:
+            if key in frequencies:
+                return frequencies[key]
+        return self.defaut
+
+
+def parse_rules(gemrcn: dict, components: Sequence[str]) -> Tuple[FrequencyRule, ...]:
+    """
+    Rules of the "regles" section, in file order. Each entry reads
+    {"id", "composante", "sens", "cles" (default [id]), "defaut", "tags",
+    "tags_contenant", "sauf_tags", "sauf_tags_contenant", "libelle"}.
+    """
+    rules = []
+    seen = set()
+    for entry in gemrcn.get("regles", []):
+        rule_id = entry["id"]
+        if rule_id in seen:
+            raise ValueError(f"Règle GEMRCN en double : {rule_id}")
+        seen.add(rule_id)
+        if entry["composante"] not in components:
+            raise ValueError(f"Composante inconnue pour la règle {rule_id} : {entry['composante']}")
+        if entry.get("sens") not in ("min", "max"):
+            raise ValueError(f"Sens invalide pour la règle {rule_id} : {entry.get('sens')} (min ou max)")
+        if not entry.get("tags") and not entry.get("tags_contenant"):
+            raise ValueError(f"La règle {rule_id} ne sélectionne aucun tag")
+        rules.append(FrequencyRule(
+            id=rule_id,
+            composante=entry["composante"],
+            sens=entry["sens"],
+            cles=tuple(entry.get("cles", [rule_id])),
+            defaut=int(entry.get("defaut", 0)),
+            tags=tuple(entry.get("tags", [])),
+            tags_contenant=tuple(entry.get("tags_contenant", [])),
+            sauf_tags=tuple(entry.get("sauf_tags", [])),
+            sauf_tags_contenant=tuple(entry.get("sauf_tags_contenant", [])),
+            libelle=entry.get("libelle", ""),
+        ))
+    return tuple(rules)
+
+
+class RuleIndex:
+    """
+    A catalog compiled against the rules: one bitset per tag and per recipe
+    type, then one per rule, (type & any selected tag) & ~(any excluded tag).
+    Selecting a rule's recipes among any subset of the catalog is then an AND
+    with the subset's bitset.
+    """
+
+    def __init__(self, rules: Tuple[FrequencyRule, ...], recipes: List):
+        self.rules = rules
+        self.positions = {r.id: i for i, r in enumerate(recipes)}  # recipe id -> bit
+        self.type_bits: Dict[str, int] = {}
+        self.tag_bits: Dict[str, int] = {}
+        for i, r in enumerate(recipes):
+            bit = 1 << i
+            self.type_bits[r.type] = self.type_bits.get(r.type, 0) | bit
+            for tag in r.tags:
+                self.tag_bits[tag] = self.tag_bits.get(tag, 0) | bit
+        self.rule_bits = [
+            self.type_bits.get(rule.composante, 0)
+            & self._bits(rule.tags, rule.tags_contenant)
+            & ~self._bits(rule.sauf_tags, rule.sauf_tags_contenant)
+            for rule in rules
+        ]
+        self.labels = {rule.family: rule.libelle for rule in rules if rule.libelle}
+
+    def _bits(self, tags: Iterable[str], substrings: Iterable[str]) -> int:
+        bits = 0
+        for tag in tags:
+            bits |= self.tag_bits.get(tag, 0)
+        for part in substrings:
+            for tag, tag_bits in self.tag_bits.items():
+                if part in tag:
+                    bits |= tag_bits
+        return bits
+
+    def bits_of(self, recipes: Iterable) -> int:
+        """Bitset of catalog recipes (recipes outside the catalog are ignored)."""
+        bits = 0
+        for r in recipes:
+            position = self.positions.get(r.id)
+            if position is not None:
+                bits |= 1 << position
+        return bits
+
+    def contains(self, bits: int, recipe_id: Optional[str]) -> bool:
+        position = self.positions.get(recipe_id)
+        return position is not None and bool(bits >> position & 1)
+
+    def memberships(self, recipe) -> Tuple[bool, ...]:
+        """The rules a recipe counts for: recipes with equal memberships are interchangeable."""
+        return tuple(self.contains(bits, recipe.id) for bits in self.rule_bits)
+
+
+# Last compiled (gemrcn, catalog): both are loaded once and shared between requests
+_compiled: Tuple = (None, None, None)
+
+
+def compile_rules(gemrcn: dict, recipes: List, components: Sequence[str]) -> RuleIndex:
+    """RuleIndex of the catalog, rebuilt only when the GEMRCN file or the catalog changes."""
+    global _compiled
+    cached_gemrcn, cached_recipes, index = _compiled
+    if cached_gemrcn is gemrcn and cached_recipes is recipes:
+        return index
+    index = RuleIndex(parse_rules(gemrcn, components), recipes)
+    _compiled = (gemrcn, recipes, index)
+    return index
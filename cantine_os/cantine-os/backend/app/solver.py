@@ -1,14 +1,56 @@
 """
 Cantine.OS - Menu Optimization Solver
 Using Google OR-Tools CP-SAT for constraint programming
+
+Demo (a 5-day primary school menu), from the backend directory:
+    python -m app.solver
 """
 
 import json
+import math
+import threading
+import time
+from datetime import date, timedelta
 from ortools.sat.python import cp_model
-from dataclasses import dataclass
-from typing import List, Dict, Optional
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Optional, Tuple, Hashable, Callable, Iterator, Union
 from pathlib import Path
 
+from .rules import FrequencyRule, RuleIndex, compile_rules
+from .heuristic import MenuHeuristic
+from .lru import LRUCache
+
+
+COMPONENTS = ["entree", "plat_principal", "garniture", "dessert", "produit_laitier"]
+
+# Length of the default "same main dish not within N days" window
+VARIETY_WINDOW = 5
+
+# GEMRCN frequencies are expressed over 20 successive meals
+GEMRCN_PERIOD = 20
+
+# Bulk discounts on the whole quantity ordered: (minimum kg, discount), largest first
+VOLUME_TIERS = ((100, 0.20), (50, 0.10))
+
+# Mixed canteens: serving a population another dish than the reference menu
+# costs as much as this many cents per meal (a second preparation)
+SHARING_PENALTY_CENTS = 50
+
+# A recipe rated one star above the average is worth this many cents per meal
+POPULARITY_CENTS_PER_STAR = 100
+
+# Constraint families reported by MenuSolver.explain()
+# (GEMRCN frequency families, "gemrcn.<rule id>", are labelled by their rule)
+CONSTRAINT_FAMILIES = {
+    "budget": "Budget maximum par repas",
+    "egalim.vegetarien_semaine": "Egalim : au moins un plat végétarien par semaine",
+    "equipement": "Équipements disponibles en cuisine",
+    "saison": "Recettes de saison",
+    "variete": f"Variété : pas le même plat principal sur {VARIETY_WINDOW} jours",
+    "changements": "Nombre maximum de changements par rapport au menu précédent",
+    **{f"variete.{comp}": f"Variété : répétitions de {comp.replace('_', ' ')} sur la fenêtre" for comp in COMPONENTS},
+}
+
 
 @dataclass
 class Recipe:
@@ -29,6 +71,7 @@ class Recipe:
     tags: List[str]
     equipement: List[str]
     mois_saison: List[int]
+    ingredients: List[Dict] = field(default_factory=list)  # {"nom", "quantite_kg" per portion, "cout_euro_kg"}
 
 
 @dataclass
@@ -50,6 +93,128 @@ class CanteenConfig:
     priorite_local: float  # 0-1
     priorite_budget: float  # 0-1
     equipement_disponible: List[str] = None  # Available kitchen equipment
+    date_debut: Optional[date] = None  # First meal; enables seasonal recipe filtering
+    priorite_popularite: float = 0.0  # 0-1, weight of the recipes' feedback ratings
+    variete: Optional[List[Dict]] = None  # repeat windows, replacing the "variete" rules of the GEMRCN file
+
+
+@dataclass(frozen=True)
+class VarietyRule:
+    """
+    At most `max_par_fenetre` servings of the same recipe (or of the same
+    family, when `familles` is set) as `composante` within any
+    `fenetre_jours` consecutive days.
+    """
+    composante: str
+    fenetre_jours: int
+    max_par_fenetre: int = 1
+    familles: Optional[Tuple[Tuple[str, Tuple[str, ...]], ...]] = None  # (family, tags), first match wins
+
+    def group(self, recipe: "Recipe") -> Optional[str]:
+        """Recipe id, or family name (None: the recipe belongs to no family)."""
+        if self.familles is None:
+            return recipe.id
+        for name, tags in self.familles:
+            if any(tag in recipe.tags for tag in tags):
+                return name
+        return None
+
+    @property
+    def constraint_family(self) -> str:
+        if self.composante == "plat_principal" and self.familles is None:
+            return "variete"
+        return f"variete.{self.composante}"
+
+
+@dataclass(frozen=True)
+class StockLot:
+    """On-hand stock of recipe ingredients, usable on the first `jours_utilisables` days."""
+    stock_id: str
+    produit: str
+    ingredients: Tuple[str, ...]  # recipe ingredient names the product stands for
+    quantite_kg: float
+    dlc: Optional[date]
+    jours_utilisables: int  # days of the horizon served on or before the DLC
+    prix_kg: float  # value of a kg consumed instead of wasted
+
+
+@dataclass
+class PlanHistory:
+    """
+    What a rolling-horizon solve carries from one chunk to the next.
+    Only the last GEMRCN_PERIOD days are kept, so memory stays bounded.
+    """
+    days: List[Dict[str, str]] = field(default_factory=list)  # component -> recipe_id, oldest first
+    budget_carry_cents: int = 0  # unspent budget of previous chunks
+
+    def append_menu(self, menu: Dict, budget_cents: int):
+        for jour in menu["jours"]:
+            self.days.append({comp: d["id"] for comp, d in jour["composantes"].items()})
+        del self.days[:-GEMRCN_PERIOD]
+        spent_cents = sum(int(round(jour["cout_total"] * 100)) for jour in menu["jours"])
+        self.budget_carry_cents = max(0, budget_cents - spent_cents)
+
+
+@dataclass
+class ModelTemplate:
+    """
+    A built CP-SAT model: decision variables + structural constraints.
+    Request-specific parts (budget bound, objective weights) are patched
+    on a clone of `model` for every solve.
+    """
+    model: cp_model.CpModel
+    x: Dict
+    x_slots: Dict  # component -> per-day variable lists
+    budget_ct: int  # proto index of the budget constraint
+    obj_vars: List
+    cost_coefs: List[int]  # cents
+    carbon_coefs: List[int]  # grams CO2
+    local_coefs: List[int]  # -100 if local
+    obj_recipe_ids: List[str] = field(default_factory=list)  # recipe of each obj_vars entry
+    obj_weights: List[int] = field(default_factory=list)  # population weight of each obj_vars entry
+    # Ingredient-level cost (optional): tier segment quantities (g) and their prices (cents/kg)
+    ingredient_vars: List = field(default_factory=list)
+    ingredient_coefs: List[int] = field(default_factory=list)
+    # Mixed canteens: one selection per GEMRCN population (x is the reference one)
+    pop_x: Dict = field(default_factory=dict)
+    pop_x_slots: Dict = field(default_factory=dict)
+    penalty_vars: List = field(default_factory=list)  # "differs from the reference dish"
+    # Stock consumption (optional): grams used of each lot before its DLC, and their value (cents/kg)
+    stock_vars: List = field(default_factory=list)
+    stock_coefs: List[int] = field(default_factory=list)
+    stock_lots: List[StockLot] = field(default_factory=list)
+
+
+class ModelCache(LRUCache):
+    """
+    LRU cache of ModelTemplate, keyed by
+    (catalog version, equipment set, population key, nb_jours).
+    """
+
+    def __init__(self, max_entries: int = 32):
+        super().__init__(max_entries)
+
+
+class MenuSolutionCallback(cp_model.CpSolverSolutionCallback):
+    """Reports every improving solution found during the search."""
+
+    def __init__(self, menu_solver: "MenuSolver", on_solution: Callable[[Dict], None]):
+        super().__init__()
+        self.menu_solver = menu_solver
+        self.on_solution = on_solution
+        self.solution_count = 0
+
+    def OnSolutionCallback(self):
+        self.solution_count += 1
+        menu = self.menu_solver._extract_solution(self)
+        self.on_solution({
+            "solution": self.solution_count,
+            "objectif": self.ObjectiveValue(),
+            "temps_s": round(self.WallTime(), 3),
+            "cout_total": menu["stats"]["cout_total"],
+            "co2_total_kg": round(sum(j["co2_total"] for j in menu["jours"]), 2),
+            "menu": menu,
+        })
 
 
 class MenuSolver:
@@ -58,10 +223,58 @@ class MenuSolver:
     Solves: Egalim + GEMRCN + Budget + Carbon constraints.
     """
 
-    def __init__(self, config: CanteenConfig, recipes: List[Recipe], gemrcn: dict):
+    # Variety windows: "auto", "cumul" (running counts) or "fenetres" (one constraint per window)
+    variety_encoding = "auto"
+
+    def __init__(self, config: CanteenConfig, recipes: List[Recipe], gemrcn: dict,
+                 model_cache: Optional[ModelCache] = None, catalog_version: Hashable = None,
+                 prune_dominated: bool = True, history: Optional[PlanHistory] = None,
+                 explain: bool = False, ingredient_prices: Optional[Dict[str, float]] = None,
+                 stocks: Optional[Dict[str, List[StockLot]]] = None,
+                 popularity: Optional[Dict[str, float]] = None):
         self.config = config
         self.gemrcn = gemrcn
         self.model = cp_model.CpModel()
+        self.model_cache = model_cache
+        self.catalog_version = catalog_version
+        # Explain mode: every constraint family is guarded by a literal
+        # (no pruning, the recipe filters become constraint families too)
+        self.explain_mode = explain
+        # Feedback: recipe id -> stars above / below the average rating (see popularity.py)
+        self.popularity = (popularity or {}) if config.priorite_popularite > 0 else {}
+        # No pruning in explain mode, nor where dominance on portion cost does not hold:
+        # shared ingredients with volume tiers (ingredient_prices), recipes rewarded for
+        # the stock lots they use (stocks) or for their ratings (popularity)
+        self.prune_dominated = (prune_dominated and not explain and ingredient_prices is None
+                                and not stocks and not self.popularity)
+        self.assumptions = {}  # family -> assumption literal
+        self.relaxable = {}  # family -> (expression, sense, bound) for families with a numeric bound
+        # Rolling horizon: previous days counted by the GEMRCN / variety constraints
+        self.history = history
+        self.history_days = []
+        if history is not None and config.nb_jours < GEMRCN_PERIOD:
+            self.history_days = history.days[-(GEMRCN_PERIOD - config.nb_jours):]
+
+        # Populations served (GEMRCN key -> cost weight from effectifs); the first
+        # convive's population plans the reference menu, the others share its
+        # dishes unless their own frequencies call for a different one
+        self.population_weights = population_weights(config.convives, gemrcn)
+        self.primary_population = self.population_key()
+        self.cost_scale = sum(self.population_weights.values())
+        # Convives per unit of population weight (effectif = weight * headcount_unit)
+        self.headcount_unit = max(1, sum(population_effectifs(config.convives, gemrcn).values()) // self.cost_scale)
+
+        # Ingredient-level cost: €/kg per ingredient; the cost term then prices the
+        # ingredient quantities of the whole horizon with volume tiers
+        self.ingredient_prices = ingredient_prices
+
+        # Perishable stock: ingredient -> lots (see ingredients.stock_index); consuming
+        # a lot before its DLC is rewarded by the value it saves from the bin
+        self.stocks = stocks or {}
+
+        # GEMRCN frequency rules ("regles" of the GEMRCN file) compiled to
+        # catalog bitsets; cached across requests sharing the same catalog
+        self.rule_index = compile_rules(gemrcn, recipes, COMPONENTS)
 
         # Filter recipes by available equipment (if specified)
         if config.equipement_disponible:
@@ -74,315 +287,751 @@ class MenuSolver:
         else:
             self.recipes = recipes
 
+        # Variety rules are enabled from the catalog before pruning,
+        # so that pruning never changes which constraints apply
+        self.variety_rules = [
+            rule for rule in variety_rules(gemrcn, config.variete)
+            if variety_applicable(rule, self.recipes)
+        ]
+
+        self.equipment_excluded = set()
+        if explain:
+            self.equipment_excluded = {r.id for r in recipes} - {r.id for r in self.recipes}
+            self.recipes = recipes
+
+        # Drop recipes that can never be part of a better menu
+        self.pruned_recipes = []
+        if self.prune_dominated:
+            self.recipes, self.pruned_recipes = prune_dominated_recipes(
+                self.recipes, self.rule_index, self.variety_rules
+            )
+            if self.pruned_recipes:
+                print(f"Dominance pruning: removed {len(self.pruned_recipes)} recipes "
+                      f"({len(self.pruned_recipes) * config.nb_jours} variables).")
+
         # Index recipes by type
         self.recipes_by_type = {}
         for r in self.recipes:
             if r.type not in self.recipes_by_type:
                 self.recipes_by_type[r.type] = []
             self.recipes_by_type[r.type].append(r)
+        self.recipe_bits = self.rule_index.bits_of(self.recipes)
+
+        # Seasonality: calendar month of each day, and the recipes in season per month
+        self.day_dates = school_days(config.date_debut, config.nb_jours) if config.date_debut else []
+        self.month_index = build_month_index(self.recipes) if config.date_debut else {}
+
+        # Recipes that get a variable on each day: day_recipes[comp][d]
+        self.day_recipes = {}
+        for comp in COMPONENTS:
+            all_year = self.recipes_by_type.get(comp, [])
+            self.day_recipes[comp] = [
+                self.month_index.get(day.month, {}).get(comp, []) if self.day_dates and not explain else all_year
+                for day in (self.day_dates or [None] * config.nb_jours)
+            ]
 
         # Decision variables: x[day, component, recipe_id] = 1 if selected
         self.x = {}
+        self.x_slots = {}
+        self.pop_x = {}
+        self.pop_x_slots = {}
+        self.template = None
+        # Previous plan used for warm starts: (day, component) -> recipe_id
+        self.previous_selection = {}
+        # Running CP-SAT solver, so that stop() can interrupt the search
+        self.cp_solver = None
+        self.stop_requested = False
+        # CP-SAT status of the last solve (INFEASIBLE vs. UNKNOWN on timeout)
+        self.last_status = None
+        # Objective coefficient of each template.obj_vars entry (None with ingredient / stock terms)
+        self.objective_weights = None
+
+    def population_key(self) -> str:
+        """GEMRCN population matching the first convive profile (default 'elementaire')."""
+        if self.config.convives and hasattr(self.config.convives[0], 'age_min'):
+            return population_for_age(self.config.convives[0].age_min)
+        return 'elementaire'
+
+    def template_key(self) -> Tuple:
+        """Everything the structural part of the model depends on."""
+        return (
+            self.catalog_version,
+            frozenset(self.config.equipement_disponible or []),
+            tuple(self.population_weights.items()),
+            self.config.nb_jours,
+            self.prune_dominated,
+            tuple(day.month for day in self.day_dates),
+            tuple(sorted(self.ingredient_prices.items())) if self.ingredient_prices is not None else None,
+            tuple((name, tuple(lots)) for name, lots in sorted(self.stocks.items())),
+            tuple(self.variety_rules),
+            self.variety_encoding,
+        )
 
     def build_model(self):
-        """Build the constraint model."""
+        """
+        Build the constraint model.
+        With a model cache, the structural part is reused from a previous
+        request and only the budget bound and objective weights are patched.
+        """
+        if (self.model_cache is not None and self.catalog_version is not None
+                and self.history is None and not self.explain_mode):
+            key = self.template_key()
+            template = self.model_cache.get(key)
+            if template is None:
+                template = self._build_template()
+                self.model_cache.put(key, template)
+            else:
+                print("Model template cache hit.")
+            # Never mutate the shared template: patch a private copy
+            self.model = template.model.Clone()
+        else:
+            template = self._build_template()
+
+        self.template = template
+        self.x = template.x
+        self.x_slots = template.x_slots
+        self.pop_x = template.pop_x
+        self.pop_x_slots = template.pop_x_slots
+        self._apply_request()
+
+    def budget_cents(self) -> int:
+        """Budget of this solve, plus any savings carried over from previous chunks."""
+        budget_cents = int(self.config.budget_max_par_repas * 100 * self.config.nb_jours)
+        if self.history is not None:
+            budget_cents += self.history.budget_carry_cents
+        return budget_cents
+
+    def _apply_request(self):
+        """Patch the budget bound and the objective weights for this request."""
+        template = self.template
+
+        budget_cents = self.budget_cents()
+        domain = self.model.Proto().constraints[template.budget_ct].linear.domain
+        domain[len(domain) - 1] = budget_cents * self.cost_scale
+
+        # OBJECTIVE: Minimize weighted sum of cost + carbon - local bonus
+        alpha = int(self.config.priorite_budget * 100)
+        beta = int(self.config.priorite_carbone * 100)
+        gamma = int(self.config.priorite_local * 100)
+        penalty = 100 * SHARING_PENALTY_CENTS * self.cost_scale
+        # Feedback ratings (request data: patched here, never part of the cached template)
+        delta = int(self.config.priorite_popularite * 100)
+        popular = [
+            -round(POPULARITY_CENTS_PER_STAR * self.popularity.get(rid, 0)) * weight
+            for rid, weight in zip(template.obj_recipe_ids, template.obj_weights)
+        ] if self.popularity else [0] * len(template.obj_vars)
+        if template.ingredient_vars or template.stock_vars:
+            # Ingredient cost and stock value are in millicents for all convives: bring
+            # the per-portion terms and the sharing penalty to the same scale
+            unit = 1000 * self.headcount_unit
+            cost_weight = 0 if template.ingredient_vars else unit * alpha
+            weights = [
+                cost_weight * c + unit * (beta * g + gamma * l + delta * p)
+                for c, g, l, p in zip(template.cost_coefs, template.carbon_coefs, template.local_coefs, popular)
+            ]
+            self.model.Minimize(cp_model.LinearExpr.WeightedSum(
+                template.obj_vars + template.penalty_vars + template.ingredient_vars + template.stock_vars,
+                weights + [unit * penalty] * len(template.penalty_vars)
+                + [alpha * c for c in template.ingredient_coefs]
+                + [-alpha * c for c in template.stock_coefs],
+            ))
+            self.objective_weights = None
+            return
+
+        weights = [
+            alpha * c + beta * g + gamma * l + delta * p
+            for c, g, l, p in zip(template.cost_coefs, template.carbon_coefs, template.local_coefs, popular)
+        ]
+        self.objective_weights = weights
+        self.model.Minimize(cp_model.LinearExpr.WeightedSum(
+            template.obj_vars + template.penalty_vars,
+            weights + [penalty] * len(template.penalty_vars),
+        ))
+
+    def _constrain(self, family: str, constraint, expr=None, sense: Optional[str] = None,
+                   bound: Optional[int] = None):
+        """
+        Tag a constraint with its family. In explain mode it is only enforced
+        when the family's assumption literal is true.
+        """
+        if self.explain_mode:
+            literal = self.assumptions.get(family)
+            if literal is None:
+                literal = self.assumptions[family] = self.model.NewBoolVar(f"assume_{family}")
+            constraint.OnlyEnforceIf(literal)
+            if expr is not None:
+                self.relaxable[family] = (expr, sense, bound)
+        return constraint
+
+    def _at_least(self, family: str, expr, bound: int):
+        return self._constrain(family, self.model.Add(expr >= bound), expr, ">=", bound)
+
+    def _at_most(self, family: str, expr, bound: int):
+        return self._constrain(family, self.model.Add(expr <= bound), expr, "<=", bound)
+
+    def _members(self, subset: Union[List[Recipe], int]) -> Callable[[Optional[str]], bool]:
+        """Membership test on recipe ids for a list of recipes or a RuleIndex bitset."""
+        if isinstance(subset, int):
+            return lambda rid: self.rule_index.contains(subset, rid)
+        return {r.id for r in subset}.__contains__
+
+    def _select(self, comp: str, subset: Union[List[Recipe], int], days=None,
+                x_slots: Optional[Dict] = None) -> List:
+        """
+        Variables of the `subset` recipes served as `comp` on `days` (default: all),
+        in the reference selection or in `x_slots`.
+        """
+        member = self._members(subset)
+        index_cache = {}  # day recipe lists are shared between days of the same month
+        selected = []
+        for d in (range(self.config.nb_jours) if days is None else days):
+            recipes = self.day_recipes[comp][d]
+            idx = index_cache.get(id(recipes))
+            if idx is None:
+                idx = index_cache[id(recipes)] = [i for i, r in enumerate(recipes) if member(r.id)]
+            slot = (x_slots or self.x_slots)[comp][d]
+            selected.extend(slot[i] for i in idx)
+        return selected
+
+    def _count(self, comp: str, subset: Union[List[Recipe], int], x_slots: Optional[Dict] = None):
+        """Number of days on which one of `subset` is served as `comp`."""
+        member = self._members(subset)
+        # Days already served in previous chunks of a rolling-horizon solve
+        # (the history records the reference menu only)
+        history_days = self.history_days if x_slots is None or x_slots is self.x_slots else []
+        served = sum(1 for day in history_days if member(day.get(comp)))
+        return cp_model.LinearExpr.Sum(self._select(comp, subset, x_slots=x_slots)) + served
+
+    def _build_template(self) -> ModelTemplate:
+        """Build the decision variables and all request-independent constraints."""
         print("Building optimization model...")
 
-        components = ["entree", "plat_principal", "garniture", "dessert", "produit_laitier"]
+        components = COMPONENTS
         days = range(self.config.nb_jours)
 
-        # Create decision variables
-        for d in days:
-            for comp in components:
-                if comp in self.recipes_by_type:
-                    for recipe in self.recipes_by_type[comp]:
-                        self.x[(d, comp, recipe.id)] = self.model.NewBoolVar(
-                            f"x_{d}_{comp}_{recipe.id}"
-                        )
+        # Coefficient arrays, computed once per distinct recipe list (one per
+        # component, or one per component and month with seasonal filtering)
+        coef_cache = {}
+
+        def coefficients(recipes: List[Recipe]) -> Tuple[List[int], List[int], List[int]]:
+            coefs = coef_cache.get(id(recipes))
+            if coefs is None:
+                coefs = coef_cache[id(recipes)] = (
+                    [int(r.cout_portion_euro * 100) for r in recipes],
+                    [int(r.co2_kg_portion * 1000) for r in recipes],
+                    [-100 if r.local else 0 for r in recipes],
+                )
+            return coefs
+
+        # Create decision variables (out-of-season recipes get none), one selection per population
+        # x_slots[comp][d] lists the variables of day d, aligned with day_recipes[comp][d]
+        for population in self.population_weights:
+            primary = population == self.primary_population
+            prefix = "x" if primary else f"x_{population}"
+            x = self.x if primary else {}
+            x_slots = {comp: [] for comp in components}
+            for d in days:
+                for comp in components:
+                    slot = []
+                    for recipe in self.day_recipes[comp][d]:
+                        var = self.model.NewBoolVar(f"{prefix}_{d}_{comp}_{recipe.id}")
+                        x[(d, comp, recipe.id)] = var
+                        slot.append(var)
+                    x_slots[comp].append(slot)
+            self.pop_x[population] = x
+            self.pop_x_slots[population] = x_slots
+        self.x_slots = self.pop_x_slots[self.primary_population]
 
         # CONSTRAINT 1: Exactly one recipe per component per day
-        for d in days:
+        for x_slots in self.pop_x_slots.values():
             for comp in components:
-                if comp in self.recipes_by_type:
-                    self.model.Add(
-                        sum(
-                            self.x[(d, comp, r.id)]
-                            for r in self.recipes_by_type[comp]
-                        )
-                        == 1
-                    )
-
-        # CONSTRAINT 2: Budget constraint (user-defined)
-        total_cost = sum(
-            self.x[(d, comp, r.id)] * int(r.cout_portion_euro * 100)  # cents for integer math
-            for d in days
-            for comp in components
-            if comp in self.recipes_by_type
-            for r in self.recipes_by_type[comp]
+                if self.recipes_by_type.get(comp):
+                    for slot in x_slots[comp]:
+                        self.model.AddExactlyOne(slot)
+
+        # Mixed canteens: a population is served the reference dish, unless it pays
+        # the sharing penalty for that (day, component)
+        penalty_vars = []
+        for population, x_slots in self.pop_x_slots.items():
+            if population == self.primary_population:
+                continue
+            for comp in components:
+                if not self.recipes_by_type.get(comp):
+                    continue
+                for d in days:
+                    differs = self.model.NewBoolVar(f"differs_{population}_{d}_{comp}")
+                    for var, reference in zip(x_slots[comp][d], self.x_slots[comp][d]):
+                        self.model.Add(var == reference).OnlyEnforceIf(differs.Not())
+                    penalty_vars.append(differs)
+
+        # Explain mode: recipes the filters would have removed are forbidden by their family
+        if self.explain_mode:
+            by_id = {r.id: r for r in self.recipes}
+            selections = [item for x in self.pop_x.values() for item in x.items()]
+            incompatible = [var for (d, comp, rid), var in selections if rid in self.equipment_excluded]
+            if incompatible:
+                self._constrain("equipement", self.model.Add(cp_model.LinearExpr.Sum(incompatible) == 0))
+            out_of_season = [
+                var for (d, comp, rid), var in selections
+                if self.day_dates and by_id[rid].mois_saison
+                and self.day_dates[d].month not in by_id[rid].mois_saison
+            ]
+            if out_of_season:
+                self._constrain("saison", self.model.Add(cp_model.LinearExpr.Sum(out_of_season) == 0))
+
+        # Flat (variable, coefficient) arrays shared by the budget and the objective,
+        # weighted by each population's share of the effectif
+        obj_vars, cost_coefs, carbon_coefs, local_coefs = [], [], [], []
+        obj_recipe_ids, obj_weights = [], []
+        for population, x_slots in self.pop_x_slots.items():
+            weight = self.population_weights[population]
+            for comp in components:
+                for d, slot in enumerate(x_slots[comp]):
+                    cost, carbon, local = coefficients(self.day_recipes[comp][d])
+                    if weight != 1:
+                        cost = [c * weight for c in cost]
+                        carbon = [g * weight for g in carbon]
+                        local = [l * weight for l in local]
+                    obj_vars.extend(slot)
+                    cost_coefs.extend(cost)
+                    carbon_coefs.extend(carbon)
+                    local_coefs.extend(local)
+                    obj_recipe_ids.extend(r.id for r in self.day_recipes[comp][d])
+                    obj_weights.extend([weight] * len(slot))
+
+        # CONSTRAINT 2: Budget constraint (user-defined, cents for integer math)
+        # (on the effectif-weighted cost with several populations)
+        total_cost = cp_model.LinearExpr.WeightedSum(obj_vars, cost_coefs)
+        budget_cents = int(self.config.budget_max_par_repas * 100 * self.config.nb_jours) * self.cost_scale
+        budget_ct = self._at_most("budget", total_cost, budget_cents).Index()
+
+        usage = self._ingredient_usage() if self.ingredient_prices is not None or self.stocks else {}
+        ingredient_vars, ingredient_coefs = [], []
+        if self.ingredient_prices is not None:
+            ingredient_vars, ingredient_coefs = self._build_ingredient_cost(usage)
+        stock_vars, stock_coefs, stock_lots = [], [], []
+        if self.stocks:
+            stock_vars, stock_coefs, stock_lots = self._build_stock_use(usage)
+
+        # CONSTRAINTS 3-5, checked for every population on its own selection
+        for population in self.population_weights:
+            self._add_population_constraints(population)
+
+        print(f"Model built: {self.config.nb_jours} days, {len(self.recipes)} recipes"
+              + (f", {len(self.population_weights)} populations" if len(self.population_weights) > 1 else ""))
+
+        return ModelTemplate(
+            model=self.model,
+            x=self.x,
+            x_slots=self.x_slots,
+            budget_ct=budget_ct,
+            obj_vars=obj_vars,
+            cost_coefs=cost_coefs,
+            carbon_coefs=carbon_coefs,
+            local_coefs=local_coefs,
+            obj_recipe_ids=obj_recipe_ids,
+            obj_weights=obj_weights,
+            pop_x=self.pop_x,
+            pop_x_slots=self.pop_x_slots,
+            penalty_vars=penalty_vars,
+            ingredient_vars=ingredient_vars,
+            ingredient_coefs=ingredient_coefs,
+            stock_vars=stock_vars,
+            stock_coefs=stock_coefs,
+            stock_lots=stock_lots,
         )
-        budget_cents = int(self.config.budget_max_par_repas * 100 * self.config.nb_jours)
-        self.model.Add(total_cost <= budget_cents)
+
+    def _ingredient_usage(self) -> Dict[str, List[Tuple[List, List[int], int]]]:
+        """
+        ingredient -> per day (selection variables, grams for all convives,
+        upper bound on the grams that day), over every population's selection.
+        """
+        usage = {}
+        nb_days = self.config.nb_jours
+        for population, x_slots in self.pop_x_slots.items():
+            headcount = self.population_weights[population] * self.headcount_unit
+            for comp in COMPONENTS:
+                for d, slot in enumerate(x_slots[comp]):
+                    slot_max = {}
+                    for var, recipe in zip(slot, self.day_recipes[comp][d]):
+                        for ingredient in recipe.ingredients:
+                            grams = round(ingredient.get("quantite_kg", 0) * 1000 * headcount)
+                            if grams <= 0:
+                                continue
+                            if ingredient["nom"] not in usage:
+                                usage[ingredient["nom"]] = [([], [], 0) for _ in range(nb_days)]
+                            variables, coefs, _ = usage[ingredient["nom"]][d]
+                            variables.append(var)
+                            coefs.append(grams)
+                            slot_max[ingredient["nom"]] = max(slot_max.get(ingredient["nom"], 0), grams)
+                    for name, grams in slot_max.items():
+                        variables, coefs, upper = usage[name][d]
+                        usage[name][d] = (variables, coefs, upper + grams)
+        return usage
+
+    def _build_ingredient_cost(self, usage: Dict) -> Tuple[List, List[int]]:
+        """
+        Ingredient-level cost: the quantity of each ingredient over the horizon
+        (grams, all convives) is split into volume-tier segments, exactly one
+        of which is active, each priced at its discounted €/kg. The whole
+        quantity gets the tier's discount, as in the grouped orders.
+        Returns the segment variables and their prices in cents/kg.
+        """
+        # ingredient -> selection variables and grams, plus an upper bound on the quantity
+        terms = {}
+        upper = {}
+        for name, per_day in usage.items():
+            terms[name] = ([v for day in per_day for v in day[0]], [c for day in per_day for c in day[1]])
+            upper[name] = sum(day[2] for day in per_day)
+
+        tiers = sorted(VOLUME_TIERS)  # ascending (kg, discount)
+        segment_vars, segment_coefs = [], []
+        for name, (variables, coefs) in terms.items():
+            price = round(self.ingredient_prices.get(name, 0) * 100)  # cents/kg
+            if price <= 0:
+                continue
+            quantity = cp_model.LinearExpr.WeightedSum(variables, coefs)
+            # Tier boundaries the quantity can reach, in grams
+            bounds = [0] + [kg * 1000 for kg, _ in tiers if kg * 1000 <= upper[name]]
+            if len(bounds) == 1:
+                # Can never reach a discount: plain linear cost
+                segment_vars.extend(variables)
+                segment_coefs.extend(c * price for c in coefs)
+                continue
+            discounts = [0.0] + [discount for kg, discount in tiers if kg * 1000 <= upper[name]]
+            active, parts = [], []
+            for k, low in enumerate(bounds):
+                high = bounds[k + 1] - 1 if k + 1 < len(bounds) else upper[name]
+                on = self.model.NewBoolVar(f"tier_{name}_{k}")
+                part = self.model.NewIntVar(0, high, f"qty_{name}_{k}")
+                self.model.Add(part >= low).OnlyEnforceIf(on)
+                self.model.Add(part == 0).OnlyEnforceIf(on.Not())
+                active.append(on)
+                parts.append(part)
+                segment_vars.append(part)
+                segment_coefs.append(round(price * (1 - discounts[k])))
+            self.model.AddExactlyOne(active)
+            self.model.Add(cp_model.LinearExpr.Sum(parts) == quantity)
+        return segment_vars, segment_coefs
+
+    def _build_stock_use(self, usage: Dict) -> Tuple[List, List[int], List[StockLot]]:
+        """
+        One variable per stock lot: the grams of it served before its DLC.
+        Lots of a product are used earliest DLC first, so with lots sorted
+        by deadline, the lots due by day D can use at most what the menu
+        consumes on days 0..D-1 (prefix constraints, no per-day variables).
+        Returns the lot variables, their values in cents/kg and the lots.
+        """
+        # Lots grouped by the ingredient names they stand for ("courgette", "courgettes")
+        products = {}
+        for lots in self.stocks.values():
+            for lot in lots:
+                products.setdefault(lot.ingredients, {})[lot.stock_id] = lot
+
+        stock_vars, stock_coefs, stock_lots = [], [], []
+        for names, lots in sorted(products.items()):
+            per_day = [([], [], 0) for _ in range(self.config.nb_jours)]
+            for name in names:
+                for d, (variables, coefs, upper) in enumerate(usage.get(name, [])):
+                    day_vars, day_coefs, day_upper = per_day[d]
+                    per_day[d] = (day_vars + variables, day_coefs + coefs, day_upper + upper)
+            name = "_".join(names)
+            used_so_far = []
+            lots = lots.values()
+            for i, lot in enumerate(sorted(lots, key=lambda l: l.jours_utilisables)):
+                days = min(lot.jours_utilisables, self.config.nb_jours)
+                price = round(lot.prix_kg * 100)
+                if days <= 0 or price <= 0:
+                    continue
+                window = per_day[:days]
+                upper = min(round(lot.quantite_kg * 1000), sum(day[2] for day in window))
+                if upper <= 0:
+                    continue
+                used = self.model.NewIntVar(0, upper, f"stock_{name}_{i}")
+                used_so_far.append(used)
+                consumed = cp_model.LinearExpr.WeightedSum(
+                    [v for day in window for v in day[0]], [c for day in window for c in day[1]]
+                )
+                self.model.Add(cp_model.LinearExpr.Sum(used_so_far) <= consumed)
+                stock_vars.append(used)
+                stock_coefs.append(price)
+                stock_lots.append(lot)
+        return stock_vars, stock_coefs, stock_lots
+
+    def _add_population_constraints(self, population: str):
+        """Egalim, GEMRCN frequency and variety constraints of one population's selection."""
+        x = self.pop_x[population]
+        x_slots = self.pop_x_slots[population]
+        primary = population == self.primary_population
+
+        def family(name: str) -> str:
+            return name if primary else f"{name}@{population}"
 
         # CONSTRAINT 3: Egalim - At least 1 vegetarian main course per 5 days (week)
         weeks = self.config.nb_jours // 5
+        veg_mains = [r for r in self.recipes_by_type.get("plat_principal", []) if r.vegetarien]
         for w in range(weeks):
             week_days = range(w * 5, min((w + 1) * 5, self.config.nb_jours))
-            veg_count = sum(
-                self.x[(d, "plat_principal", r.id)]
-                for d in week_days
-                for r in self.recipes_by_type.get("plat_principal", [])
-                if r.vegetarien
-            )
-            self.model.Add(veg_count >= 1)
+            veg_count = cp_model.LinearExpr.Sum(self._select("plat_principal", veg_mains, week_days, x_slots))
+            self._constrain(family("egalim.vegetarien_semaine"), self.model.Add(veg_count >= 1))
 
         # CONSTRAINT 4: GEMRCN frequency constraints (over 20 meals, prorated)
-        # Get the appropriate population constraints from gemrcn
-        # Default to 'elementaire' if available
-        population_key = 'elementaire'
-        if self.config.convives and hasattr(self.config.convives[0], 'age_min'):
-            age = self.config.convives[0].age_min
-            if age < 3:
-                population_key = 'petite_enfance'
-            elif age < 6:
-                population_key = 'maternelle'
-            elif age < 11:
-                population_key = 'elementaire'
+        # with this population's frequencies
+        for rule, bits, bound in self._gemrcn_bounds(population):
+            count = self._count(rule.composante, bits, x_slots)
+            if rule.sens == "min":
+                self._at_least(family(rule.family), count, bound)
             else:
-                population_key = 'adolescents'
-        
-        pop_constraints = self.gemrcn.get('populations', {}).get(population_key, {}).get('frequences_sur_20_repas', {})
-        
+                self._at_most(family(rule.family), count, bound)
+
+        # CONSTRAINT 5: Variety - repeat windows per component (same main dish not within 5 days...)
+        for rule in self.variety_rules:
+            self._add_variety_rule(rule, x_slots, family(rule.constraint_family), primary)
+
+    def _gemrcn_bounds(self, population: str) -> List[Tuple[FrequencyRule, int, int]]:
+        """
+        (rule, bitset of the rule's recipes in this solve, bound) of the GEMRCN
+        rules (data, see rules.py) for a population, frequencies over 20 meals
+        prorated to the horizon. Rules none of the solve's recipes count for are left out.
+        """
+        pop_constraints = self.gemrcn.get('populations', {}).get(population, {}).get('frequences_sur_20_repas', {})
+
         # Scale factor: if we have fewer than 20 days, scale constraints proportionally
-        scale = self.config.nb_jours / 20.0
-        
+        # (a rolling-horizon chunk is checked together with the days before it)
+        history_days = self.history_days if population == self.primary_population else []
+        scale = (self.config.nb_jours + len(history_days)) / GEMRCN_PERIOD
+
         # Helper to scale minimum constraints (round down, but at least 1 if original > 0)
         def scale_min(val):
             scaled = int(val * scale)
             return max(1, scaled) if val > 0 and scaled == 0 else scaled
-        
+
         # Helper to scale maximum constraints (round up)
         def scale_max(val):
             return max(1, int(val * scale + 0.5))
-        
-        days_range = range(self.config.nb_jours)
-        
-        # --- MINIMUM CONSTRAINTS (>= X) ---
-        
-        # Crudités (raw vegetables) - min 10/20
-        crudites_min = pop_constraints.get('crudites_min', 10)
-        crudites_recipes = [r for r in self.recipes_by_type.get("entree", []) if "crudites" in r.tags]
-        if crudites_recipes:
-            crudites_count = sum(
-                self.x[(d, "entree", r.id)]
-                for d in days_range
-                for r in crudites_recipes
-            )
-            self.model.Add(crudites_count >= scale_min(crudites_min))
-        
-        # Poisson qualité - min 4/20
-        poisson_min = pop_constraints.get('poisson_qualite_min', pop_constraints.get('poisson_min', 4))
-        fish_recipes = [r for r in self.recipes_by_type.get("plat_principal", []) if "poisson" in r.tags]
-        if fish_recipes:
-            fish_count = sum(
-                self.x[(d, "plat_principal", r.id)]
-                for d in days_range
-                for r in fish_recipes
-            )
-            self.model.Add(fish_count >= scale_min(poisson_min))
-        
-        # Viande non hachée - min 4/20
-        viande_min = pop_constraints.get('viande_non_hachee_min', 4)
-        viande_recipes = [r for r in self.recipes_by_type.get("plat_principal", []) 
-                          if "viande" in r.tags and "hache" not in r.tags]
-        if viande_recipes:
-            viande_count = sum(
-                self.x[(d, "plat_principal", r.id)]
-                for d in days_range
-                for r in viande_recipes
-            )
-            self.model.Add(viande_count >= scale_min(viande_min))
-        
-        # Légumes en garniture - min 10/20
-        legumes_min = pop_constraints.get('legumes_min', pop_constraints.get('legumes_cuits_min', 10))
-        legumes_recipes = [r for r in self.recipes_by_type.get("garniture", []) if "legumes" in r.tags]
-        if legumes_recipes:
-            legumes_count = sum(
-                self.x[(d, "garniture", r.id)]
-                for d in days_range
-                for r in legumes_recipes
-            )
-            self.model.Add(legumes_count >= scale_min(legumes_min))
-        
-        # Féculents en garniture - min 10/20
-        feculents_min = pop_constraints.get('feculents_min', 10)
-        feculents_recipes = [r for r in self.recipes_by_type.get("garniture", []) if "feculents" in r.tags]
-        if feculents_recipes:
-            feculents_count = sum(
-                self.x[(d, "garniture", r.id)]
-                for d in days_range
-                for r in feculents_recipes
-            )
-            self.model.Add(feculents_count >= scale_min(feculents_min))
-        
-        # Fromages riches en calcium - min 8/20
-        fromages_min = pop_constraints.get('fromages_calcium_min', 8)
-        fromages_recipes = [r for r in self.recipes_by_type.get("produit_laitier", []) 
-                           if "fromage" in r.tags or "calcium_eleve" in r.tags]
-        if fromages_recipes:
-            fromages_count = sum(
-                self.x[(d, "produit_laitier", r.id)]
-                for d in days_range
-                for r in fromages_recipes
-            )
-            self.model.Add(fromages_count >= scale_min(fromages_min))
-        
-        # Laitages sains - min 6/20
-        laitages_min = pop_constraints.get('laitages_sains_min', 6)
-        laitages_recipes = [r for r in self.recipes_by_type.get("produit_laitier", []) 
-                           if "laitages" in r.tags]
-        if laitages_recipes:
-            laitages_count = sum(
-                self.x[(d, "produit_laitier", r.id)]
-                for d in days_range
-                for r in laitages_recipes
-            )
-            self.model.Add(laitages_count >= scale_min(laitages_min))
-        
-        # Fruits crus - min 8/20
-        fruits_min = pop_constraints.get('fruits_crus_min', pop_constraints.get('fruits_min', 8))
-        fruits_recipes = [r for r in self.recipes_by_type.get("dessert", []) if "fruits" in r.tags]
-        if fruits_recipes:
-            fruits_count = sum(
-                self.x[(d, "dessert", r.id)]
-                for d in days_range
-                for r in fruits_recipes
-            )
-            self.model.Add(fruits_count >= scale_min(fruits_min))
-        
-        # --- MAXIMUM CONSTRAINTS (<= X) ---
-        
-        # Entrées grasses - max 4/20
-        entrees_grasses_max = pop_constraints.get('entrees_grasses_max', 4)
-        entrees_grasses = [r for r in self.recipes_by_type.get("entree", []) 
-                          if "gras" in r.tags or "friture" in r.tags]
-        if entrees_grasses:
-            entrees_grasses_count = sum(
-                self.x[(d, "entree", r.id)]
-                for d in days_range
-                for r in entrees_grasses
-            )
-            self.model.Add(entrees_grasses_count <= scale_max(entrees_grasses_max))
-        
-        # Fritures - max 4/20
-        fritures_max = pop_constraints.get('fritures_max', 4)
-        fritures_recipes = [r for r in self.recipes_by_type.get("plat_principal", []) 
-                           if "friture" in r.tags or "frit" in str(r.tags)]
-        if fritures_recipes:
-            fritures_count = sum(
-                self.x[(d, "plat_principal", r.id)]
-                for d in days_range
-                for r in fritures_recipes
-            )
-            self.model.Add(fritures_count <= scale_max(fritures_max))
-        
-        # Plats industriels - max 3/20
-        plats_indus_max = pop_constraints.get('plats_industriels_max', 3)
-        plats_indus = [r for r in self.recipes_by_type.get("plat_principal", []) 
-                       if "industriel" in r.tags]
-        if plats_indus:
-            plats_indus_count = sum(
-                self.x[(d, "plat_principal", r.id)]
-                for d in days_range
-                for r in plats_indus
-            )
-            self.model.Add(plats_indus_count <= scale_max(plats_indus_max))
-        
-        # Desserts gras - max 3/20
-        desserts_gras_max = pop_constraints.get('desserts_gras_max', 3)
-        desserts_gras = [r for r in self.recipes_by_type.get("dessert", []) 
-                        if "gras" in r.tags]
-        if desserts_gras:
-            desserts_gras_count = sum(
-                self.x[(d, "dessert", r.id)]
-                for d in days_range
-                for r in desserts_gras
-            )
-            self.model.Add(desserts_gras_count <= scale_max(desserts_gras_max))
-        
-        # Desserts sucrés - max 4/20
-        desserts_sucres_max = pop_constraints.get('desserts_sucres_max', 4)
-        desserts_sucres = [r for r in self.recipes_by_type.get("dessert", []) 
-                          if "sucre" in r.tags and "sans_sucre" not in str(r.tags)]
-        if desserts_sucres:
-            desserts_sucres_count = sum(
-                self.x[(d, "dessert", r.id)]
-                for d in days_range
-                for r in desserts_sucres
-            )
-            self.model.Add(desserts_sucres_count <= scale_max(desserts_sucres_max))
-
-        # CONSTRAINT 5: Variety - same main dish not within 5 days
-        # Only apply this constraint if we have more recipes than days,
-        # otherwise the solver may not find a solution
-        main_dishes = self.recipes_by_type.get("plat_principal", [])
-        if len(main_dishes) > self.config.nb_jours:
-            for r in main_dishes:
-                for d in range(self.config.nb_jours - 4):
-                    # At most 1 occurrence in any 5-day window
-                    self.model.Add(
-                        sum(self.x[(d + i, "plat_principal", r.id)] for i in range(5)) <= 1
-                    )
-
-        # OBJECTIVE: Minimize weighted sum of cost + carbon
-        alpha = self.config.priorite_budget
-        beta = self.config.priorite_carbone
-        gamma = self.config.priorite_local
-
-        # Cost component (cents)
-        cost_obj = sum(
-            self.x[(d, comp, r.id)] * int(r.cout_portion_euro * 100)
-            for d in days
-            for comp in components
-            if comp in self.recipes_by_type
-            for r in self.recipes_by_type[comp]
-        )
 
-        # Carbon component (grams for integer math)
-        carbon_obj = sum(
-            self.x[(d, comp, r.id)] * int(r.co2_kg_portion * 1000)
-            for d in days
-            for comp in components
-            if comp in self.recipes_by_type
-            for r in self.recipes_by_type[comp]
-        )
+        bounds = []
+        for rule, bits in zip(self.rule_index.rules, self.rule_index.rule_bits):
+            bits &= self.recipe_bits
+            if not bits:
+                continue
+            limit = rule.limit(pop_constraints)
+            bounds.append((rule, bits, scale_min(limit) if rule.sens == "min" else scale_max(limit)))
+        return bounds
 
-        # Local bonus (negative = good)
-        local_obj = sum(
-            self.x[(d, comp, r.id)] * (-100 if r.local else 0)
-            for d in days
-            for comp in components
-            if comp in self.recipes_by_type
-            for r in self.recipes_by_type[comp]
-        )
+    def _add_variety_rule(self, rule: VarietyRule, x_slots: Dict, family: str, primary: bool):
+        """
+        Repeat window of one rule on one population's selection.
+        "fenetres": one constraint over the group's variables of every window
+        (groups x days x window terms).
+        "cumul": a running count per group (recipe or family),
+        c[d] = c[d-1] + servings on day d, and one 2-term bound
+        c[d] - c[d - w] <= max per window (groups x days terms, any window).
+        "auto" picks the smaller of the two for each group: short windows
+        keep the cliques CP-SAT propagates best, long ones get running counts.
+        """
+        comp = rule.composante
+        nb_days = self.config.nb_jours
+        window = rule.fenetre_jours
+        groups: Dict[str, List[List]] = {}  # group -> per day variables
+        for d, slot in enumerate(x_slots[comp]):
+            for var, recipe in zip(slot, self.day_recipes[comp][d]):
+                group = rule.group(recipe)
+                if group is not None:
+                    groups.setdefault(group, [[] for _ in range(nb_days)])[d].append(var)
 
-        # Weighted objective
-        self.model.Minimize(
-            int(alpha * 100) * cost_obj +
-            int(beta * 100) * carbon_obj +
-            int(gamma * 100) * local_obj
-        )
+        # Days served in the previous chunk of a rolling-horizon solve
+        # (the history records the reference menu only)
+        by_id = {r.id: r for r in self.recipes_by_type.get(comp, [])}
+        recent = self.history.days[-(window - 1):] if self.history is not None and primary and window > 1 else []
+        served_before = {}  # group -> days before the horizon it was served (1 = yesterday)
+        for back, day in enumerate(reversed(recent), start=1):
+            recipe = by_id.get(day.get(comp))
+            group = rule.group(recipe) if recipe is not None else None
+            if group is not None:
+                served_before.setdefault(group, []).append(back)
+
+        for group, per_day in groups.items():
+            history = served_before.get(group, [])
+            # nb_vars[d] / open_days[d]: variables / days with a variable on days 0..d
+            nb_vars, open_days = [], []
+            for d in range(nb_days):
+                nb_vars.append((nb_vars[-1] if d else 0) + len(per_day[d]))
+                open_days.append((open_days[-1] if d else 0) + (1 if per_day[d] else 0))
+
+            def in_window(prefix, start, end):
+                return prefix[end] - (prefix[start - 1] if start > 0 else 0)
+
+            # Windows ending on day `end` (clipped to the horizon) that can be violated;
+            # earlier windows are contained in the first full one unless history days precede them
+            first_end = 0 if history else min(window, nb_days) - 1
+            windows = []  # (start, end, bound)
+            for end in range(first_end, nb_days):
+                start = max(0, end - window + 1)
+                bound = rule.max_par_fenetre - sum(1 for back in history if back <= window - 1 - end)
+                if in_window(open_days, start, end) > bound:
+                    windows.append((start, end, bound))
+            if not windows:
+                continue
+
+            encoding = self.variety_encoding
+            if encoding == "auto":
+                window_terms = sum(in_window(nb_vars, start, end) for start, end, _ in windows)
+                count_terms = nb_vars[-1] + 2 * open_days[-1] + 2 * len(windows)
+                encoding = "cumul" if count_terms < window_terms else "fenetres"
+
+            if encoding == "fenetres":
+                for start, end, bound in windows:
+                    variables = [v for d in range(start, end + 1) for v in per_day[d]]
+                    if bound == 1:
+                        self._constrain(family, self.model.AddAtMostOne(variables))
+                    else:
+                        self._constrain(family, self.model.Add(cp_model.LinearExpr.Sum(variables) <= bound))
+                continue
+
+            # counts[d]: servings on days 0..d
+            counts = []
+            previous = 0
+            for d in range(nb_days):
+                if per_day[d]:
+                    count = self.model.NewIntVar(0, min(open_days[d], rule.max_par_fenetre * (d // window + 1)),
+                                                 f"served_{comp}_{group}_{d}")
+                    self.model.Add(count == previous + cp_model.LinearExpr.Sum(per_day[d]))
+                    previous = count
+                counts.append(previous)
+            for start, end, bound in windows:
+                served = counts[end] - counts[start - 1] if start > 0 else counts[end]
+                self._constrain(family, self.model.Add(served <= bound))
+
+    def warm_start(self, previous_menu: Dict, max_changes: Optional[int] = None):
+        """
+        Re-solve mode: hint CP-SAT with a previously returned menu
+        (`jours[].composantes`) so the search starts from a feasible plan.
+        Optionally cap the number of (day, component) slots that may differ.
+        """
+        if self.template is None:
+            self.build_model()
+
+        by_name = {(r.type, r.nom): r.id for r in self.recipes}
+        known_ids = {r.id for r in self.recipes}
 
-        print(f"Model built: {self.config.nb_jours} days, {len(self.recipes)} recipes")
+        self.previous_selection = {}
+        for day_index, jour in enumerate(previous_menu.get("jours", [])):
+            d = jour.get("jour", day_index + 1) - 1
+            if not 0 <= d < self.config.nb_jours:
+                continue
+            for comp, details in jour.get("composantes", {}).items():
+                recipe_id = details.get("id")
+                if recipe_id not in known_ids:
+                    recipe_id = by_name.get((comp, details.get("recette")))
+                if recipe_id is not None and (d, comp, recipe_id) in self.x:
+                    self.previous_selection[(d, comp)] = recipe_id
 
-    def solve(self) -> Optional[Dict]:
-        """Solve the model and return the menu plan."""
-        self.build_model()
+        if not self.previous_selection:
+            print("Warm start: previous menu does not match the current catalog, solving cold.")
+            return
+
+        hinted_days = {d for d, _ in self.previous_selection}
+        for (d, comp, recipe_id), var in self.x.items():
+            if d in hinted_days:
+                self.model.AddHint(var, self.previous_selection.get((d, comp)) == recipe_id)
+
+        if max_changes is not None:
+            kept = [self.x[(d, comp, rid)] for (d, comp), rid in self.previous_selection.items()]
+            self._at_least("changements", cp_model.LinearExpr.Sum(kept), len(kept) - max_changes)
+
+        print(f"Warm start: {len(self.previous_selection)} slots hinted"
+              + (f", max {max_changes} changes" if max_changes is not None else ""))
+
+    def repair(self, menu: Dict, days: List[int], components: Optional[List[str]] = None,
+               exclude: Optional[List[str]] = None, max_time_in_seconds: float = 2.0,
+               num_search_workers: Optional[int] = None) -> Optional[Dict]:
+        """
+        Local repair of a returned menu: every slot outside `days` (numbers of
+        `jours`, from 1) x `components` (default: all) keeps its dish, for every
+        population, and only the chosen slots are re-optimized under the
+        constraints of the whole horizon (budget, Egalim, GEMRCN, variety).
+        `exclude` lists recipes the repaired slots may not serve (default:
+        their current dishes). The kept slots are pinned by a single BoolAnd
+        per population, so presolve fixes them and the search only sees the
+        repaired slots. Raises ValueError if the menu does not fit the model.
+        """
+        if self.template is None:
+            self.build_model()
+        repaired_days = set()
+        for day in days:
+            if not 1 <= day <= self.config.nb_jours:
+                raise ValueError(f"Jour à réparer hors du menu : {day} (1 à {self.config.nb_jours})")
+            repaired_days.add(day - 1)
+        repaired_components = set(components or COMPONENTS)
+        unknown = repaired_components - set(COMPONENTS)
+        if unknown:
+            raise ValueError(f"Composantes inconnues : {', '.join(sorted(unknown))}")
+
+        jours = {jour.get("jour", i + 1) - 1: jour for i, jour in enumerate(menu.get("jours", []))}
+        self.previous_selection = {}
+        pinned = {population: [] for population in self.pop_x}
+        for d in range(self.config.nb_jours):
+            jour = jours.get(d, {})
+            for comp in COMPONENTS:
+                if not self.recipes_by_type.get(comp):
+                    continue
+                recipe_id = jour.get("composantes", {}).get(comp, {}).get("id")
+                if (d, comp, recipe_id) not in self.x:
+                    raise ValueError(f"Jour {d + 1}, {comp} : recette absente ou inconnue ({recipe_id})")
+                self.previous_selection[(d, comp)] = recipe_id
+                if d in repaired_days and comp in repaired_components:
+                    continue
+                for population, x in self.pop_x.items():
+                    variant = jour.get("variantes", {}).get(population, {}).get(comp, {}).get("id")
+                    var = x.get((d, comp, variant or recipe_id))
+                    if var is None:
+                        raise ValueError(f"Jour {d + 1}, {comp} : variante inconnue pour {population} ({variant})")
+                    pinned[population].append(var)
+        for variables in pinned.values():
+            if variables:
+                self.model.AddBoolAnd(variables)
+
+        if exclude is None:
+            exclude = [self.previous_selection[(d, comp)] for d, comp in self.previous_selection
+                       if d in repaired_days and comp in repaired_components]
+        excluded = set(exclude)
+        forbidden = [
+            var for x in self.pop_x.values() for (d, comp, recipe_id), var in x.items()
+            if recipe_id in excluded and d in repaired_days and comp in repaired_components
+        ]
+        if forbidden:
+            self.model.AddBoolAnd([var.Not() for var in forbidden])
+
+        print(f"Repair: {len(repaired_days)} day(s) x {len(repaired_components)} component(s), "
+              f"{len(excluded)} recipe(s) excluded")
+        return self.solve(max_time_in_seconds=max_time_in_seconds, num_search_workers=num_search_workers)
+
+    def solve(self, max_time_in_seconds: float = 30.0,
+              on_solution: Optional[Callable[[Dict], None]] = None,
+              num_search_workers: Optional[int] = None) -> Optional[Dict]:
+        """
+        Solve the model and return the menu plan.
+        `on_solution` is called with each improving intermediate menu.
+        `num_search_workers` caps CP-SAT threads (default: all cores).
+        """
+        if self.template is None:
+            self.build_model()
 
         solver = cp_model.CpSolver()
-        solver.parameters.max_time_in_seconds = 30.0
+        solver.parameters.max_time_in_seconds = max_time_in_seconds
+        if num_search_workers:
+            solver.parameters.num_search_workers = num_search_workers
+        self.cp_solver = solver
+        if self.stop_requested:
+            print("Solve cancelled before start.")
+            return None
 
         print("Solving...")
-        status = solver.Solve(self.model)
+        callback = MenuSolutionCallback(self, on_solution) if on_solution else None
+        status = self._search(solver, callback)
+        self.cp_solver = None
+        self.last_status = status
 
         if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
             print(f"Solution found! Status: {'OPTIMAL' if status == cp_model.OPTIMAL else 'FEASIBLE'}")
@@ -391,9 +1040,226 @@ class MenuSolver:
             print(f"No solution found. Status: {status}")
             return None
 
+    def solve_portfolio(self, latency_ms: int = 300, num_search_workers: Optional[int] = None) -> Optional[Dict]:
+        """
+        Race CP-SAT (on a thread: it releases the GIL while searching) against
+        MenuHeuristic for `latency_ms`, model build included, and return the
+        menu with the better objective. menu["portefeuille"] names the winning
+        engine and its optimality gap to CP-SAT's bound. The heuristic covers
+        the portion-cost model; with ingredient-level cost, stock terms, a
+        rolling-horizon history or a warm start (whose change cap it does not
+        enforce), CP-SAT runs alone.
+        """
+        start = time.perf_counter()
+        deadline = start + latency_ms / 1000
+        if self.template is None:
+            self.build_model()
+
+        solver = cp_model.CpSolver()
+        # A little time is left for extracting the menu
+        solver.parameters.max_time_in_seconds = max(0.01, (deadline - time.perf_counter()) * 0.9)
+        if num_search_workers:
+            solver.parameters.num_search_workers = num_search_workers
+        self.cp_solver = solver
+        if self.stop_requested:
+            print("Solve cancelled before start.")
+            return None
+        outcome = {}
+
+        def search_cp_sat():
+            try:
+                outcome["status"] = self._search(solver)
+            except BaseException as e:
+                outcome["error"] = e
+
+        search = threading.Thread(target=search_cp_sat, daemon=True)
+        search.start()
+
+        heuristic = None
+        if (self.objective_weights is not None and self.history is None and not self.explain_mode
+                and not self.previous_selection):
+            heuristic = MenuHeuristic(self).run(deadline, lambda: self.stop_requested)
+        search.join()
+        self.cp_solver = None
+        if "error" in outcome:
+            raise outcome["error"]
+        status = outcome["status"]
+        self.last_status = status
+
+        found = status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+        cp_objective = round(solver.ObjectiveValue()) if found else None
+        bound = solver.BestObjectiveBound() if status != cp_model.INFEASIBLE else None
+        # (CP-SAT reports 0 until presolve has produced a bound)
+        if bound is not None and (not math.isfinite(bound) or (status == cp_model.UNKNOWN and bound == 0)):
+            bound = None
+        if heuristic is not None and (cp_objective is None or heuristic[0] < cp_objective):
+            objective, assignment = heuristic
+            engine = "heuristique"
+            menu = self._extract_solution(assignment)
+        elif found:
+            objective, engine = cp_objective, "cp-sat"
+            menu = self._extract_solution(solver)
+        else:
+            print(f"No solution found. Status: {status}")
+            return None
+
+        gap = None
+        if status == cp_model.OPTIMAL and engine == "cp-sat":
+            gap = 0.0
+        elif bound is not None:
+            gap = round(100 * max(0.0, objective - bound) / max(1, abs(objective)), 2)
+        menu["portefeuille"] = {
+            "moteur": engine,
+            "objectif": objective,
+            "objectif_cp_sat": cp_objective,
+            "objectif_heuristique": heuristic[0] if heuristic is not None else None,
+            "borne": round(bound) if bound is not None else None,
+            "ecart_optimalite_pct": gap,
+            "statut_cp_sat": solver.StatusName(status),
+            "latence_ms": latency_ms,
+            "temps_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        print(f"Portfolio: {engine} wins (objective {objective}, gap {gap}%)")
+        return menu
+
+    def _search(self, solver: cp_model.CpSolver,
+                callback: Optional[cp_model.CpSolverSolutionCallback] = None) -> int:
+        """
+        Run solver.Solve() while a watcher re-sends stop() to it: StopSearch()
+        is a no-op until Solve() has started, so a stop landing between the
+        stop_requested check and the search would otherwise be lost.
+        """
+        done = threading.Event()
+
+        def relay_stop():
+            while not done.wait(0.02):
+                if self.stop_requested:
+                    solver.StopSearch()
+
+        watcher = threading.Thread(target=relay_stop, daemon=True)
+        watcher.start()
+        try:
+            return solver.Solve(self.model, callback)
+        finally:
+            done.set()
+            watcher.join()
+
+    def stop(self):
+        """Interrupt a running solve (safe to call from another thread)."""
+        self.stop_requested = True
+        solver = self.cp_solver
+        if solver is not None:
+            solver.StopSearch()
+
+    def explain(self, max_time_in_seconds: float = 2.0) -> Dict:
+        """
+        Diagnose a request without solution (requires explain=True).
+        Every constraint family is guarded by a literal: families are dropped
+        one by one while the rest stays infeasible, which leaves a minimal
+        conflicting set, then each family of that set is relaxed alone to the
+        closest feasible bound. `max_time_in_seconds` caps each check.
+        """
+        if not self.explain_mode:
+            raise ValueError("explain() requires a MenuSolver created with explain=True")
+        start = time.perf_counter()
+        if self.template is None:
+            self.build_model()
+        if "budget" in self.relaxable:
+            expr, sense, _ = self.relaxable["budget"]
+            self.relaxable["budget"] = (expr, sense, self.budget_cents() * self.cost_scale)
+
+        families = list(self.assumptions)
+        solver, status = self._check(families, max_time_in_seconds)
+        result = {
+            "faisable": status in (cp_model.OPTIMAL, cp_model.FEASIBLE),
+            "statut": solver.StatusName(status),
+            "conflit_minimal": [],
+            "relaxations": [],
+            "relaxation_conseillee": None,
+        }
+        if status != cp_model.INFEASIBLE:
+            result["temps_s"] = round(time.perf_counter() - start, 3)
+            return result
+
+        # Deletion: drop each family whose removal keeps the rest infeasible
+        # (a check that times out keeps the family, the set stays conflicting)
+        conflict = families
+        for family in families:
+            rest = [f for f in conflict if f != family]
+            _, status = self._check(rest, max_time_in_seconds)
+            if status == cp_model.INFEASIBLE:
+                conflict = rest
+        result["conflit_minimal"] = [
+            {"contrainte": f, "description": family_description(f, self.rule_index.labels)} for f in conflict
+        ]
+
+        # Relax each conflicting family alone, as little as possible
+        for family in conflict:
+            relaxation = {"contrainte": family, "description": family_description(family, self.rule_index.labels)}
+            expr, sense, bound = self.relaxable.get(family, (None, None, None))
+            others = [f for f in families if f != family]
+            solver, status = self._check(others, max_time_in_seconds, expr, sense)
+
+            relaxation["restaure_faisabilite"] = status in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+            if expr is None or not relaxation["restaure_faisabilite"]:
+                relaxation["action"] = "supprimer"
+                relaxation["cout_relatif"] = 1.0
+            else:
+                value = int(solver.Value(expr))
+                relaxation["cout_relatif"] = round(abs(value - bound) / max(1, abs(bound)), 3)
+                if family == "budget":
+                    # Cheapest menu cost, per meal and rounded up to the cent
+                    # (costs are effectif-weighted, i.e. scaled by cost_scale)
+                    carry = bound // self.cost_scale - int(self.config.budget_max_par_repas * 100 * self.config.nb_jours)
+                    relaxation["action"] = "augmenter"
+                    relaxation["actuel"] = self.config.budget_max_par_repas
+                    relaxation["propose"] = math.ceil((value / self.cost_scale - carry) / self.config.nb_jours) / 100
+                    relaxation["unite"] = "€/repas"
+                elif family == "changements":
+                    # Bound on the kept slots: report it as changes allowed
+                    slots = len(self.previous_selection)
+                    relaxation["action"] = "relever"
+                    relaxation["actuel"] = slots - bound
+                    relaxation["propose"] = slots - value
+                    relaxation["unite"] = "changements"
+                else:
+                    relaxation["action"] = "abaisser" if sense == ">=" else "relever"
+                    relaxation["actuel"] = bound
+                    relaxation["propose"] = value
+                    relaxation["unite"] = f"repas sur {self.config.nb_jours}"
+            result["relaxations"].append(relaxation)
+
+        restoring = [r for r in result["relaxations"] if r["restaure_faisabilite"]]
+        if restoring:
+            result["relaxation_conseillee"] = min(restoring, key=lambda r: r["cout_relatif"])
+        result["temps_s"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _check(self, families: List[str], max_time_in_seconds: float, expr=None, sense=None):
+        """
+        Solve with only `families` enforced; returns (solver, status).
+        The guard literals are fixed on a copy of the model rather than passed
+        as assumptions, so that presolve can still prove infeasibility quickly.
+        With `expr`, the copy pushes it towards the bound of its family.
+        """
+        model = self.model.Clone()
+        enabled = set(families)
+        for family, literal in self.assumptions.items():
+            model.Add(literal == (1 if family in enabled else 0))
+        if expr is None:
+            model.ClearObjective()
+        elif sense == ">=":
+            model.Maximize(expr)
+        else:
+            model.Minimize(expr)
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = max_time_in_seconds
+        status = solver.Solve(model)
+        return solver, status
+
     def _extract_solution(self, solver) -> Dict:
         """Extract the solution into a readable format."""
-        components = ["entree", "plat_principal", "garniture", "dessert", "produit_laitier"]
+        components = COMPONENTS
         menu = {"jours": [], "stats": {}}
 
         total_cost = 0
@@ -401,24 +1267,22 @@ class MenuSolver:
         veg_count = 0
         bio_count = 0
         local_count = 0
+        changes = 0
+        shared_slots = 0  # other populations' slots served the reference dish
+        total_slots = 0
 
         for d in range(self.config.nb_jours):
             day_menu = {"jour": d + 1, "composantes": {}}
+            if self.day_dates:
+                day_menu["date"] = self.day_dates[d].isoformat()
             day_cost = 0
             day_carbon = 0
 
             for comp in components:
                 if comp in self.recipes_by_type:
-                    for r in self.recipes_by_type[comp]:
-                        if solver.Value(self.x[(d, comp, r.id)]) == 1:
-                            day_menu["composantes"][comp] = {
-                                "recette": r.nom,
-                                "cout": r.cout_portion_euro,
-                                "co2": r.co2_kg_portion,
-                                "vegetarien": r.vegetarien,
-                                "bio": r.bio,
-                                "local": r.local
-                            }
+                    for var, r in zip(self.x_slots[comp][d], self.day_recipes[comp][d]):
+                        if solver.Value(var) == 1:
+                            day_menu["composantes"][comp] = dish_details(r)
                             day_cost += r.cout_portion_euro
                             day_carbon += r.co2_kg_portion
                             if r.vegetarien and comp == "plat_principal":
@@ -427,6 +1291,32 @@ class MenuSolver:
                                 bio_count += 1
                             if r.local:
                                 local_count += 1
+                            previous_id = self.previous_selection.get((d, comp))
+                            if previous_id is not None and previous_id != r.id:
+                                changes += 1
+
+            # Mixed canteens: dishes of the other populations that differ from the
+            # reference menu; day totals become effectif-weighted averages
+            if len(self.population_weights) > 1:
+                day_cost *= self.population_weights[self.primary_population]
+                day_carbon *= self.population_weights[self.primary_population]
+                day_menu["variantes"] = {}
+                for population, x_slots in self.pop_x_slots.items():
+                    if population == self.primary_population:
+                        continue
+                    weight = self.population_weights[population]
+                    for comp in components:
+                        for var, r in zip(x_slots[comp][d], self.day_recipes[comp][d]):
+                            if solver.Value(var) == 1:
+                                day_cost += r.cout_portion_euro * weight
+                                day_carbon += r.co2_kg_portion * weight
+                                total_slots += 1
+                                if r.id != day_menu["composantes"].get(comp, {}).get("id"):
+                                    day_menu["variantes"].setdefault(population, {})[comp] = dish_details(r)
+                                else:
+                                    shared_slots += 1
+                day_cost /= self.cost_scale
+                day_carbon /= self.cost_scale
 
             day_menu["cout_total"] = round(day_cost, 2)
             day_menu["co2_total"] = round(day_carbon, 2)
@@ -442,12 +1332,354 @@ class MenuSolver:
             "pct_repas_vegetariens": round(veg_count / self.config.nb_jours * 100, 1),
             "pct_bio": round(bio_count / total_items * 100, 1),
             "pct_local": round(local_count / total_items * 100, 1),
-            "budget_respecte": total_cost <= self.config.budget_max_par_repas * self.config.nb_jours
+            "budget_respecte": round(total_cost * 100) <= self.budget_cents()
         }
+        if self.previous_selection:
+            menu["stats"]["nb_changements"] = changes
+        if self.popularity:
+            rated = [self.popularity[dish["id"]] for jour in menu["jours"]
+                     for dish in jour["composantes"].values() if dish["id"] in self.popularity]
+            menu["stats"]["popularite_ecart_moyen"] = round(sum(rated) / len(rated), 2) if rated else 0.0
+        if self.ingredient_prices is not None:
+            quantities = {}
+            for population, x_slots in self.pop_x_slots.items():
+                headcount = self.population_weights[population] * self.headcount_unit
+                for comp in components:
+                    for d in range(self.config.nb_jours):
+                        for var, r in zip(x_slots[comp][d], self.day_recipes[comp][d]):
+                            if solver.Value(var) == 1:
+                                for ingredient in r.ingredients:
+                                    quantities[ingredient["nom"]] = (quantities.get(ingredient["nom"], 0)
+                                                                     + ingredient.get("quantite_kg", 0) * headcount)
+            menu["ingredients"] = price_ingredients(quantities, self.ingredient_prices)
+            ingredient_cost = sum(line["cout"] for line in menu["ingredients"])
+            meals = self.config.nb_jours * self.headcount_unit * self.cost_scale
+            menu["stats"]["cout_ingredients_total"] = round(ingredient_cost, 2)
+            menu["stats"]["cout_ingredients_par_repas"] = round(ingredient_cost / meals, 2)
+        if self.template.stock_vars:
+            menu["stocks"] = []
+            for var, lot in zip(self.template.stock_vars, self.template.stock_lots):
+                used_kg = solver.Value(var) / 1000
+                if used_kg <= 0:
+                    continue
+                menu["stocks"].append({
+                    "stock_id": lot.stock_id,
+                    "produit": lot.produit,
+                    "dlc": lot.dlc.isoformat() if lot.dlc else None,
+                    "quantite_kg": lot.quantite_kg,
+                    "consomme_kg": round(used_kg, 3),
+                    "valeur": round(used_kg * lot.prix_kg, 2),
+                })
+            menu["stats"]["stock_consomme_kg"] = round(sum(s["consomme_kg"] for s in menu["stocks"]), 3)
+            menu["stats"]["valeur_stock_consommee"] = round(sum(s["valeur"] for s in menu["stocks"]), 2)
+        if len(self.population_weights) > 1:
+            menu["stats"]["populations"] = {
+                c.label or population_for_age(c.age_min): population_for_age(c.age_min)
+                for c in self.config.convives
+            }
+            menu["stats"]["pct_plats_partages"] = round(shared_slots / total_slots * 100, 1) if total_slots else 100.0
 
         return menu
 
 
+# Rolling-horizon chunk sizes (multiples of 5 so that Egalim weeks never straddle chunks)
+CHUNK_DAYS = {"semaine": 5, "mois": 20}
+
+
+class RollingHorizonSolver:
+    """
+    Plans a long horizon (up to a full school year) chunk by chunk.
+    Each chunk is a small MenuSolver model that sees the previous days through
+    a PlanHistory: GEMRCN counts over the last 20 meals, the variety window
+    and the unspent budget are carried forward, so the stitched plan stays
+    compliant while memory stays bounded by the chunk size.
+    """
+
+    def __init__(self, config: CanteenConfig, recipes: List[Recipe], gemrcn: dict, chunk_days: int = 5):
+        if chunk_days <= 0 or chunk_days % 5:
+            raise ValueError("chunk_days must be a positive multiple of 5")
+        self.config = config
+        self.recipes = recipes
+        self.gemrcn = gemrcn
+        self.chunk_days = chunk_days
+        self.current = None  # MenuSolver of the chunk being solved
+        self.stop_requested = False
+
+    def iter_solve(self, max_time_per_chunk: float = 5.0) -> Iterator[Tuple[int, Optional[Dict]]]:
+        """
+        Yield (first_day_index, chunk_menu) as chunks are solved.
+        A None menu means the chunk was infeasible; iteration stops there.
+        """
+        history = PlanHistory()
+        for start in range(0, self.config.nb_jours, self.chunk_days):
+            if self.stop_requested:
+                return
+            chunk_config = replace(self.config, nb_jours=min(self.chunk_days, self.config.nb_jours - start))
+            if self.config.date_debut:
+                chunk_config.date_debut = school_days(self.config.date_debut, start + 1)[-1]
+            solver = MenuSolver(chunk_config, self.recipes, self.gemrcn, history=history)
+            self.current = solver
+            menu = solver.solve(max_time_in_seconds=max_time_per_chunk)
+            self.current = None
+            if menu is None:
+                print(f"Rolling horizon: no solution for days {start + 1}-{start + chunk_config.nb_jours}.")
+                yield start, None
+                return
+            history.append_menu(menu, solver.budget_cents())
+            yield start, menu
+
+    def solve(self, max_time_per_chunk: float = 5.0) -> Optional[Dict]:
+        """Solve every chunk and stitch them into one menu plan."""
+        jours = []
+        for start, menu in self.iter_solve(max_time_per_chunk):
+            if menu is None:
+                return None
+            for jour in menu["jours"]:
+                jours.append({**jour, "jour": start + jour["jour"]})
+        if len(jours) < self.config.nb_jours:
+            return None  # Stopped
+        budget_cents = int(self.config.budget_max_par_repas * 100 * self.config.nb_jours)
+        return {"jours": jours, "stats": menu_stats(jours, budget_cents)}
+
+    def stop(self):
+        """Interrupt the current chunk and skip the remaining ones."""
+        self.stop_requested = True
+        solver = self.current
+        if solver is not None:
+            solver.stop()
+
+
+def menu_stats(jours: List[Dict], budget_cents: int) -> Dict:
+    """Plan-level statistics computed from already extracted days."""
+    nb_jours = len(jours)
+    items = [details for jour in jours for details in jour["composantes"].values()]
+    total_cost = sum(jour["cout_total"] for jour in jours)
+    total_carbon = sum(jour["co2_total"] for jour in jours)
+    veg_count = sum(
+        1 for jour in jours
+        if jour["composantes"].get("plat_principal", {}).get("vegetarien")
+    )
+    return {
+        "cout_moyen_par_jour": round(total_cost / nb_jours, 2),
+        "cout_total": round(total_cost, 2),
+        "co2_moyen_par_jour_kg": round(total_carbon / nb_jours, 2),
+        "pct_repas_vegetariens": round(veg_count / nb_jours * 100, 1),
+        "pct_bio": round(sum(1 for i in items if i["bio"]) / len(items) * 100, 1),
+        "pct_local": round(sum(1 for i in items if i["local"]) / len(items) * 100, 1),
+        "budget_respecte": round(total_cost * 100) <= budget_cents
+    }
+
+
+def family_description(family: str, labels: Optional[Dict[str, str]] = None) -> str:
+    """
+    Label of a constraint family ("<family>@<population>" for non-reference
+    populations); `labels` adds the families of the GEMRCN rules.
+    """
+    base, _, population = family.partition("@")
+    description = (labels or {}).get(base) or CONSTRAINT_FAMILIES.get(base, base)
+    return f"{description} ({population})" if population else description
+
+
+def population_for_age(age: int) -> str:
+    """GEMRCN population of a convive group, from its minimum age."""
+    if age < 3:
+        return 'petite_enfance'
+    elif age < 6:
+        return 'maternelle'
+    elif age < 11:
+        return 'elementaire'
+    return 'adolescents'
+
+
+def population_effectifs(convives: List[ConviveProfile], gemrcn: Optional[dict] = None) -> Dict[str, int]:
+    """
+    GEMRCN population -> summed effectif, the first convive's population
+    first. Populations with the same frequency rules in `gemrcn` are always
+    best served the same plan, so they are merged into the first of them.
+    """
+    effectifs = {}
+    owners = {}  # frequency rules -> population planned for them
+    for c in convives:
+        key = population_for_age(c.age_min)
+        if gemrcn is not None:
+            rules = gemrcn.get('populations', {}).get(key, {}).get('frequences_sur_20_repas', {})
+            key = owners.setdefault(json.dumps(rules, sort_keys=True), key)
+        effectifs[key] = effectifs.get(key, 0) + max(0, c.effectif)
+    return effectifs
+
+
+def population_weights(convives: List[ConviveProfile], gemrcn: Optional[dict] = None) -> Dict[str, int]:
+    """Cost weight of each population: its effectif reduced by the gcd (a single population weighs 1)."""
+    weights = population_effectifs(convives, gemrcn)
+    if not weights:
+        return {'elementaire': 1}
+    if not any(weights.values()):
+        return {key: 1 for key in weights}
+    divisor = math.gcd(*weights.values())
+    return {key: w // divisor for key, w in weights.items()}
+
+
+def school_days(start: date, count: int) -> List[date]:
+    """The `count` weekdays (Monday-Friday) starting at `start`."""
+    days = []
+    day = start
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def build_month_index(recipes: List[Recipe]) -> Dict[int, Dict[str, List[Recipe]]]:
+    """month (1-12) -> component -> recipes in season (empty mois_saison = all year)."""
+    index = {month: {} for month in range(1, 13)}
+    for r in recipes:
+        for month in (r.mois_saison or range(1, 13)):
+            if month in index:
+                index[month].setdefault(r.type, []).append(r)
+    return index
+
+
+def volume_discount(quantity_kg: float) -> float:
+    """Discount rate granted for an order of `quantity_kg`."""
+    for minimum_kg, discount in VOLUME_TIERS:
+        if quantity_kg >= minimum_kg:
+            return discount
+    return 0.0
+
+
+def price_ingredients(quantities_kg: Dict[str, float], prices: Dict[str, float]) -> List[Dict]:
+    """Cost lines of an ingredient order, with volume tiers applied per ingredient."""
+    lines = []
+    for name, quantity in sorted(quantities_kg.items(), key=lambda item: -item[1]):
+        price = prices.get(name, 0.0)
+        discount = volume_discount(quantity)
+        lines.append({
+            "ingredient": name,
+            "quantite_kg": round(quantity, 2),
+            "prix_kg": round(price, 2),
+            "remise": discount,
+            "cout": round(quantity * price * (1 - discount), 2),
+        })
+    return lines
+
+
+def dish_details(r: Recipe) -> Dict:
+    """A recipe as shown in menu output."""
+    return {
+        "id": r.id,
+        "recette": r.nom,
+        "cout": r.cout_portion_euro,
+        "co2": r.co2_kg_portion,
+        "vegetarien": r.vegetarien,
+        "bio": r.bio,
+        "local": r.local
+    }
+
+
+def variety_rules(gemrcn: dict, overrides: Optional[List[Dict]] = None) -> List[VarietyRule]:
+    """
+    Repeat-window rules: the request's, else the "variete" list of the GEMRCN
+    file, else the default main-dish window. Each entry reads
+    {"composante", "fenetre_jours", "max" (default 1), "par": "recette" | "famille"};
+    families come from the "familles" section (component -> family -> tags).
+    """
+    entries = overrides if overrides is not None else gemrcn.get(
+        "variete", [{"composante": "plat_principal", "fenetre_jours": VARIETY_WINDOW}]
+    )
+    rules = []
+    for entry in entries:
+        comp = entry["composante"]
+        if comp not in COMPONENTS:
+            raise ValueError(f"Composante inconnue pour la variété : {comp}")
+        window = int(entry.get("fenetre_jours", VARIETY_WINDOW))
+        if window < 1:
+            raise ValueError(f"Fenêtre de variété invalide pour {comp} : {window}")
+        families = None
+        if entry.get("par", "recette") == "famille":
+            definitions = gemrcn.get("familles", {}).get(comp, {})
+            if not definitions:
+                raise ValueError(f"Aucune famille définie pour {comp}")
+            families = tuple((name, tuple(tags)) for name, tags in definitions.items())
+        rules.append(VarietyRule(comp, window, int(entry.get("max", 1)), families))
+    return rules
+
+
+def variety_applicable(rule: VarietyRule, recipes: List[Recipe]) -> bool:
+    """
+    A rule only applies when the catalog can follow it on its own: enough
+    distinct groups to fill a window (recipes outside every family are free).
+    """
+    groups = [rule.group(r) for r in recipes if r.type == rule.composante]
+    if None in groups:
+        return True
+    return len(set(groups)) * rule.max_par_fenetre >= rule.fenetre_jours
+
+
+def constraint_signature(r: Recipe, rule_index: RuleIndex) -> Tuple:
+    """Everything the Egalim / GEMRCN constraints look at for a recipe."""
+    return (r.type, r.vegetarien) + rule_index.memberships(r)
+
+
+def prune_dominated_recipes(recipes: List[Recipe], rule_index: RuleIndex,
+                            rules: Optional[List[VarietyRule]] = None
+                            ) -> Tuple[List[Recipe], List[Recipe]]:
+    """
+    Remove recipes that are dominated within their constraint class: another
+    recipe of the same type and GEMRCN signature (and variety family) costs
+    no more, emits no more CO2 and is at least as local.
+
+    A recipe is only dropped once it has enough dominators to stand in for
+    it: 1 for most components, and 2 * window - 1 for components with a
+    per-recipe repeat window, so that a replacement outside the window
+    always exists. Returns (kept, pruned).
+    """
+    if rules is None:
+        rules = [VarietyRule("plat_principal", VARIETY_WINDOW)]
+    needed_by_type = {}
+    family_rules = []
+    for rule in rules:
+        if rule.familles is None:
+            needed = 2 * rule.fenetre_jours - 1
+            needed_by_type[rule.composante] = max(needed_by_type.get(rule.composante, 1), needed)
+        else:
+            family_rules.append(rule)
+
+    groups: Dict[Tuple, List[Recipe]] = {}
+    for r in recipes:
+        families = tuple(rule.group(r) for rule in family_rules if rule.composante == r.type)
+        groups.setdefault(constraint_signature(r, rule_index) + families, []).append(r)
+
+    def dominates(a: Recipe, b: Recipe) -> bool:
+        if a.cout_portion_euro > b.cout_portion_euro or a.co2_kg_portion > b.co2_kg_portion:
+            return False
+        if b.local and not a.local:
+            return False
+        # a must be available whenever b is (empty mois_saison = all year)
+        if a.mois_saison and (not b.mois_saison or not set(b.mois_saison) <= set(a.mois_saison)):
+            return False
+        # Identical recipes: keep the one with the smallest id
+        if (a.cout_portion_euro, a.co2_kg_portion, a.local) == (b.cout_portion_euro, b.co2_kg_portion, b.local):
+            return a.id < b.id
+        return True
+
+    pruned_ids = set()
+    for signature, group in groups.items():
+        needed = needed_by_type.get(signature[0], 1)
+        for b in group:
+            dominators = 0
+            for a in group:
+                if a is not b and dominates(a, b):
+                    dominators += 1
+                    if dominators >= needed:
+                        pruned_ids.add(b.id)
+                        break
+
+    kept = [r for r in recipes if r.id not in pruned_ids]
+    pruned = [r for r in recipes if r.id in pruned_ids]
+    return kept, pruned
+
+
 def load_recipes(path: str) -> List[Recipe]:
     """Load recipes from JSON file."""
     with open(path, "r", encoding="utf-8") as f:
@@ -473,15 +1705,16 @@ def load_recipes(path: str) -> List[Recipe]:
             co2_kg_portion=item.get("co2_kg_portion", 0),
             tags=item.get("tags", []),
             equipement=item.get("equipement", []),
-            mois_saison=item.get("mois_saison", [])
+            mois_saison=item.get("mois_saison", []),
+            ingredients=item.get("ingredients", [])
         ))
     return recipes
 
 
 def main():
-    """Demo: Generate a 5-day menu for a primary school."""
+    """Demo: Generate a 5-day menu for a primary school (python -m app.solver)."""
     # Load data
-    data_dir = Path(__file__).parent.parent / "data"
+    data_dir = Path(__file__).parent.parent.parent / "data"
     recipes = load_recipes(data_dir / "recettes.json")
 
     with open(data_dir / "gemrcn_constraints.json", "r", encoding="utf-8") as f:
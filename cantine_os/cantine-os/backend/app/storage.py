@@ -0,0 +1,614 @@
+"""
+Cantine.OS - Storage
+The mutable data (suppliers, établissements, stocks and their movements,
+orders, ratings, planning) behind one interface, with two backends: the
+JSON files of the data directory, and a SQLite database with indexed
+lookups whose writes do not depend on the size of the data
+"""
+
+import argparse
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple, Union
+
+from .result_cache import file_digest
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+DB_NAME = "cantine.db"
+
+
+@dataclass(frozen=True)
+class CollectionSpec:
+    """
+    A collection and where it lives in the JSON files. "list" collections
+    hold records with an "id"; "map" collections map a key to a value
+    (menu date -> score, week -> planning).
+    """
+    name: str
+    fichier: str
+    cle: Optional[str]  # key of the collection in the file (None: the whole file)
+    kind: str = "list"  # "list" | "map"
+    index: Tuple[str, ...] = ()  # fields searched by value (SQLite indexes)
+
+
+@dataclass(frozen=True)
+class FileSpec:
+    default: object  # content of a missing file
+    stamp: Optional[str] = None  # strftime format of meta.last_updated, refreshed on write
+    indent: int = 4
+
+
+COLLECTIONS = {spec.name: spec for spec in (
+    CollectionSpec("fournisseurs", "fournisseurs.json", "fournisseurs"),
+    CollectionSpec("etablissements", "etablissements.json", None),
+    CollectionSpec("stocks", "stocks.json", "stocks", index=("fournisseur_id",)),
+    CollectionSpec("mouvements", "stocks.json", "mouvements", index=("stock_id",)),
+    CollectionSpec("commandes", "commandes.json", "commandes", index=("statut", "fournisseur_id")),
+    CollectionSpec("ratings", "feedback.json", "ratings", index=("menu_date",)),
+    CollectionSpec("menu_scores", "feedback.json", "menu_scores", kind="map"),
+    CollectionSpec("planning", "planning.json", None, kind="map"),
+)}
+
+FILES = {
+    "fournisseurs.json": FileSpec({
+        "fournisseurs": [],
+        "meta": {
+            "version": "1.0",
+            "last_updated": "2024-12-13",
+            "description": "Catalogue des fournisseurs de la cantine"
+        }
+    }),
+    "etablissements.json": FileSpec([]),
+    "stocks.json": FileSpec({"stocks": [], "mouvements": [], "meta": {}}, stamp="%Y-%m-%d"),
+    "commandes.json": FileSpec({"commandes": [], "meta": {"last_updated": None}}, stamp="%Y-%m-%d %H:%M", indent=2),
+    "feedback.json": FileSpec({"ratings": [], "menu_scores": {}, "meta": {"last_updated": None}},
+                              stamp="%Y-%m-%d %H:%M:%S", indent=2),
+    "planning.json": FileSpec({}, indent=2),
+}
+
+
+class Storage(ABC):
+    """
+    Collections of COLLECTIONS. Records returned belong to the caller
+    (changing them does not change the store). Single operations are
+    atomic; transaction() groups several.
+    """
+
+    @abstractmethod
+    def all(self, name: str) -> Union[List[Dict], Dict]:
+        """Records of a list collection in insertion order, or the dict of a map collection."""
+
+    @abstractmethod
+    def find(self, name: str, **criteria) -> List[Dict]:
+        """Records of a list collection whose fields equal `criteria`."""
+
+    @abstractmethod
+    def get(self, name: str, key: str):
+        """Record with id `key` (value under `key` for a map), or None."""
+
+    @abstractmethod
+    def count(self, name: str) -> int:
+        """Number of records of a collection."""
+
+    @abstractmethod
+    def since(self, name: str, cursor: Optional[int] = None) -> Optional[Tuple[List[Dict], int]]:
+        """
+        Records appended to a list collection after `cursor` (None: all of
+        them), in insertion order, with the cursor to pass next time. None
+        if the collection was rewritten since `cursor` was handed out.
+        """
+
+    @abstractmethod
+    def put(self, name: str, value, key: Optional[str] = None):
+        """Insert or replace (in place) the record with value["id"] (`key` for a map)."""
+
+    @abstractmethod
+    def add(self, name: str, record: Dict):
+        """Append a record to a list collection without looking for its id."""
+
+    @abstractmethod
+    def delete(self, name: str, key: str):
+        """Remove a record; returns it, or None if there was none."""
+
+    @abstractmethod
+    def replace(self, name: str, values: Union[List[Dict], Dict]):
+        """Replace a whole collection."""
+
+    @abstractmethod
+    def version(self, *names: str) -> Hashable:
+        """Changes whenever one of the collections does (and only then)."""
+
+    @contextmanager
+    @abstractmethod
+    def transaction(self) -> Iterator["Storage"]:
+        """Operations inside are applied together, or not at all if the block raises."""
+
+
+class FileLock:
+    """
+    Exclusive lock on `path` shared by every process using the same file
+    (flock, or msvcrt on Windows), reentrant within a process.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a+b")
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._file.seek(0)
+                    while True:
+                        try:
+                            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue  # LK_LOCK gives up after 10 s
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+def write_json_atomic(path: Path, data, indent: Optional[int] = None):
+    """Write to a temp file of the same directory, fsync, then rename over `path`."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class JsonStorage(Storage):
+    """
+    The JSON files of the data directory, in their historical layout. Safe
+    with several threads and processes on the same directory:
+    - files are only ever replaced by rename, so a reader sees a whole file;
+    - a write reads the file, applies the change, then checks under the
+      directory lock (.storage.lock) that the file version (inode, mtime,
+      size) is still the one it read; if another writer got in first, the
+      change is applied again to its version, lock held;
+    - transaction() holds the lock for the whole block and writes each
+      file once at the end (nothing if the block raises).
+    """
+
+    def __init__(self, data_dir: Path):
+        self.data_dir = Path(data_dir)
+        self.file_lock = FileLock(self.data_dir / ".storage.lock")
+        self._local = threading.local()  # .txn: file -> content, .dirty: files to write
+        self._lock = threading.Lock()
+        self._digests: Dict[str, Tuple] = {}  # file -> ((mtime_ns, size), digest)
+        self.stats = {"ecritures": 0, "conflits": 0}
+
+    def _load(self, fichier: str) -> Tuple[Optional[Tuple], object]:
+        """(version, content) of a file, the version being that of the content read."""
+        try:
+            with open(self.data_dir / fichier, "r", encoding="utf-8") as f:
+                st = os.fstat(f.fileno())
+                return (st.st_ino, st.st_mtime_ns, st.st_size), json.load(f)
+        except FileNotFoundError:
+            return None, copy.deepcopy(FILES[fichier].default)
+
+    def _version_of(self, fichier: str) -> Optional[Tuple]:
+        try:
+            st = os.stat(self.data_dir / fichier)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _dump(self, fichier: str, content):
+        # Caller holds self.file_lock
+        spec = FILES[fichier]
+        if spec.stamp:
+            content.setdefault("meta", {})["last_updated"] = datetime.now().strftime(spec.stamp)
+        write_json_atomic(self.data_dir / fichier, content, indent=spec.indent)
+        self.stats["ecritures"] += 1
+
+    def _txn(self) -> Optional[Dict]:
+        return getattr(self._local, "txn", None)
+
+    def _txn_content(self, fichier: str):
+        txn = self._local.txn
+        if fichier not in txn:
+            txn[fichier] = self._load(fichier)[1]
+        return txn[fichier]
+
+    @staticmethod
+    def _records(spec: CollectionSpec, content):
+        if spec.cle is None:
+            return content
+        return content.setdefault(spec.cle, [] if spec.kind == "list" else {})
+
+    def _view(self, name: str, copied: bool = True):
+        """
+        (spec, records) to read; inside a transaction, a copy of the pending
+        content (`copied`, unless the caller never hands the records out).
+        """
+        spec = COLLECTIONS[name]
+        if self._txn() is not None:
+            records = self._records(spec, self._txn_content(spec.fichier))
+            return spec, copy.deepcopy(records) if copied else records
+        return spec, self._records(spec, self._load(spec.fichier)[1])
+
+    def _modify(self, name: str, change):
+        """
+        Apply change(spec, content) -> (content, result, changed) to the file
+        of a collection and write it if changed. Returns the result.
+        """
+        spec = COLLECTIONS[name]
+        if self._txn() is not None:
+            content, result, changed = change(spec, self._txn_content(spec.fichier))
+            if changed:
+                self._local.txn[spec.fichier] = content
+                self._local.dirty.add(spec.fichier)
+            return result
+        version, content = self._load(spec.fichier)
+        content, result, changed = change(spec, content)
+        if not changed:
+            return result
+        with self.file_lock:
+            if self._version_of(spec.fichier) != version:
+                # Another writer replaced the file since it was read: redo the change on its version
+                self.stats["conflits"] += 1
+                content, result, changed = change(spec, self._load(spec.fichier)[1])
+                if not changed:
+                    return result
+            self._dump(spec.fichier, content)
+        return result
+
+    def all(self, name: str):
+        return self._view(name)[1]
+
+    def find(self, name: str, **criteria) -> List[Dict]:
+        records = self._view(name)[1]
+        return [r for r in records if all(r.get(k) == v for k, v in criteria.items())]
+
+    def get(self, name: str, key: str):
+        spec, records = self._view(name)
+        if spec.kind == "map":
+            return records.get(key)
+        return next((r for r in records if r.get("id") == key), None)
+
+    def count(self, name: str) -> int:
+        return len(self._view(name, copied=False)[1])
+
+    def since(self, name: str, cursor: Optional[int] = None) -> Optional[Tuple[List[Dict], int]]:
+        # The cursor is the length of the list (the whole file is parsed anyway)
+        records = self._view(name, copied=False)[1]
+        if cursor is not None and len(records) < cursor:
+            return None
+        return copy.deepcopy(records[cursor or 0:]), len(records)
+
+    def put(self, name: str, value, key: Optional[str] = None):
+        def change(spec, content):
+            records = self._records(spec, content)
+            if spec.kind == "map":
+                records[key] = copy.deepcopy(value)
+            else:
+                index = next((i for i, r in enumerate(records) if r.get("id") == value.get("id")), None)
+                if index is None:
+                    records.append(copy.deepcopy(value))
+                else:
+                    records[index] = copy.deepcopy(value)
+            return content, None, True
+        self._modify(name, change)
+
+    def add(self, name: str, record: Dict):
+        def change(spec, content):
+            self._records(spec, content).append(copy.deepcopy(record))
+            return content, None, True
+        self._modify(name, change)
+
+    def delete(self, name: str, key: str):
+        def change(spec, content):
+            records = self._records(spec, content)
+            if spec.kind == "map":
+                removed = records.pop(key, None)
+            else:
+                index = next((i for i, r in enumerate(records) if r.get("id") == key), None)
+                removed = records.pop(index) if index is not None else None
+            return content, removed, removed is not None
+        return self._modify(name, change)
+
+    def replace(self, name: str, values):
+        def change(spec, content):
+            if spec.cle is None:
+                return copy.deepcopy(values), None, True
+            content[spec.cle] = copy.deepcopy(values)
+            return content, None, True
+        self._modify(name, change)
+
+    def version(self, *names: str) -> Hashable:
+        """Content digests of the files (hashed again only when their mtime or size moves)."""
+        versions = []
+        for fichier in sorted({COLLECTIONS[name].fichier for name in names}):
+            path = self.data_dir / fichier
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                versions.append(None)
+                continue
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            with self._lock:
+                cached = self._digests.get(fichier)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, file_digest(path))
+                with self._lock:
+                    self._digests[fichier] = cached
+            versions.append(cached[1])
+        return tuple(versions)
+
+    @contextmanager
+    def transaction(self):
+        if self._txn() is not None:
+            yield self
+            return
+        with self.file_lock:
+            self._local.txn = {}
+            self._local.dirty = set()
+            try:
+                yield self
+                for fichier in self._local.dirty:
+                    self._dump(fichier, self._local.txn[fichier])
+            finally:
+                self._local.txn = None
+
+
+class SqliteStorage(Storage):
+    """
+    One table per collection: (seq, id, indexed fields, data as JSON), seq
+    keeping insertion order. Ids and COLLECTIONS' index fields are indexed,
+    so lookups and writes touch a few rows whatever the size of the data.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self.conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False,
+                                    timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.transaction():
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (cle TEXT PRIMARY KEY, valeur TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS versions (collection TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+            for spec in COLLECTIONS.values():
+                columns = "".join(f", {field} TEXT" for field in spec.index)
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {spec.name} "
+                                  f"(seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE{columns}, data TEXT NOT NULL)")
+                for field in spec.index:
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS {spec.name}_{field} ON {spec.name} ({field})")
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('base', ?)", (uuid.uuid4().hex,))
+        self.base = self.conn.execute("SELECT valeur FROM meta WHERE cle = 'base'").fetchone()[0]
+
+    def _row(self, spec: CollectionSpec, value, key: Optional[str]) -> Tuple:
+        if spec.kind == "list":
+            key = value.get("id")
+        return (key, *(value.get(field) for field in spec.index),
+                json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+    def _insert(self, spec: CollectionSpec, value, key: Optional[str] = None, upsert: bool = False):
+        columns = ("id",) + spec.index + ("data",)
+        sql = (f"INSERT INTO {spec.name} ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)})")
+        if upsert:
+            sql += " ON CONFLICT(id) DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+        self.conn.execute(sql, self._row(spec, value, key))
+
+    def _touch(self, name: str):
+        self.conn.execute("INSERT INTO versions VALUES (?, 1) ON CONFLICT(collection) DO UPDATE SET n = n + 1",
+                          (name,))
+
+    def all(self, name: str):
+        spec = COLLECTIONS[name]
+        with self._lock:
+            rows = self.conn.execute(f"SELECT id, data FROM {name} ORDER BY seq").fetchall()
+        if spec.kind == "map":
+            return {key: json.loads(data) for key, data in rows}
+        return [json.loads(data) for _, data in rows]
+
+    def find(self, name: str, **criteria) -> List[Dict]:
+        spec = COLLECTIONS[name]
+        clauses = []
+        params = []
+        for field, value in criteria.items():
+            column = field if field == "id" or field in spec.index else f"json_extract(data, '$.{field}')"
+            if value is None:
+                clauses.append(f"{column} IS NULL")
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self.conn.execute(f"SELECT data FROM {name}{where} ORDER BY seq", params).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def get(self, name: str, key: str):
+        with self._lock:
+            row = self.conn.execute(f"SELECT data FROM {name} WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    def since(self, name: str, cursor: Optional[int] = None) -> Optional[Tuple[List[Dict], int]]:
+        # The cursor is the last seq read: replace() renumbers every row, delete() removes it
+        with self._lock:
+            if cursor and self.conn.execute(f"SELECT 1 FROM {name} WHERE seq = ?", (cursor,)).fetchone() is None:
+                return None
+            rows = self.conn.execute(f"SELECT seq, data FROM {name} WHERE seq > ? ORDER BY seq",
+                                     (cursor or 0,)).fetchall()
+        return [json.loads(data) for _, data in rows], (rows[-1][0] if rows else cursor or 0)
+
+    def put(self, name: str, value, key: Optional[str] = None):
+        spec = COLLECTIONS[name]
+        with self.transaction():
+            if spec.kind == "list" and value.get("id") is None:
+                self._insert(spec, value)
+            else:
+                self._insert(spec, value, key, upsert=True)
+            self._touch(name)
+
+    def add(self, name: str, record: Dict):
+        with self.transaction():
+            self._insert(COLLECTIONS[name], record)
+            self._touch(name)
+
+    def delete(self, name: str, key: str):
+        with self.transaction():
+            removed = self.get(name, key)
+            if removed is not None:
+                self.conn.execute(f"DELETE FROM {name} WHERE id = ?", (key,))
+                self._touch(name)
+            return removed
+
+    def replace(self, name: str, values):
+        spec = COLLECTIONS[name]
+        with self.transaction():
+            self.conn.execute(f"DELETE FROM {name}")
+            if spec.kind == "map":
+                for key, value in values.items():
+                    self._insert(spec, value, key)
+            else:
+                for record in values:
+                    self._insert(spec, record)
+            self._touch(name)
+
+    def version(self, *names: str) -> Hashable:
+        with self._lock:
+            counters = dict(self.conn.execute(
+                f"SELECT collection, n FROM versions WHERE collection IN ({', '.join('?' for _ in names)})",
+                names).fetchall())
+        return (self.base,) + tuple(counters.get(name, 0) for name in names)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+            self._depth = 1
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
+            finally:
+                self._depth = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def open_storage(data_dir: Path) -> Storage:
+    """The SQLite database of `data_dir` once migrated (see migrate()), else its JSON files."""
+    db_path = Path(data_dir) / DB_NAME
+    if db_path.exists():
+        return SqliteStorage(db_path)
+    return JsonStorage(data_dir)
+
+
+def migrate(data_dir: Path, db_path: Optional[Path] = None) -> Dict[str, int]:
+    """
+    Copy every collection of the JSON files into a new SQLite database
+    (built next to it, then renamed, so a failed migration leaves nothing).
+    The JSON files are left as they are. Returns the record count per collection.
+    """
+    data_dir = Path(data_dir)
+    db_path = Path(db_path) if db_path is not None else data_dir / DB_NAME
+    if db_path.exists():
+        raise FileExistsError(f"La base {db_path} existe déjà")
+    source = JsonStorage(data_dir)
+    tmp_path = db_path.with_suffix(".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    target = SqliteStorage(tmp_path)
+    counts = {}
+    try:
+        with target.transaction():
+            for name in COLLECTIONS:
+                values = source.all(name)
+                try:
+                    target.replace(name, values)
+                except sqlite3.IntegrityError as e:
+                    raise ValueError(f"Migration impossible de {name} : {e} (identifiants en double ?)") from e
+                counts[name] = len(values)
+        for name, expected in counts.items():
+            if target.count(name) != expected:
+                raise ValueError(f"Migration incomplète de {name} : {target.count(name)}/{expected}")
+    finally:
+        target.close()
+    os.replace(tmp_path, db_path)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migre les fichiers JSON de données vers une base SQLite")
+    parser.add_argument("--data-dir", default=str(Path(__file__).parent.parent.parent / "data"),
+                        help="Dossier des fichiers JSON")
+    parser.add_argument("--db", default="", help=f"Base SQLite à créer (défaut: <data-dir>/{DB_NAME})")
+    args = parser.parse_args()
+
+    db_path = Path(args.db) if args.db else Path(args.data_dir) / DB_NAME
+    counts = migrate(Path(args.data_dir), db_path)
+    for name, count in counts.items():
+        print(f"  {name}: {count}")
+    print(f"✅ {sum(counts.values())} enregistrements migrés vers {db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark: recipe catalog load, JSON parse vs columnar build vs mapped snapshot"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.solver import load_recipes
+from app.catalog import CatalogStore, RecipeCatalog
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--recettes", type=int, default=50000, help="Size of the synthetic catalog")
+parser.add_argument("--repeat", type=int, default=5)
+args = parser.parse_args()
+
+# Synthetic catalog: the real recipes replicated under new ids
+data_dir = Path(__file__).parent.parent / 'data'
+with open(data_dir / 'recettes.json', 'r', encoding='utf-8') as f:
+    base = json.load(f)
+data = []
+for i in range(args.recettes):
+    item = dict(base[i % len(base)])
+    item["id"] = f"s{i:06d}"
+    data.append(item)
+
+workdir = Path(tempfile.mkdtemp())
+path = workdir / 'recettes.json'
+with open(path, 'w', encoding='utf-8') as f:
+    json.dump(data, f, ensure_ascii=False)
+print(f"Catalogue synthétique : {len(data)} recettes, {path.stat().st_size / 1e6:.1f} Mo")
+
+
+def timed(label, fn):
+    best = None
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<38} {best * 1000:>9.2f} ms")
+    return result
+
+
+timed("load_recipes (JSON -> Recipe)", lambda: load_recipes(path))
+catalog = timed("RecipeCatalog.from_json", lambda: RecipeCatalog.from_json(path))
+snapshot = workdir / 'recettes.catalog'
+timed("save_snapshot", lambda: catalog.save_snapshot(snapshot, {}))
+print(f"{'  taille instantané':<38} {snapshot.stat().st_size / 1e6:>9.1f} Mo")
+mapped = timed("load_snapshot (mmap)", lambda: RecipeCatalog.load_snapshot(snapshot)[0])
+
+
+def cold_store():
+    store = CatalogStore(path, snapshot_dir=workdir / 'cache')
+    store.get()
+    return store
+
+
+timed("CatalogStore.get (froid, instantané)", cold_store)
+store = cold_store()
+timed("CatalogStore.get (chaud)", store.get)
+timed("recipes() depuis l'instantané", lambda: RecipeCatalog.load_snapshot(snapshot)[0].recipes())
+timed("colonne coût (somme, instantané)", lambda: sum(mapped.numeric["cout_portion_euro"]))
+vegan = mapped.tags.bits(["vegan"])
+timed("recettes taguées 'vegan' (masques)",
+      lambda: sum(1 for i in range(len(mapped)) if mapped.tags.mask(i) & vegan))
+assert mapped.recipes() == catalog.recipes()
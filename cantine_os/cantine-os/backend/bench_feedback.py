@@ -0,0 +1,70 @@
+"""Benchmark: rating ingestion during a QR-code burst, per-rating write vs write-behind buffer"""
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.storage import JsonStorage, SqliteStorage
+from app.feedback import FeedbackBuffer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--historique", default="0,10000", help="Ratings already stored")
+parser.add_argument("--notes", type=int, default=3000, help="Ratings of the burst")
+parser.add_argument("--ancien", type=int, default=200, help="Ratings timed on the per-rating path")
+args = parser.parse_args()
+
+TARGET = 1000  # ratings/s
+
+
+def open_backend(backend: str):
+    data_dir = Path(tempfile.mkdtemp())
+    return SqliteStorage(data_dir / "cantine.db") if backend == "sqlite" else JsonStorage(data_dir)
+
+
+def fill(storage, count: int):
+    storage.replace("ratings", [{"id": f"rating_{n + 1:05d}", "menu_date": f"2023-{n % 12 + 1:02d}-{n % 28 + 1:02d}",
+                                 "rating": n % 5 + 1, "comment": "", "timestamp": "2024-12-16 12:00:00"}
+                                for n in range(count)])
+
+
+def per_rating(storage, menu_date: str, rating: int):
+    """Previous submit_rating: rewrite feedback.json, rescan the date's ratings"""
+    with storage.transaction():
+        storage.add("ratings", {"id": f"rating_{storage.count('ratings') + 1:05d}", "menu_date": menu_date,
+                                "rating": rating, "comment": "",
+                                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+        menu_ratings = storage.find("ratings", menu_date=menu_date)
+        storage.put("menu_scores", {"score": round(sum(r["rating"] for r in menu_ratings) / len(menu_ratings), 2),
+                                    "total_ratings": len(menu_ratings),
+                                    "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, key=menu_date)
+
+
+print(f"{'stockage':>8} | {'historique':>10} | {'note par note':>14} | {'tampon':>12} | objectif")
+for backend in ["json", "sqlite"]:
+    for size in [int(v) for v in args.historique.split(",")]:
+        storage = open_backend(backend)
+        fill(storage, size)
+        t0 = time.perf_counter()
+        for n in range(args.ancien):
+            per_rating(storage, "2024-12-16", n % 5 + 1)
+        old_rate = args.ancien / (time.perf_counter() - t0)
+
+        storage = open_backend(backend)
+        fill(storage, size)
+        buffer = FeedbackBuffer(storage, flush_interval=3600)  # flushed by size only
+        t0 = time.perf_counter()
+        for n in range(args.notes):
+            buffer.submit("2024-12-16", n % 5 + 1, "")
+            if len(buffer.pending) >= buffer.flush_every:
+                buffer.flush()  # inline, so the flushes are counted on this core
+        buffer.flush()
+        elapsed = time.perf_counter() - t0
+        rate = args.notes / elapsed
+        assert storage.count("ratings") == size + args.notes
+        assert storage.get("menu_scores", "2024-12-16")["total_ratings"] == args.notes
+        print(f"{backend:>8} | {size:>10} | {old_rate:>10.0f}/s | {rate:>10.0f}/s | "
+              f"{'OK' if rate >= TARGET else 'ÉCHEC'}")
@@ -0,0 +1,45 @@
+"""Benchmark: stock movement journal, appends, per-stock history and restart as the history grows"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.ledger import StockLedger
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--mouvements", default="1000,10000,100000", help="History sizes")
+parser.add_argument("--stocks", type=int, default=200)
+parser.add_argument("--fsync", default="1,64", help="Movements per fsync")
+args = parser.parse_args()
+
+
+def fill(ledger, count: int, start: int = 0):
+    for n in range(start, start + count):
+        stock_id = f"stock_{n % args.stocks:05d}"
+        ledger.append(stock_id, {"type": "entree", "quantite": 1, "date": "2024-12-16", "motif": ""},
+                      ledger.quantity(stock_id, 0) + 1)
+
+
+print(f"{'mouvements':>10} | {'fsync/n':>7} | {'écriture':>9} | {'historique (10)':>15} | {'redémarrage':>11}")
+for size in [int(v) for v in args.mouvements.split(",")]:
+    for every in [int(v) for v in args.fsync.split(",")]:
+        directory = Path(tempfile.mkdtemp()) / "mouvements"
+        ledger = StockLedger(directory, fsync_every=every, compact_every=max(size // 4, 1000))
+        t0 = time.perf_counter()
+        fill(ledger, size)
+        ledger.flush()
+        write = (time.perf_counter() - t0) / size
+        t0 = time.perf_counter()
+        for n in range(args.stocks):
+            ledger.history(f"stock_{n:05d}", limit=10)
+        history = (time.perf_counter() - t0) / args.stocks
+        ledger.close()
+        t0 = time.perf_counter()
+        reopened = StockLedger(directory)
+        restart = time.perf_counter() - t0
+        assert reopened.quantity("stock_00000", 0) == ledger.quantity("stock_00000", 0)
+        print(f"{size:>10} | {every:>7} | {write * 1e6:>6.1f} µs | {history * 1e6:>12.1f} µs | "
+              f"{restart * 1000:>8.1f} ms", flush=True)
@@ -0,0 +1,61 @@
+"""Benchmark: MenuSolver model build time across synthetic catalog sizes"""
+import sys
+import json
+import time
+import random
+import argparse
+from dataclasses import replace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.solver import load_recipes, MenuSolver, CanteenConfig, ConviveProfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--tailles", default="137,500,1000,2000", help="Catalog sizes")
+parser.add_argument("--jours", default="20,60", help="Horizons (days)")
+args = parser.parse_args()
+
+# Load data
+data_dir = Path(__file__).parent.parent / 'data'
+base_recipes = load_recipes(data_dir / 'recettes.json')
+
+with open(data_dir / 'gemrcn_constraints.json', 'r', encoding='utf-8') as f:
+    gemrcn = json.load(f)
+
+
+def synthetic_catalog(size, seed=42):
+    """Grow the real catalog to `size` recipes by jittering copies of it."""
+    rng = random.Random(seed)
+    recipes = list(base_recipes[:size])
+    while len(recipes) < size:
+        r = rng.choice(base_recipes)
+        recipes.append(replace(
+            r,
+            id=f"{r.id}_s{len(recipes)}",
+            cout_portion_euro=round(r.cout_portion_euro * rng.uniform(0.8, 1.2), 2),
+            co2_kg_portion=round(r.co2_kg_portion * rng.uniform(0.8, 1.2), 3),
+        ))
+    return recipes
+
+
+print(f"{'recettes':>8} | {'jours':>5} | {'variables':>9} | {'contraintes':>11} | {'build':>10}")
+for size in [int(v) for v in args.tailles.split(",")]:
+    recipes = synthetic_catalog(size)
+    for nb_jours in [int(v) for v in args.jours.split(",")]:
+        config = CanteenConfig(
+            nom='Bench School',
+            budget_max_par_repas=2.50,
+            nb_jours=nb_jours,
+            convives=[ConviveProfile(label='Elementaire', age_min=6, age_max=11, effectif=100, grammages={})],
+            priorite_carbone=0.3,
+            priorite_local=0.3,
+            priorite_budget=0.4
+        )
+        solver = MenuSolver(config, recipes, gemrcn)
+        t0 = time.perf_counter()
+        solver.build_model()
+        elapsed = time.perf_counter() - t0
+        proto = solver.model.Proto()
+        print(f"{size:>8} | {nb_jours:>5} | {len(proto.variables):>9} | {len(proto.constraints):>11} | "
+              f"{elapsed * 1000:>7.0f} ms", flush=True)
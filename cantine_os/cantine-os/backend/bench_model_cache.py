@@ -0,0 +1,64 @@
+"""Benchmark: model build time with and without the solver ModelCache"""
+import sys
+import json
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.solver import load_recipes, MenuSolver, CanteenConfig, ConviveProfile, ModelCache
+
+# Load data
+data_dir = Path(__file__).parent.parent / 'data'
+recipes = load_recipes(data_dir / 'recettes.json')
+
+with open(data_dir / 'gemrcn_constraints.json', 'r', encoding='utf-8') as f:
+    gemrcn = json.load(f)
+
+# Same canteen, the manager only moves the sliders / budget between requests
+requests = [
+    (2.50, 0.4, 0.3, 0.3),
+    (2.50, 0.2, 0.5, 0.3),
+    (2.40, 0.6, 0.2, 0.2),
+    (2.60, 0.3, 0.3, 0.4),
+    (2.50, 0.1, 0.8, 0.1),
+]
+
+
+def make_config(nb_jours, budget, p_budget, p_carbone, p_local):
+    return CanteenConfig(
+        nom='Bench School',
+        budget_max_par_repas=budget,
+        nb_jours=nb_jours,
+        convives=[ConviveProfile(label='Elementaire', age_min=6, age_max=11, effectif=100, grammages={})],
+        priorite_carbone=p_carbone,
+        priorite_local=p_local,
+        priorite_budget=p_budget
+    )
+
+
+def run(nb_jours, cache):
+    build_time = 0.0
+    total_time = 0.0
+    for budget, p_budget, p_carbone, p_local in requests:
+        config = make_config(nb_jours, budget, p_budget, p_carbone, p_local)
+        t0 = time.perf_counter()
+        solver = MenuSolver(config, recipes, gemrcn, model_cache=cache, catalog_version='bench')
+        solver.build_model()
+        build_time += time.perf_counter() - t0
+        solver.solve(max_time_in_seconds=2.0)
+        total_time += time.perf_counter() - t0
+    return build_time, total_time
+
+
+results = []
+for nb_jours in (5, 20):
+    cold_build, cold_total = run(nb_jours, cache=None)
+    warm_build, warm_total = run(nb_jours, cache=ModelCache())
+    results.append((nb_jours, cold_build, cold_total, warm_build, warm_total))
+
+print("\n=== Model build time over %d requests ===" % len(requests))
+print(f"{'jours':>5} | {'build (no cache)':>16} | {'build (cache)':>13} | {'total (no cache)':>16} | {'total (cache)':>13}")
+for nb_jours, cold_build, cold_total, warm_build, warm_total in results:
+    print(f"{nb_jours:>5} | {cold_build * 1000:>13.1f} ms | {warm_build * 1000:>10.1f} ms | "
+          f"{cold_total * 1000:>13.1f} ms | {warm_total * 1000:>10.1f} ms")
@@ -0,0 +1,48 @@
+"""Benchmark: portfolio solve (CP-SAT vs local-search heuristic) across latency budgets"""
+import sys
+import json
+import argparse
+import contextlib
+import io
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.solver import load_recipes, MenuSolver, CanteenConfig, ConviveProfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--latences", default="100,300,1000,3000", help="Latency budgets (ms)")
+parser.add_argument("--jours", default="5,20,60", help="Horizons (days)")
+args = parser.parse_args()
+
+# Load data
+data_dir = Path(__file__).parent.parent / 'data'
+recipes = load_recipes(data_dir / 'recettes.json')
+
+with open(data_dir / 'gemrcn_constraints.json', 'r', encoding='utf-8') as f:
+    gemrcn = json.load(f)
+
+print(f"{'jours':>5} | {'latence':>7} | {'moteur':>11} | {'objectif':>9} | {'cp-sat':>9} | "
+      f"{'heuristique':>11} | {'écart':>7} | {'temps':>8}")
+for nb_jours in [int(v) for v in args.jours.split(",")]:
+    for latency in [int(v) for v in args.latences.split(",")]:
+        config = CanteenConfig(
+            nom='Bench School',
+            budget_max_par_repas=2.60,
+            nb_jours=nb_jours,
+            convives=[ConviveProfile(label='Elementaire', age_min=6, age_max=11, effectif=100, grammages={})],
+            priorite_carbone=0.3,
+            priorite_local=0.3,
+            priorite_budget=0.4
+        )
+        solver = MenuSolver(config, recipes, gemrcn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            menu = solver.solve_portfolio(latency_ms=latency)
+        if menu is None:
+            print(f"{nb_jours:>5} | {latency:>5} ms | {'-':>11} | aucun menu dans le délai")
+            continue
+        p = menu["portefeuille"]
+        gap = f"{p['ecart_optimalite_pct']:.1f}%" if p["ecart_optimalite_pct"] is not None else "-"
+        print(f"{nb_jours:>5} | {latency:>5} ms | {p['moteur']:>11} | {p['objectif']:>9} | "
+              f"{str(p['objectif_cp_sat']):>9} | {str(p['objectif_heuristique']):>11} | {gap:>7} | "
+              f"{p['temps_ms']:>5.0f} ms", flush=True)
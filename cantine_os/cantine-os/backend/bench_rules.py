@@ -0,0 +1,44 @@
+"""Benchmark: compiling the GEMRCN rules to bitsets, cold (new catalog) and per request (cached)"""
+import sys
+import json
+import time
+import argparse
+from dataclasses import replace
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.solver import load_recipes, COMPONENTS
+from app.rules import compile_rules
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--copies", type=int, default=1, help="Catalog replicated N times (new ids)")
+parser.add_argument("--repeat", type=int, default=1000)
+args = parser.parse_args()
+
+# Load data
+data_dir = Path(__file__).parent.parent / 'data'
+catalog = load_recipes(data_dir / 'recettes.json')
+recipes = [replace(r, id=f"{r.id}_{k}") if k else r for k in range(args.copies) for r in catalog]
+
+with open(data_dir / 'gemrcn_constraints.json', 'r', encoding='utf-8') as f:
+    gemrcn = json.load(f)
+
+t0 = time.perf_counter()
+index = compile_rules(gemrcn, recipes, COMPONENTS)
+cold = time.perf_counter() - t0
+
+# Per request: cached index, then the rule bitsets of the solve's recipes
+subset = recipes[::2]
+t0 = time.perf_counter()
+for _ in range(args.repeat):
+    index = compile_rules(gemrcn, recipes, COMPONENTS)
+    available = index.bits_of(subset)
+    masks = [bits & available for bits in index.rule_bits]
+warm = (time.perf_counter() - t0) / args.repeat
+
+print(f"{len(recipes)} recettes, {len(index.rules)} règles, {len(index.tag_bits)} tags")
+print(f"Compilation (nouveau catalogue): {cold * 1e6:.0f} µs")
+print(f"Par requête (index en cache):    {warm * 1e6:.1f} µs")
+for rule, bits in zip(index.rules, masks):
+    print(f"  {rule.family:<28} {bin(bits).count('1'):>6} recettes")
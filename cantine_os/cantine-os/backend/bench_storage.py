@@ -0,0 +1,50 @@
+"""Benchmark: latency of a stock movement as the history grows, JSON files vs SQLite"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.storage import JsonStorage, SqliteStorage, migrate
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--mouvements", default="1000,10000,100000", help="History sizes")
+parser.add_argument("--stocks", type=int, default=200)
+parser.add_argument("--ecritures", type=int, default=50, help="Movements recorded per measure")
+args = parser.parse_args()
+
+
+def record_movement(storage, stock_id: str, n: int):
+    """What POST /api/stocks/{id}/mouvement does."""
+    with storage.transaction():
+        stock = storage.get("stocks", stock_id)
+        stock["quantite_actuelle"] += 1
+        storage.put("stocks", stock)
+        storage.add("mouvements", {"id": f"mvt_bench_{n}", "stock_id": stock_id, "type": "entree",
+                                   "quantite": 1, "date": "2024-12-16", "motif": "bench"})
+
+
+print(f"{'mouvements':>10} | {'stockage':>8} | {'écriture':>10} | {'historique stock':>16}")
+for size in [int(v) for v in args.mouvements.split(",")]:
+    data_dir = Path(tempfile.mkdtemp())
+    stocks = [{"id": f"stock_{i:05d}", "produit_nom": f"Produit {i}", "quantite_actuelle": 0,
+               "fournisseur_id": f"f{i % 20:03d}"} for i in range(args.stocks)]
+    mouvements = [{"id": f"mvt_{i:07d}", "stock_id": f"stock_{i % args.stocks:05d}", "type": "entree",
+                   "quantite": 1, "date": "2024-12-01", "motif": ""} for i in range(size)]
+    with open(data_dir / "stocks.json", "w", encoding="utf-8") as f:
+        json.dump({"stocks": stocks, "mouvements": mouvements, "meta": {}}, f, indent=4)
+    migrate(data_dir)
+
+    for label, storage in (("json", JsonStorage(data_dir)), ("sqlite", SqliteStorage(data_dir / "cantine.db"))):
+        t0 = time.perf_counter()
+        for n in range(args.ecritures):
+            record_movement(storage, f"stock_{n % args.stocks:05d}", n)
+        write = (time.perf_counter() - t0) / args.ecritures
+        t0 = time.perf_counter()
+        for n in range(args.ecritures):
+            storage.find("mouvements", stock_id=f"stock_{n % args.stocks:05d}")
+        lookup = (time.perf_counter() - t0) / args.ecritures
+        print(f"{size:>10} | {label:>8} | {write * 1000:>7.2f} ms | {lookup * 1000:>13.2f} ms", flush=True)
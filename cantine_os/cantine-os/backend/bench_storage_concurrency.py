@@ -0,0 +1,94 @@
+"""
+Stress benchmark: several processes, each with several threads, hammer the same
+data directory with the read-modify-write patterns of the API (rating
+submission, supplier product import, stock movements) and no write may be lost
+"""
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.storage import JsonStorage, SqliteStorage
+from app.ledger import StockLedger
+
+def open_backend(backend: str, data_dir: Path):
+    return SqliteStorage(data_dir / "cantine.db") if backend == "sqlite" else JsonStorage(data_dir)
+
+
+def worker(backend: str, data_dir: Path, p: int, threads: int, count: int):
+    storage = open_backend(backend, data_dir)
+    ledger = StockLedger(data_dir / "mouvements", fsync_every=16, compact_every=500)
+
+    def run(t: int):
+        for n in range(count):
+            # submit_rating: append to feedback.json
+            storage.add("ratings", {"id": f"rating_{p}_{t}_{n}", "menu_date": f"2024-12-{n % 5 + 16}",
+                                    "note_globale": n % 5 + 1})
+            # import_products_to_supplier: get, modify, put in a transaction
+            with storage.transaction():
+                supplier = storage.get("fournisseurs", "four_001")
+                supplier["produits"].append({"nom": f"produit_{p}_{t}_{n}"})
+                storage.put("fournisseurs", supplier)
+            # record_stock_movement: read the quantity, append the new one
+            with ledger.lock:
+                stock_id = f"stock_{n % 3}"
+                ledger.append(stock_id, {"type": "entree", "quantite": 1, "date": "2024-12-16", "motif": ""},
+                              ledger.quantity(stock_id, 0) + 1)
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    ledger.close()
+    print(f"  processus {p}: {getattr(storage, 'stats', {})}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processus", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--ecritures", type=int, default=100, help="Writes of each kind per thread")
+    args = parser.parse_args()
+
+    for backend in ["json", "sqlite"]:
+        data_dir = Path(tempfile.mkdtemp())
+        storage = open_backend(backend, data_dir)
+        storage.add("fournisseurs", {"id": "four_001", "nom": "Fournisseur test", "produits": []})
+        if backend == "sqlite":
+            storage.close()
+
+        total = args.processus * args.threads * args.ecritures
+        print(f"{backend}: {args.processus} processus x {args.threads} threads, {total} écritures de chaque type")
+        t0 = time.perf_counter()
+        processes = [multiprocessing.Process(target=worker, args=(backend, data_dir, p, args.threads, args.ecritures))
+                     for p in range(args.processus)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0, f"processus en échec ({process.exitcode})"
+        elapsed = time.perf_counter() - t0
+
+        storage = open_backend(backend, data_dir)
+        ratings = storage.all("ratings")
+        assert len(ratings) == total, f"{total - len(ratings)} notes perdues"
+        assert len({r["id"] for r in ratings}) == total
+        produits = storage.get("fournisseurs", "four_001")["produits"]
+        assert len(produits) == total, f"{total - len(produits)} produits perdus"
+        ledger = StockLedger(data_dir / "mouvements")
+        quantities = [ledger.quantity(f"stock_{i}", 0) for i in range(3)]
+        assert sum(quantities) == total, f"{total - sum(quantities)} mouvements perdus"
+        assert ledger.version() == total
+        assert len(ledger.history("stock_0")) == quantities[0]
+        print(f"  OK en {elapsed:.1f}s: {len(ratings)} notes, {len(produits)} produits, "
+              f"stocks {quantities} ({ledger.version()} mouvements)")
+
+
+if __name__ == "__main__":
+    main()
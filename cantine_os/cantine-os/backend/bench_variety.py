@@ -0,0 +1,73 @@
+"""Benchmark: model size of the variety windows, per-window constraints vs running counts"""
+import sys
+import json
+import time
+import argparse
+import contextlib
+import io
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.solver import load_recipes, MenuSolver, CanteenConfig, ConviveProfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--fenetres", default="5,10,20", help="Main dish repeat windows (days)")
+parser.add_argument("--jours", default="20,60,180", help="Horizons (days)")
+parser.add_argument("--desserts", action="store_true", help="Add the 'same dessert family at most twice a week' rule")
+args = parser.parse_args()
+
+# Load data
+data_dir = Path(__file__).parent.parent / 'data'
+recipes = load_recipes(data_dir / 'recettes.json')
+
+with open(data_dir / 'gemrcn_constraints.json', 'r', encoding='utf-8') as f:
+    gemrcn = json.load(f)
+
+
+def model_size(model):
+    """(variables, constraints, terms) of a built model."""
+    proto = model.Proto()
+    terms = 0
+    for i in range(len(proto.constraints)):
+        ct = proto.constraints[i]
+        # has_*() first: reading an unset oneof field would switch the constraint to it
+        if ct.has_linear():
+            terms += len(ct.linear.vars)
+        elif ct.has_at_most_one():
+            terms += len(ct.at_most_one.literals)
+        elif ct.has_exactly_one():
+            terms += len(ct.exactly_one.literals)
+        elif ct.has_bool_or():
+            terms += len(ct.bool_or.literals)
+        terms += len(ct.enforcement_literal)
+    return len(proto.variables), len(proto.constraints), terms
+
+
+print(f"{'fenetre':>7} | {'jours':>5} | {'encodage':>8} | {'variables':>9} | {'contraintes':>11} | "
+      f"{'termes':>7} | {'build':>8}")
+for window in [int(v) for v in args.fenetres.split(",")]:
+    rules = [{"composante": "plat_principal", "fenetre_jours": window}]
+    if args.desserts:
+        rules.append({"composante": "dessert", "par": "famille", "fenetre_jours": 5, "max": 2})
+    for nb_jours in [int(v) for v in args.jours.split(",")]:
+        for encoding in ("fenetres", "cumul", "auto"):
+            config = CanteenConfig(
+                nom='Bench School',
+                budget_max_par_repas=3.0,
+                nb_jours=nb_jours,
+                convives=[ConviveProfile(label='Elementaire', age_min=6, age_max=11, effectif=100, grammages={})],
+                priorite_carbone=0.3,
+                priorite_local=0.3,
+                priorite_budget=0.4,
+                variete=rules
+            )
+            solver = MenuSolver(config, recipes, gemrcn, prune_dominated=False)
+            solver.variety_encoding = encoding
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                solver.build_model()
+            elapsed = time.perf_counter() - t0
+            variables, constraints, terms = model_size(solver.model)
+            print(f"{window:>7} | {nb_jours:>5} | {encoding:>8} | {variables:>9} | {constraints:>11} | "
+                  f"{terms:>7} | {elapsed * 1000:>5.0f} ms", flush=True)
@@ -0,0 +1,63 @@
+"""
+FeedbackBuffer with several workers on one storage: each worker's scores
+must count the ratings the others stored, whatever their dates
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.storage import JsonStorage, SqliteStorage
+from app.feedback import FeedbackBuffer
+
+
+def check_two_workers(storage_a, storage_b):
+    a = FeedbackBuffer(storage_a, flush_interval=3600)
+    b = FeedbackBuffer(storage_b, flush_interval=3600)
+
+    # A rates D1 and D2, B rates D1 only
+    a.submit("2024-12-16", 5)
+    a.submit("2024-12-17", 4)
+    a.flush()
+    b.submit("2024-12-16", 1)
+    b.flush()
+    scores = storage_a.all("menu_scores")
+    assert scores["2024-12-16"]["total_ratings"] == 2, scores
+    assert scores["2024-12-16"]["score"] == 3.0, scores
+
+    # A's next batch only holds D2: its D1 totals must still include B's rating
+    a.submit("2024-12-17", 2)
+    a.flush()
+    result = a.submit("2024-12-16", 3)
+    assert result["total_ratings"] == 3, result
+    assert result["popularity_score"] == 3.0, result
+    a.flush()
+    scores = storage_b.all("menu_scores")
+    assert scores["2024-12-16"] == {**scores["2024-12-16"], "score": 3.0, "total_ratings": 3}, scores
+    assert scores["2024-12-17"]["total_ratings"] == 2, scores
+
+    # B catches up with the ratings A stored for both dates
+    b.flush()  # background tick with nothing queued
+    result = b.submit("2024-12-17", 5)
+    assert result["total_ratings"] == 3 and result["popularity_score"] == 3.67, result
+    b.flush()
+    assert storage_a.count("ratings") == 6
+    ids = [r["id"] for r in storage_a.all("ratings")]
+    assert len(set(ids)) == len(ids)
+
+
+def test_two_workers_json():
+    data_dir = Path(tempfile.mkdtemp())
+    check_two_workers(JsonStorage(data_dir), JsonStorage(data_dir))
+
+
+def test_two_workers_sqlite():
+    db_path = Path(tempfile.mkdtemp()) / "cantine.db"
+    check_two_workers(SqliteStorage(db_path), SqliteStorage(db_path))
+
+
+if __name__ == "__main__":
+    test_two_workers_json()
+    test_two_workers_sqlite()
+    print("OK")